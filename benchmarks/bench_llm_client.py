@@ -0,0 +1,108 @@
+# benchmarks/bench_llm_client.py
+#
+# LLM 编排压测：在进程内启动一个或多个 mock_llm_server，模拟多个配置会话并发调用 LLMClient.get_response_stream，
+# 报告每次调用的 TTFT / 总耗时分位数、整体吞吐 (calls/sec、tokens/sec) 以及错误数。不需要 GPU 或真实模型。
+#
+# 用法:
+#   python benchmarks/bench_llm_client.py                                   # 4 个会话 x 10 次调用，单端点
+#   python benchmarks/bench_llm_client.py --sessions 16 --endpoints 3       # 多端点路由
+#   python benchmarks/bench_llm_client.py --stop-after-json --ttft 0.5 --token-delay 0.005
+#   python benchmarks/bench_llm_client.py --fail-rate 0.2 --endpoints 2     # 故障注入 + 故障切换
+#   python benchmarks/bench_llm_client.py --base-url http://127.0.0.1:8089/v1  # 使用外部已启动的服务器
+
+import argparse
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm  # noqa: E402
+from mock_llm_server import MockOptions, start_mock_server  # noqa: E402
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_session(base_url: str, calls: int, stop_after_json: bool, results: List[Dict[str, Any]],
+                results_lock: threading.Lock):
+    client = llm.LLMClient(api_key="mock", model_name="mock-model", base_url=base_url,
+                           system_prompt="你是一个配置助手。", max_history_turns=0)
+    for call_index in range(calls):
+        for event_type, _ in client.get_response_stream(f"第 {call_index} 步：请给出下一步行动。", temperature=0.1,
+                                                       max_tokens=4096, stop_after_json=stop_after_json):
+            if event_type in ("stream_end", "error"):
+                break
+        with results_lock:
+            results.append(client.last_call_metrics or {})
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="LLMClient orchestration benchmark against a mock server")
+    arg_parser.add_argument("--sessions", type=int, default=4, help="并发的配置会话数 (线程)")
+    arg_parser.add_argument("--calls", type=int, default=10, help="每个会话的调用次数")
+    arg_parser.add_argument("--endpoints", type=int, default=1, help="启动的模拟端点数")
+    arg_parser.add_argument("--ttft", type=float, default=0.2)
+    arg_parser.add_argument("--token-delay", type=float, default=0.002)
+    arg_parser.add_argument("--jitter", type=float, default=0.2)
+    arg_parser.add_argument("--fail-rate", type=float, default=0.0)
+    arg_parser.add_argument("--drop-rate", type=float, default=0.0)
+    arg_parser.add_argument("--stop-after-json", action="store_true")
+    arg_parser.add_argument("--base-url", help="使用已运行的服务器 (逗号分隔多个)，不启动内置模拟服务器")
+    args = arg_parser.parse_args()
+
+    servers = []
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        urls = []
+        for index in range(args.endpoints):
+            options = MockOptions(ttft=args.ttft * (1 + index * 0.5), token_delay=args.token_delay,
+                                  jitter=args.jitter, fail_rate=args.fail_rate, drop_rate=args.drop_rate, seed=index)
+            server, _ = start_mock_server(options=options)
+            servers.append(server)
+            urls.append(f"http://127.0.0.1:{server.server_address[1]}/v1")
+        base_url = ",".join(urls)
+
+    results: List[Dict[str, Any]] = []
+    results_lock = threading.Lock()
+    threads = [threading.Thread(target=run_session,
+                                args=(base_url, args.calls, args.stop_after_json, results, results_lock))
+               for _ in range(args.sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ttfts = [r["ttft"] for r in results if r.get("ttft") is not None]
+    totals = [r["total_time"] for r in results if r.get("total_time") is not None]
+    deltas = sum(r.get("delta_count") or 0 for r in results)
+    errors = sum(1 for r in results if r.get("error"))
+    print(f"sessions={args.sessions} calls/session={args.calls} endpoints={len(base_url.split(','))} "
+          f"stop_after_json={args.stop_after_json}")
+    print(f"wall time: {elapsed:.2f}s  throughput: {len(results) / elapsed:.2f} calls/s, {deltas / elapsed:,.0f} deltas/s")
+    print(f"TTFT   p50={percentile(ttfts, 0.5) * 1000:8.1f} ms  p95={percentile(ttfts, 0.95) * 1000:8.1f} ms")
+    print(f"total  p50={percentile(totals, 0.5) * 1000:8.1f} ms  p95={percentile(totals, 0.95) * 1000:8.1f} ms")
+    print(f"errors: {errors}/{len(results)}")
+    endpoint_counts: Dict[str, int] = {}
+    for r in results:
+        endpoint_counts[r.get("endpoint") or "N/A"] = endpoint_counts.get(r.get("endpoint") or "N/A", 0) + 1
+    for endpoint, count in sorted(endpoint_counts.items()):
+        print(f"  {endpoint}: {count} calls")
+    for server in servers:
+        print(f"  mock :{server.server_address[1]} stats: {server.mock_stats.snapshot()}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# benchmarks/bench_output_reader.py
+#
+# 命令输出读取压测：用 Python 子进程模拟 `pip install -v` (大量逐行刷新的短行) 和 `conda create`
+# (含中文与 \r 进度条的输出，stdout / stderr 交替) 等"话多"的命令，比较旧的逐块读取方式
+# (select + read(256) + 每块单独 decode) 与 output_reader.ProcessOutputReader (selectors + 大缓冲区 +
+# 增量解码 + 合并) 的吞吐 (MB/s)、产出的块数 (即界面事件数) 以及解码出的替换字符数。
+#
+# 用法:
+#   python benchmarks/bench_output_reader.py                    # 默认每种负载 20 MB
+#   python benchmarks/bench_output_reader.py --mb 50 --repeat 3
+#   python benchmarks/bench_output_reader.py --workload conda_create
+
+import argparse
+import os
+import select
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, Iterator, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from output_reader import ProcessOutputReader  # noqa: E402
+
+# 子进程脚本：按目标字节数循环输出，每行都 flush，模拟未缓冲的命令行工具
+WORKLOAD_SCRIPTS: Dict[str, str] = {
+    "pip_verbose": r"""
+import sys
+target = int(sys.argv[1])
+out = sys.stdout.buffer
+written = 0
+i = 0
+while written < target:
+    line = (f"  Looking in indexes: https://pypi.org/simple, candidate package-{i} 1.{i % 97}.0 "
+            f"from https://files.pythonhosted.org/packages/ab/cd/package_{i}-1.0-py3-none-any.whl\n").encode()
+    out.write(line)
+    out.flush()
+    written += len(line)
+    i += 1
+""",
+    "conda_create": r"""
+import sys
+target = int(sys.argv[1])
+out, err = sys.stdout.buffer, sys.stderr.buffer
+written = 0
+i = 0
+while written < target:
+    line = f"下载并解压软件包 pkg-{i} 依赖解析中… 版本 {i % 13}.{i % 7} ✓\n".encode("utf-8")
+    out.write(line)
+    out.flush()
+    bar = f"\rpkg-{i % 50:<3} | {'#' * (i % 40):<40} | {i % 101:3d}% ".encode("utf-8")
+    err.write(bar)
+    err.flush()
+    written += len(line) + len(bar)
+    i += 1
+""",
+}
+
+
+def legacy_reader(process: subprocess.Popen, encoding: str = "utf-8",
+                  errors: str = "replace") -> Iterator[Tuple[str, str]]:
+    # 旧实现：select(0.05) + read(256)，每块独立 decode (多字节字符可能被切断成替换字符)
+    import fcntl
+    streams = {}
+    for stream_type, pipe in (("stdout", process.stdout), ("stderr", process.stderr)):
+        fcntl.fcntl(pipe.fileno(), fcntl.F_SETFL, os.O_NONBLOCK)
+        streams[pipe.fileno()] = (stream_type, pipe)
+    active = list(streams)
+    while active:
+        readable, _, _ = select.select(active, [], [], 0.05)
+        for fd in readable:
+            stream_type, pipe = streams[fd]
+            try:
+                data = pipe.read(256)
+            except BlockingIOError:
+                continue
+            if data:
+                yield stream_type, data.decode(encoding, errors)
+            else:
+                active.remove(fd)
+
+
+def new_reader(process: subprocess.Popen) -> Iterator[Tuple[str, str]]:
+    return iter(ProcessOutputReader(process, "utf-8", "replace"))
+
+
+def run_once(workload: str, target_bytes: int,
+             reader: Callable[[subprocess.Popen], Iterator[Tuple[str, str]]]) -> Dict[str, float]:
+    process = subprocess.Popen([sys.executable, "-c", WORKLOAD_SCRIPTS[workload], str(target_bytes)],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    started = time.perf_counter()
+    chunks = 0
+    chars = 0
+    replacements = 0
+    for _, text in reader(process):
+        chunks += 1
+        chars += len(text)
+        replacements += text.count("�")
+    process.wait()
+    elapsed = time.perf_counter() - started
+    return {"seconds": elapsed, "chunks": chunks, "chars": chars, "replacements": replacements}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Process output reader throughput benchmark")
+    arg_parser.add_argument("--mb", type=float, default=20.0, help="每次运行子进程输出的数据量 (MB)")
+    arg_parser.add_argument("--repeat", type=int, default=1)
+    arg_parser.add_argument("--workload", choices=sorted(WORKLOAD_SCRIPTS), action="append",
+                            help="只运行指定负载 (可重复)，默认全部")
+    args = arg_parser.parse_args()
+
+    target_bytes = int(args.mb * 1024 * 1024)
+    readers = [("legacy", legacy_reader), ("selectors", new_reader)]
+    if os.name == "nt":
+        readers = readers[1:]  # 旧实现依赖 fcntl/select，Windows 上只测新实现的线程路径
+    for workload in args.workload or sorted(WORKLOAD_SCRIPTS):
+        print(f"workload={workload} size={args.mb:.1f} MB")
+        for name, reader in readers:
+            for _ in range(args.repeat):
+                result = run_once(workload, target_bytes, reader)
+                print(f"  {name:<10} {args.mb / result['seconds']:8.1f} MB/s  {result['seconds']:6.2f}s  "
+                      f"chunks={result['chunks']:<8} replacement_chars={result['replacements']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# benchmarks/bench_sse_parser.py
+#
+# SSE 解析微基准：对比旧的逐行解析路径 (iter_lines -> decode -> startswith -> 切片 -> strip -> json.loads)
+# 与 sse_parser.SSEParser 增量解析 (字节缓冲 -> 按事件边界整段解码 -> loads_payload) 的 events/sec。
+# 分别报告 "仅分帧" (不含 JSON 解析，衡量解析器本身的开销) 和 "分帧 + JSON 解析" (端到端) 两组数据。
+#
+# 用法:
+#   python benchmarks/bench_sse_parser.py                       # 使用合成的 12k token 流
+#   python benchmarks/bench_sse_parser.py --stream recorded.sse # 使用录制的原始 SSE 字节流
+#   python benchmarks/bench_sse_parser.py --record recorded.sse # 把合成流写入文件，便于复用
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Iterator, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse_parser import SSEParser, loads_payload  # noqa: E402
+
+SAMPLE_TOKENS = ["<think>", "用户", "需要", "配置", " conda", " 环境", "，", "先", "读取", " requirements",
+                 ".txt", "。", "</think>", "{\"", "thought", "_summary", "\":", " \"", "安装", "依赖", "\",",
+                 " \"commands", "_to_execute", "\":", " [", "{\"", "command_line", "\":", " \"conda", " run",
+                 " -n", " proj_env", " python", " -m", " pip", " install", " -r", " requirements.txt", "\"}", "]}"]
+
+
+def build_recorded_stream(num_tokens: int, line_ending: bytes = b"\n", seed: int = 0) -> bytes:
+    """生成与 OpenAI 兼容服务器 (LM Studio / llama.cpp) 格式一致的流，每个 token 一个事件。"""
+    rng = random.Random(seed)
+    parts: List[bytes] = []
+    created = int(time.time())
+    for i in range(num_tokens):
+        chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created,
+                 "model": "deepseek-r1-0528-qwen3-8b", "system_fingerprint": "bench",
+                 "choices": [{"index": 0, "delta": {"content": rng.choice(SAMPLE_TOKENS)},
+                              "logprobs": None, "finish_reason": None}]}
+        parts.append(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + line_ending + line_ending)
+    parts.append(b'data: {"choices":[{"index":0,"delta":{},"finish_reason":"stop"}]}' + line_ending + line_ending)
+    parts.append(b"data: [DONE]" + line_ending + line_ending)
+    return b"".join(parts)
+
+
+def iter_network_chunks(stream: bytes, seed: int = 1) -> Iterator[bytes]:
+    # 模拟网络读取：块大小随机，事件会被切在任意位置
+    rng = random.Random(seed)
+    pos = 0
+    while pos < len(stream):
+        size = rng.randint(64, 4096)
+        yield stream[pos:pos + size]
+        pos += size
+
+
+def legacy_iter_lines(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    # 与 requests.Response.iter_lines() 相同的按行切分逻辑
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        yield from lines
+    if pending is not None:
+        yield pending
+
+
+def run_legacy(chunks: List[bytes], decode_json: bool = True) -> int:
+    events = 0
+    for line in legacy_iter_lines(iter(chunks)):
+        if line:
+            decoded_line = line.decode('utf-8', errors='replace')
+            if decoded_line.startswith('data: '):
+                json_str = decoded_line[len('data: '):].strip()
+                if json_str == "[DONE]":
+                    break
+                if not json_str:
+                    continue
+                if decode_json:
+                    json.loads(json_str)
+                events += 1
+    return events
+
+
+def run_incremental(chunks: List[bytes], decode_json: bool = True) -> int:
+    events = 0
+    parser = SSEParser()
+    for chunk in chunks:
+        for payload in parser.feed(chunk):
+            if SSEParser.is_done_marker(payload):
+                return events
+            if decode_json:
+                loads_payload(payload)
+            events += 1
+    return events
+
+
+def bench(name: str, func, chunks: List[bytes], repeat: int) -> float:
+    best = float("inf")
+    events = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        events = func(chunks)
+        best = min(best, time.perf_counter() - start)
+    rate = events / best if best > 0 else float("inf")
+    print(f"{name:<24} events={events:<7} best={best * 1000:8.2f} ms  {rate:12,.0f} events/sec")
+    return rate
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="SSE parser micro-benchmark")
+    arg_parser.add_argument("--tokens", type=int, default=12000, help="合成流的 token 数 (默认 12000，对应 MAX_LLM_OUTPUT_TOKENS)")
+    arg_parser.add_argument("--stream", help="录制的原始 SSE 字节流文件")
+    arg_parser.add_argument("--record", help="把合成流写入该文件后退出")
+    arg_parser.add_argument("--crlf", action="store_true", help="合成流使用 CRLF 行结束符")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    if args.stream:
+        with open(args.stream, "rb") as f:
+            stream = f.read()
+    else:
+        stream = build_recorded_stream(args.tokens, b"\r\n" if args.crlf else b"\n")
+    if args.record:
+        with open(args.record, "wb") as f:
+            f.write(stream)
+        print(f"已写入 {len(stream)} 字节到 {args.record}")
+        return
+
+    chunks = list(iter_network_chunks(stream))
+    print(f"stream: {len(stream) / 1024:.1f} KiB in {len(chunks)} network chunks")
+    print("-- framing only --")
+    legacy_rate = bench("legacy iter_lines", lambda c: run_legacy(c, decode_json=False), chunks, args.repeat)
+    incremental_rate = bench("incremental SSEParser", lambda c: run_incremental(c, decode_json=False), chunks,
+                             args.repeat)
+    print(f"speedup: {incremental_rate / legacy_rate:.2f}x")
+    print("-- framing + JSON decode --")
+    legacy_rate = bench("legacy iter_lines", run_legacy, chunks, args.repeat)
+    incremental_rate = bench("incremental SSEParser", run_incremental, chunks, args.repeat)
+    print(f"speedup: {incremental_rate / legacy_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
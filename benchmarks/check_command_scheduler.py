@@ -0,0 +1,62 @@
+# benchmarks/check_command_scheduler.py
+#
+# command_scheduler.classify_command 的自检：列出有代表性的命令及其应属的类别 (read / fetch / barrier)。
+# 被误判为 read 的命令可能与其他命令并行或被调整顺序，因此重点覆盖"看起来只读、实际会执行或修改"的命令。
+# 全部通过时退出码为 0。
+#
+# 用法:
+#   python benchmarks/check_command_scheduler.py
+
+import os
+import sys
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from command_scheduler import (COMMAND_KIND_BARRIER, COMMAND_KIND_FETCH, COMMAND_KIND_READ,  # noqa: E402
+                               classify_command)
+
+CASES: List[Tuple[str, str]] = [
+    # 查询版本 / 帮助
+    ("python --version", COMMAND_KIND_READ),
+    ("python -V", COMMAND_KIND_READ),
+    ("gcc -v", COMMAND_KIND_READ),
+    ("nvcc --version", COMMAND_KIND_READ),
+    ("conda run -n env python --version", COMMAND_KIND_READ),
+    # -v 在多数程序中表示 verbose：python -v 会启动解释器，不能当作版本查询
+    ("python -v", COMMAND_KIND_BARRIER),
+    ("python3.10 -v", COMMAND_KIND_BARRIER),
+    ("conda run -n env python -v", COMMAND_KIND_BARRIER),
+    ("node -v script.js", COMMAND_KIND_BARRIER),
+    ("make -v", COMMAND_KIND_BARRIER),
+    # 只读的程序与子命令
+    ("ls -la", COMMAND_KIND_READ),
+    ("cat requirements.txt", COMMAND_KIND_READ),
+    ("git status", COMMAND_KIND_READ),
+    ("pip list", COMMAND_KIND_READ),
+    ("python -m pip show torch", COMMAND_KIND_READ),
+    ("conda env list", COMMAND_KIND_READ),
+    ("pip download -d wheels torch", COMMAND_KIND_FETCH),
+    # 会修改环境或文件
+    ("find . -name '*.pyc' -delete", COMMAND_KIND_BARRIER),
+    ("pip install -r requirements.txt", COMMAND_KIND_BARRIER),
+    ("conda create -n env python=3.10 -y", COMMAND_KIND_BARRIER),
+    ("echo hi > out.txt", COMMAND_KIND_BARRIER),
+    ("cat a | tee b", COMMAND_KIND_BARRIER),
+    ("python setup.py develop", COMMAND_KIND_BARRIER),
+]
+
+
+def main() -> int:
+    failures = 0
+    for command, expected in CASES:
+        actual = classify_command(command)
+        ok = actual == expected
+        failures += not ok
+        print(f"  [{'OK' if ok else 'FAIL'}] {command!r}: {actual}" + ("" if ok else f" (应为 {expected})"))
+    print("全部通过" if not failures else f"{failures} 项失败")
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
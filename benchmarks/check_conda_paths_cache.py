@@ -0,0 +1,108 @@
+# benchmarks/check_conda_paths_cache.py
+#
+# command_executor 的 Conda 路径缓存自检：每一步在独立的子进程中解析 Conda 路径 (与真实的进程启动一致)，
+# 使用临时的缓存文件和只含临时目录的 PATH，检查
+#   1. 没有找到 Conda 时不写缓存
+#   2. 之后把 Conda 放进 PATH，下次启动能找到它 (不会命中"没有 Conda"的旧结果) 并写入缓存
+#   3. 再次启动命中缓存，不重新探测
+#   4. 删除 Conda 后缓存失效
+# 只适用于非 Windows 平台。全部通过时退出码为 0。
+#
+# 用法:
+#   python benchmarks/check_conda_paths_cache.py
+#   python benchmarks/check_conda_paths_cache.py --keep      # 保留临时目录便于排查
+
+import argparse
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子进程：解析 Conda 路径，输出结果和是否重新探测过 (探测时会打印 "--- Final Deduced Paths ---")
+RESOLVE_SCRIPT = r"""
+import json, command_executor
+command_executor.ensure_conda_paths()
+print("RESULT " + json.dumps({"exe": command_executor.CONDA_EXE_PATH, "root": command_executor.CONDA_ROOT_PATH}))
+"""
+
+
+def resolve(root: str, path_dirs: List[str]) -> Tuple[Dict[str, Optional[str]], bool]:
+    env = {"PATH": os.pathsep.join(path_dirs), "HOME": root, "PYTHONPATH": PACKAGE_DIR,
+           "CONDA_PATHS_CACHE_FILE": os.path.join(root, "cache", "conda_paths.json")}
+    result = subprocess.run([sys.executable, "-c", RESOLVE_SCRIPT], cwd=root, env=env, capture_output=True,
+                            text=True, check=True)
+    line = next(l for l in result.stdout.splitlines() if l.startswith("RESULT "))
+    return json.loads(line[len("RESULT "):]), "Final Deduced Paths" in result.stdout
+
+
+def make_fake_conda(conda_root: str) -> str:
+    # shutil.which("conda.exe") 在所有平台上都会查找这个名字；conda-meta 让路径推导认定 conda_root 是 base 前缀
+    os.makedirs(os.path.join(conda_root, "bin"))
+    os.makedirs(os.path.join(conda_root, "conda-meta"))
+    conda_exe = os.path.join(conda_root, "bin", "conda.exe")
+    with open(conda_exe, "w", encoding="utf-8") as f:
+        f.write("#!/bin/sh\necho fake conda\n")
+    os.chmod(conda_exe, os.stat(conda_exe).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return conda_exe
+
+
+def check(condition: bool, message: str, failures: List[str]) -> None:
+    print(f"  [{'OK' if condition else 'FAIL'}] {message}")
+    if not condition:
+        failures.append(message)
+
+
+def run_checks(root: str) -> List[str]:
+    failures: List[str] = []
+    cache_file = os.path.join(root, "cache", "conda_paths.json")
+    empty_bin = os.path.join(root, "empty-bin")
+    os.makedirs(empty_bin)
+    conda_root = os.path.join(root, "conda")
+    conda_bin = os.path.join(conda_root, "bin")
+
+    paths, probed = resolve(root, [empty_bin])
+    check(paths["exe"] is None and probed, "PATH 中没有 Conda：探测结果为空", failures)
+    check(not os.path.exists(cache_file), "没有找到 Conda 时不写缓存", failures)
+
+    conda_exe = make_fake_conda(conda_root)
+    paths, probed = resolve(root, [empty_bin, conda_bin])
+    check(probed and paths["exe"] == conda_exe and paths["root"] == conda_root,
+          "Conda 加入 PATH 后重新探测并找到它", failures)
+    check(os.path.isfile(cache_file), "找到 Conda 后写入缓存", failures)
+
+    paths, probed = resolve(root, [empty_bin, conda_bin])
+    check(not probed and paths["exe"] == conda_exe, "再次启动命中缓存，不重新探测", failures)
+
+    shutil.rmtree(conda_root)
+    paths, probed = resolve(root, [empty_bin, conda_bin])
+    check(probed and paths["exe"] is None, "删除 Conda 后缓存失效并重新探测", failures)
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Conda 路径缓存自检")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    args = parser.parse_args()
+    if os.name == "nt":
+        print("此自检只适用于非 Windows 平台。")
+        return 0
+    root = tempfile.mkdtemp(prefix="check-conda-cache-")
+    try:
+        failures = run_checks(root)
+    finally:
+        if args.keep:
+            print(f"临时目录: {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    print("全部通过" if not failures else f"{len(failures)} 项失败")
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# benchmarks/check_git_mirror.py
+#
+# git_mirror.GitMirrorCache 的自检脚本：在临时目录里建一个 file:// 源仓库，依次检查
+#   1. 三种克隆方式 (reference / shallow / partial) 都能得到正确的检出，origin 指向源仓库而不是镜像
+#   2. 第二次克隆命中镜像缓存 (只 fetch，不再 clone --mirror)；每种模式都只在更新镜像时访问远程
+#   3. 源仓库有新提交、默认分支改名后，refresh_workspace 能把工作区更新到新的默认分支并清掉未跟踪文件
+# 只依赖本机的 git，不访问网络。全部通过时退出码为 0。
+#
+# 用法:
+#   python benchmarks/check_git_mirror.py
+#   python benchmarks/check_git_mirror.py --keep      # 保留临时目录便于排查
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from git_mirror import GIT_CLONE_MODES, GitMirrorCache, _file_url, mirror_path_for_url, run_git_command  # noqa: E402
+
+
+def git(args: List[str], cwd: str) -> str:
+    result = subprocess.run(["git", "-c", "user.name=check", "-c", "user.email=check@localhost"] + args,
+                            cwd=cwd, capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+def make_source_repo(path: str) -> None:
+    os.makedirs(path)
+    git(["init", "-q", "-b", "main"], path)
+    with open(os.path.join(path, "README.md"), "w", encoding="utf-8") as f:
+        f.write("v1\n")
+    git(["add", "README.md"], path)
+    git(["commit", "-q", "-m", "v1"], path)
+
+
+class RecordingRunner:
+    # 记录 GitMirrorCache 执行的每条命令，用于检查缓存命中和访问远程的次数
+    def __init__(self):
+        self.commands: List[List[str]] = []
+
+    def __call__(self, command: List[str], cwd: Optional[str]) -> Dict[str, Any]:
+        self.commands.append(command)
+        return run_git_command(command, cwd)
+
+    def take(self) -> List[List[str]]:
+        commands, self.commands = self.commands, []
+        return commands
+
+
+def check(condition: bool, message: str, failures: List[str]) -> None:
+    print(f"  [{'OK' if condition else 'FAIL'}] {message}")
+    if not condition:
+        failures.append(message)
+
+
+def run_checks(root: str) -> List[str]:
+    failures: List[str] = []
+    source = os.path.join(root, "source")
+    make_source_repo(source)
+    source_url = _file_url(source)
+    runner = RecordingRunner()
+    cache = GitMirrorCache(os.path.join(root, "mirrors"), runner)
+    mirror_path = mirror_path_for_url(cache.cache_dir, source_url)
+
+    print("克隆:")
+    for index, mode in enumerate(GIT_CLONE_MODES):
+        workspace = os.path.join(root, f"ws-{mode}")
+        result = cache.prepare_workspace(source_url, workspace, mode)
+        commands = runner.take()
+        check(result.get("return_code") == 0 and result.get("workspace_strategy") == "cloned",
+              f"{mode}: prepare_workspace 克隆成功", failures)
+        check(os.path.isfile(os.path.join(workspace, "README.md")), f"{mode}: 检出了 README.md", failures)
+        check(git(["config", "--get", "remote.origin.url"], workspace) == source_url,
+              f"{mode}: origin 指向源仓库", failures)
+        mirror_clones = [c for c in commands if c[:3] == ["git", "clone", "--mirror"]]
+        check(len(mirror_clones) == (1 if index == 0 else 0),
+              f"{mode}: {'首次创建镜像' if index == 0 else '命中镜像缓存'}", failures)
+        # 只有更新镜像时访问远程，工作区从镜像克隆
+        workspace_clones = [c for c in commands if c[:2] == ["git", "clone"] and "--mirror" not in c]
+        check(len(workspace_clones) == 1 and _file_url(mirror_path) in workspace_clones[0] and
+              source_url not in workspace_clones[0], f"{mode}: 工作区从镜像克隆，不再访问远程", failures)
+    check(not os.path.exists(os.path.join(root, "ws-reference", ".git", "objects", "info", "alternates")),
+          "reference: 工作区不依赖镜像 (没有 alternates)", failures)
+
+    print("刷新:")
+    with open(os.path.join(source, "README.md"), "w", encoding="utf-8") as f:
+        f.write("v2\n")
+    git(["commit", "-q", "-am", "v2"], source)
+    git(["branch", "-m", "main", "trunk"], source)
+    workspace = os.path.join(root, "ws-reference")
+    with open(os.path.join(workspace, "scratch.txt"), "w", encoding="utf-8") as f:
+        f.write("leftover\n")
+    result = cache.prepare_workspace(source_url, workspace, "reference")
+    runner.take()
+    check(result.get("return_code") == 0 and result.get("workspace_strategy") == "refreshed",
+          "prepare_workspace 原地刷新", failures)
+    with open(os.path.join(workspace, "README.md"), encoding="utf-8") as f:
+        check(f.read() == "v2\n", "工作区更新到最新提交", failures)
+    check(git(["rev-parse", "--abbrev-ref", "HEAD"], workspace) == "trunk", "切换到改名后的默认分支", failures)
+    check(not os.path.exists(os.path.join(workspace, "scratch.txt")), "未跟踪文件被清除", failures)
+
+    shallow = os.path.join(root, "ws-shallow")
+    result = cache.prepare_workspace(source_url, shallow, "shallow")
+    check(result.get("workspace_strategy") == "refreshed" and
+          git(["rev-parse", "--abbrev-ref", "HEAD"], shallow) == "trunk",
+          "shallow: 只跟踪单个分支的浅克隆也能切换到改名后的默认分支", failures)
+    check(git(["rev-parse", "--is-shallow-repository"], shallow) == "true", "shallow: 刷新后仍是浅克隆", failures)
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="GitMirrorCache 自检 (本地 file:// 仓库)")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    args = parser.parse_args()
+    root = tempfile.mkdtemp(prefix="check-git-mirror-")
+    try:
+        failures = run_checks(root)
+    finally:
+        if args.keep:
+            print(f"临时目录: {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    print("全部通过" if not failures else f"{len(failures)} 项失败")
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
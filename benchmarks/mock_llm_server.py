@@ -0,0 +1,320 @@
+# benchmarks/mock_llm_server.py
+#
+# 本地模拟的 OpenAI 兼容流式推理服务器，用于在没有 GPU 机器的情况下对 LLMClient / main.py 的编排流程做压测。
+# 支持 POST /v1/chat/completions (stream=true 时为 SSE，否则返回完整 JSON)、GET /v1/models 和 GET /stats。
+#
+# 用法:
+#   python benchmarks/mock_llm_server.py --port 8089                              # 使用内置的示例行动JSON回复
+#   python benchmarks/mock_llm_server.py --script replies.jsonl --ttft 0.8 --token-delay 0.02
+#   python benchmarks/mock_llm_server.py --recorded recorded.sse                  # 按事件重放录制的原始 SSE 字节流
+#   python benchmarks/mock_llm_server.py --fail-rate 0.1 --drop-rate 0.05         # 注入 503 和流中途断开
+#   LMSTUDIO_BASE_URL=http://127.0.0.1:8089/v1 python main.py                     # 让主程序连接模拟服务器
+#
+# --script 文件每行一个 JSON：{"reply": "..."} 或 {"match": "子串", "reply": "..."}；
+# 带 match 的条目在最后一条用户消息包含该子串时使用，其余条目按顺序循环使用。
+
+import argparse
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_REPLY = (
+    "<think>用户需要为项目配置 conda 环境。先读取依赖文件，再安装依赖。</think>\n"
+    + json.dumps({
+        "thought_summary": "读取 requirements.txt 并安装依赖。",
+        "files_to_read": ["requirements.txt"],
+        "commands_to_execute": [
+            {"command_line": "conda run -n mock_env python -m pip install -r requirements.txt",
+             "description": "安装项目依赖"},
+        ],
+    }, ensure_ascii=False)
+    + "\n以上是本步的行动指令。"
+)
+
+# 把回复切成近似 token 的片段：中日韩文字逐字，英文单词带前导空格，其他符号逐个
+_TOKEN_RE = re.compile("[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]| ?[A-Za-z]+| ?[0-9]|\\s+|.", re.DOTALL)
+
+
+def split_tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text)
+
+
+class MockOptions:
+    def __init__(self, ttft: float = 0.2, token_delay: float = 0.01, jitter: float = 0.0,
+                 fail_rate: float = 0.0, fail_status: int = 503, drop_rate: float = 0.0,
+                 script: Optional[List[Dict[str, str]]] = None, recorded: Optional[bytes] = None,
+                 model: str = "mock-model", seed: Optional[int] = None, reject_response_format: bool = False,
+                 reasoning_field: bool = False):
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.drop_rate = drop_rate
+        self.model = model
+        self.reject_response_format = reject_response_format  # 模拟不支持结构化输出的旧服务器
+        self.reasoning_field = reasoning_field  # 像 vLLM / LM Studio 一样把 <think> 内容放在 delta.reasoning_content 中发送
+        self.recorded_events = self._split_recorded(recorded) if recorded else None
+        self._matchers = [entry for entry in (script or []) if entry.get("match")]
+        replies = [entry["reply"] for entry in (script or []) if not entry.get("match")]
+        self._replies = itertools.cycle(replies or [DEFAULT_REPLY])
+        self._lock = threading.Lock()
+        self.rng = random.Random(seed)
+
+    @staticmethod
+    def _split_recorded(recorded: bytes) -> List[bytes]:
+        normalized = recorded.replace(b"\r\n", b"\n")
+        return [event + b"\n\n" for event in normalized.split(b"\n\n") if event.strip()]
+
+    def pick_reply(self, messages: List[Dict[str, Any]]) -> str:
+        last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        for entry in self._matchers:
+            if entry["match"] in last_user:
+                return entry["reply"]
+        with self._lock:
+            return next(self._replies)
+
+    def chance(self, probability: float) -> bool:
+        if probability <= 0:
+            return False
+        with self._lock:
+            return self.rng.random() < probability
+
+    def delay(self, base: float) -> float:
+        if self.jitter <= 0:
+            return base
+        with self._lock:
+            return max(0.0, base * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "active": 0, "completed": 0, "failed_injected": 0, "dropped_injected": 0,
+                         "client_disconnects": 0, "tokens_sent": 0, "rejected_response_format": 0}
+
+    def add(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockLLM/1.0"
+
+    def log_message(self, format, *args):
+        pass  # 压测时每个请求打印一行会严重干扰结果
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass  # 客户端关闭了空闲的 keep-alive 连接
+
+    @property
+    def options(self) -> MockOptions:
+        return self.server.mock_options
+
+    @property
+    def stats(self) -> MockStats:
+        return self.server.mock_stats
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": self.options.model, "object": "model"}]})
+        elif self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.stats.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request_data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON body"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        self.stats.add("requests")
+        if self.options.reject_response_format and "response_format" in request_data:
+            self.stats.add("rejected_response_format")
+            self._send_json(400, {"error": {"message": "response_format is not supported"}})
+            return
+        if self.options.chance(self.options.fail_rate):
+            self.stats.add("failed_injected")
+            self._send_json(self.options.fail_status, {"error": {"message": "injected failure"}})
+            return
+        self.stats.add("active")
+        try:
+            if request_data.get("stream"):
+                self._stream_reply(request_data)
+            else:
+                self._complete_reply(request_data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.stats.add("client_disconnects")  # 客户端提前关闭了连接 (例如 stop_after_json)
+            self.close_connection = True
+        finally:
+            self.stats.add("active", -1)
+
+    def _reply_tokens(self, request_data: Dict[str, Any]) -> Tuple[List[str], str]:
+        tokens = split_tokens(self.options.pick_reply(request_data.get("messages") or []))
+        max_tokens = request_data.get("max_tokens")
+        if isinstance(max_tokens, int) and 0 < max_tokens < len(tokens):
+            return tokens[:max_tokens], "length"
+        return tokens, "stop"
+
+    def _delta_fields(self, tokens: List[str]) -> List[Tuple[str, str]]:
+        if not self.options.reasoning_field:
+            return [(token, "content") for token in tokens]
+        # 思考部分 (<think> ... </think>) 的 token 改用 reasoning_content 字段，标签本身不发送
+        text = "".join(tokens)
+        match = re.match(r"\s*<think>(.*?)(</think>|$)", text, re.DOTALL)
+        if not match:
+            return [(token, "content") for token in tokens]
+        return [(token, "reasoning_content") for token in split_tokens(match.group(1))] + \
+            [(token, "content") for token in split_tokens(text[match.end():])]
+
+    def _usage(self, request_data: Dict[str, Any], completion_tokens: int) -> Dict[str, int]:
+        prompt_chars = sum(len(m.get("content") or "") for m in request_data.get("messages") or [])
+        prompt_tokens = max(1, prompt_chars // 3)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _complete_reply(self, request_data: Dict[str, Any]):
+        tokens, finish_reason = self._reply_tokens(request_data)
+        time.sleep(self.options.delay(self.options.ttft) + self.options.token_delay * len(tokens))
+        self.stats.add("tokens_sent", len(tokens))
+        self.stats.add("completed")
+        self._send_json(200, {
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+            "model": self.options.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                         "finish_reason": finish_reason}],
+            "usage": self._usage(request_data, len(tokens)),
+        })
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _stream_reply(self, request_data: Dict[str, Any]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(self.options.delay(self.options.ttft))
+
+        if self.options.recorded_events is not None:
+            events = self.options.recorded_events
+            finish_reason = None
+        else:
+            tokens, finish_reason = self._reply_tokens(request_data)
+            events = []
+            created = int(time.time())
+            for token, field in self._delta_fields(tokens):
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created,
+                         "model": self.options.model,
+                         "choices": [{"index": 0, "delta": {field: token}, "finish_reason": None}]}
+                events.append(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+
+        drop_at = len(events) // 2 if self.options.chance(self.options.drop_rate) else -1
+        for index, event in enumerate(events):
+            if index == drop_at:
+                # 模拟推理服务器崩溃或网络中断：不发送结束块，直接断开连接
+                self.stats.add("dropped_injected")
+                self.close_connection = True
+                return
+            if index:
+                time.sleep(self.options.delay(self.options.token_delay))
+            self._write_chunk(event)
+        self.stats.add("tokens_sent", len(events))
+
+        if finish_reason is not None:
+            final_chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                           "model": self.options.model,
+                           "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+                           "usage": self._usage(request_data, len(events))}
+            self._write_chunk(b"data: " + json.dumps(final_chunk).encode("utf-8") + b"\n\n")
+            self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")  # 分块传输的结束块
+        self.stats.add("completed")
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, options: Optional[MockOptions] = None
+                      ) -> Tuple[ThreadingHTTPServer, threading.Thread]:
+    """在后台线程中启动模拟服务器；port=0 时由系统分配端口 (server.server_address[1])。"""
+    server = ThreadingHTTPServer((host, port), MockLLMHandler)
+    server.daemon_threads = True
+    server.mock_options = options or MockOptions()
+    server.mock_stats = MockStats()
+    thread = threading.Thread(target=server.serve_forever, name=f"mock-llm-{server.server_address[1]}", daemon=True)
+    thread.start()
+    return server, thread
+
+
+def load_script(path: str) -> List[Dict[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Mock OpenAI-compatible streaming server")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8089)
+    arg_parser.add_argument("--ttft", type=float, default=0.2, help="首 token 延迟 (秒)")
+    arg_parser.add_argument("--token-delay", type=float, default=0.01, help="相邻 token 之间的延迟 (秒)")
+    arg_parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机抖动比例，例如 0.3 表示 ±30%%")
+    arg_parser.add_argument("--fail-rate", type=float, default=0.0, help="直接返回错误状态码的请求比例")
+    arg_parser.add_argument("--fail-status", type=int, default=503)
+    arg_parser.add_argument("--drop-rate", type=float, default=0.0, help="流输出到一半时断开连接的请求比例")
+    arg_parser.add_argument("--script", help="脚本化回复 (JSON Lines 或 JSON 数组)")
+    arg_parser.add_argument("--recorded", help="录制的原始 SSE 字节流，按事件重放")
+    arg_parser.add_argument("--model", default="mock-model")
+    arg_parser.add_argument("--seed", type=int)
+    arg_parser.add_argument("--reject-response-format", action="store_true", help="对带 response_format 的请求返回 400")
+    arg_parser.add_argument("--reasoning-field", action="store_true", help="思考内容通过 delta.reasoning_content 发送")
+    args = arg_parser.parse_args()
+
+    recorded = None
+    if args.recorded:
+        with open(args.recorded, "rb") as f:
+            recorded = f.read()
+    options = MockOptions(ttft=args.ttft, token_delay=args.token_delay, jitter=args.jitter,
+                          fail_rate=args.fail_rate, fail_status=args.fail_status, drop_rate=args.drop_rate,
+                          script=load_script(args.script) if args.script else None, recorded=recorded,
+                          model=args.model, seed=args.seed, reject_response_format=args.reject_response_format,
+                          reasoning_field=args.reasoning_field)
+    server, thread = start_mock_server(args.host, args.port, options)
+    print(f"Mock LLM server listening on http://{args.host}:{server.server_address[1]}/v1", file=sys.stderr)
+    try:
+        thread.join()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,24 @@
 import subprocess
 import os
+import atexit
+import codecs
+import json
 import shutil
 import shlex
 import tempfile
 import platform
-import select
+import re
+import selectors
+import signal
 import threading
-import queue
-from typing import List, Dict, Union, Iterator, Tuple, Optional, Any
+import time
+from types import MappingProxyType
+from typing import List, Dict, Union, Iterator, Tuple, Optional, Any, Mapping
 
-# Conditional import for fcntl
-if platform.system() != "Windows":
-    try:
-        import fcntl
-    except ImportError:
-        print(
-            "[WARN] command_executor: fcntl module not found, non-blocking pipe reads might be limited on this Unix-like system.")
-        fcntl = None  # type: ignore
-else:
-    fcntl = None  # type: ignore
+import git_mirror
+from output_reader import ProcessOutputReader, process_has_exited
 
-# --- Globals, find_and_set_conda_paths, get_clean_env_for_conda, _threaded_read_pipe ---
+# --- Globals, find_and_set_conda_paths, get_clean_env_for_conda ---
 # (These functions remain the same as the previous version where get_clean_env_for_conda
 # was replaced with your original more restrictive version)
 
@@ -35,11 +33,108 @@ ANACONDA_BASE_PATH: Optional[str] = None
 END_OF_COMMAND_MARKER = f"__EOC_MARKER__{os.urandom(8).hex()}__"
 RETURN_CODE_MARKER_PREFIX = "__RC_MARKER__:"
 
+# 把 `conda run -n <env> python/pip ...` 改写为直接执行环境中的解释器 (最快)，其次才使用常驻 shell
+CONDA_RUN_BYPASS = os.environ.get("CONDA_RUN_BYPASS", "1").lower() not in ("0", "false", "no")
+# 为 `conda run -n <env> ...` 保留每个环境一个已激活的常驻 shell，避免每条命令都付出 conda run 的启动开销 (仅 Unix)
+PERSISTENT_CONDA_SHELL = os.environ.get("PERSISTENT_CONDA_SHELL", "1").lower() not in ("0", "false", "no")
+PERSISTENT_SHELL_START_TIMEOUT = float(os.environ.get("PERSISTENT_SHELL_START_TIMEOUT", "60"))
+# conda run 的选项：不带值的可以忽略，带值的需要解析；出现其他选项时回退到真正的 conda run
+CONDA_RUN_FLAG_OPTIONS = ("--no-capture-output", "--live-stream", "-v", "--verbose", "--dev", "--debug-wrapper-scripts")
+CONDA_RUN_VALUE_OPTIONS = ("-n", "--name", "-p", "--prefix", "--cwd")
+# 命令监控 (秒，0 表示不限制)：总时长上限、连续无输出时长上限 (conda 求解依赖时可能长时间没有输出，默认值留足余量)。
+# 超时后先向命令的整个进程组发送 TERM，等待 COMMAND_KILL_GRACE_SECONDS 后仍未退出则 KILL
+COMMAND_TIMEOUT_SECONDS = float(os.environ.get("COMMAND_TIMEOUT_SECONDS", "3600"))
+COMMAND_IDLE_TIMEOUT_SECONDS = float(os.environ.get("COMMAND_IDLE_TIMEOUT_SECONDS", "900"))
+COMMAND_KILL_GRACE_SECONDS = float(os.environ.get("COMMAND_KILL_GRACE_SECONDS", "5"))
+COMMAND_TIMEOUT_RETURN_CODE = -124
+
+# Conda 路径探测结果的缓存文件。探测需要多次 shutil.which 和文件系统检查，结果在 Conda 安装不变时是稳定的。
+# 缓存不跟踪 PATH：要改用 PATH 中另一个 Conda，设置 CONDA_EXE 或删除此文件。没有找到 Conda 时不写缓存，下次启动重新探测
+CONDA_PATHS_CACHE_FILE = os.environ.get(
+    "CONDA_PATHS_CACHE_FILE", os.path.join(os.path.expanduser('~'), ".agentic_env_setup", "conda_paths.json"))
+CONDA_PATHS_CACHE_VERSION = 3
+CONDA_PATH_GLOBAL_NAMES = ("CONDA_EXE_PATH", "CONDA_BAT_PATH", "CONDA_ROOT_PATH", "CONDA_SCRIPTS_PATH",
+                           "CONDA_CONDABIN_PATH", "CONDA_LIBRARY_BIN_PATH", "ANACONDA_ACTIVATE_BAT_PATH",
+                           "ANACONDA_BASE_PATH")
+_conda_paths_resolved = False
+_conda_paths_lock = threading.Lock()
+
+
+def ensure_conda_paths():
+    """
+    首次需要 Conda 路径时才解析 (执行命令、构建命令环境)，而不是在导入模块时。
+    优先使用缓存文件：CONDA_EXE 环境变量、缓存中的 Conda 可执行文件和 base 前缀都未变化时直接采用 (不输出日志)，
+    否则重新探测并更新缓存。
+    """
+    global _conda_paths_resolved
+    if _conda_paths_resolved:
+        return
+    with _conda_paths_lock:
+        if _conda_paths_resolved:
+            return
+        cached_paths = _load_conda_paths_cache()
+        if cached_paths is not None:
+            _apply_conda_paths(cached_paths)
+        else:
+            find_and_set_conda_paths()
+        _conda_paths_resolved = True
+
+
+def _apply_conda_paths(paths: Dict[str, Optional[str]]):
+    for name in CONDA_PATH_GLOBAL_NAMES:
+        globals()[name] = paths.get(name)
+
+
+def _conda_cache_fingerprint(paths: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    # 只检查解析出的 Conda 可执行文件和 base 前缀 (各一次 stat)：Conda 被卸载、移动或重装时它们会消失或 mtime 变化。
+    # 缓存命中在每个进程启动时都会发生，不再逐个检查 PATH 中的目录
+    mtimes: Dict[str, Optional[float]] = {}
+    for name in ("CONDA_EXE_PATH", "CONDA_ROOT_PATH"):
+        try:
+            mtimes[name] = os.stat(paths[name]).st_mtime if paths.get(name) else None
+        except OSError:
+            mtimes[name] = None
+    return {"platform": platform.system(), "conda_exe_env": os.environ.get("CONDA_EXE"),
+            "conda_exe_path": paths.get("CONDA_EXE_PATH"), "conda_root_path": paths.get("CONDA_ROOT_PATH"),
+            "mtimes": mtimes}
+
+
+def _load_conda_paths_cache() -> Optional[Dict[str, Optional[str]]]:
+    try:
+        with open(CONDA_PATHS_CACHE_FILE, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("version") != CONDA_PATHS_CACHE_VERSION:
+        return None
+    paths = cached.get("paths") or {}
+    if _conda_cache_fingerprint(paths) != cached.get("fingerprint"):
+        return None
+    return paths
+
+
+def _save_conda_paths_cache():
+    paths = {name: globals()[name] for name in CONDA_PATH_GLOBAL_NAMES}
+    if not (paths["CONDA_EXE_PATH"] or paths["CONDA_BAT_PATH"] or paths["CONDA_ROOT_PATH"]):
+        # 没有找到 Conda 时不缓存：指纹里没有任何路径，之后安装 Conda 或把它加入 PATH 也会一直命中这个结果
+        return
+    payload = {"version": CONDA_PATHS_CACHE_VERSION, "paths": paths, "fingerprint": _conda_cache_fingerprint(paths)}
+    try:
+        os.makedirs(os.path.dirname(CONDA_PATHS_CACHE_FILE), exist_ok=True)
+        temp_path = f"{CONDA_PATHS_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(temp_path, CONDA_PATHS_CACHE_FILE)
+    except OSError as e:
+        print(f"[WARN] Failed to write Conda paths cache '{CONDA_PATHS_CACHE_FILE}': {e}")
+
 
 def find_and_set_conda_paths():
+    """重新探测 Conda 路径 (忽略缓存) 并写入缓存文件。通常不需要直接调用，由 ensure_conda_paths() 按需触发。"""
     global CONDA_EXE_PATH, CONDA_BAT_PATH, CONDA_ROOT_PATH, \
         CONDA_SCRIPTS_PATH, CONDA_CONDABIN_PATH, CONDA_LIBRARY_BIN_PATH, \
-        ANACONDA_ACTIVATE_BAT_PATH, ANACONDA_BASE_PATH
+        ANACONDA_ACTIVATE_BAT_PATH, ANACONDA_BASE_PATH, _conda_paths_resolved
+    _apply_conda_paths({})
     CONDA_BAT_PATH = shutil.which("conda.bat")
     CONDA_EXE_PATH = shutil.which("conda.exe")
     env_conda_exe_var = os.environ.get("CONDA_EXE")
@@ -106,17 +201,188 @@ def find_and_set_conda_paths():
     print(f"CONDA_LIBRARY_BIN_PATH: {CONDA_LIBRARY_BIN_PATH}");
     print(f"ANACONDA_ACTIVATE_BAT_PATH (Win): {ANACONDA_ACTIVATE_BAT_PATH}");
     print(f"ANACONDA_BASE_PATH: {ANACONDA_BASE_PATH}")
+    _conda_paths_resolved = True
+    _save_conda_paths_cache()
+
+
+CLEAN_ENV_ESSENTIAL_VARS = ("SYSTEMROOT", "WINDIR", "TEMP", "TMP", "USERPROFILE", "USERNAME", "PROGRAMFILES",
+                            "PROGRAMFILES(X86)", "PROGRAMDATA", "ALLUSERSPROFILE", "PUBLIC", "COMPUTERNAME",
+                            "SystemDrive", "HOMEDRIVE", "HOMEPATH", "APPDATA", "LOCALAPPDATA")
+
+# 命令执行环境的快照：Conda 路径或宿主进程的 PATH / 基础变量不变时直接复用，不必为每条命令重新检查目录、去重 PATH
+_clean_env_snapshot: Optional[Tuple[Tuple[Any, ...], Mapping[str, str]]] = None
+_conda_env_overlays: Dict[Tuple[Tuple[Any, ...], str], Mapping[str, str]] = {}
+_clean_env_lock = threading.Lock()
+_conda_env_prefixes: Optional[Dict[str, str]] = None
+_conda_env_prefixes_lock = threading.Lock()
 
 
-find_and_set_conda_paths()
+def _clean_env_key() -> Tuple[Any, ...]:
+    return (tuple(globals()[name] for name in CONDA_PATH_GLOBAL_NAMES), os.environ.get('PATH', ''),
+            os.environ.get("COMSPEC"), tuple(os.environ.get(var) for var in CLEAN_ENV_ESSENTIAL_VARS))
+
+
+def get_clean_env_snapshot(conda_env: Optional[str] = None) -> Mapping[str, str]:
+    """
+    返回只读的命令执行环境 (MappingProxyType)。基础环境按 Conda 路径和宿主环境变量记忆，二者变化时自动重建。
+    conda_env 为环境名称或前缀路径时，返回在基础环境上叠加该环境 (bin/Scripts 目录优先、CONDA_PREFIX 等) 的版本，
+    同样只在第一次使用时计算；环境不存在时返回基础环境。
+    """
+    global _clean_env_snapshot
+    ensure_conda_paths()
+    key = _clean_env_key()
+    snapshot = _clean_env_snapshot
+    if snapshot is None or snapshot[0] != key:
+        with _clean_env_lock:
+            if _clean_env_snapshot is None or _clean_env_snapshot[0] != key:
+                _clean_env_snapshot = (key, MappingProxyType(_build_clean_env_for_conda()))
+                _conda_env_overlays.clear()
+            snapshot = _clean_env_snapshot
+    if not conda_env:
+        return snapshot[1]
+    overlay = _conda_env_overlays.get((key, conda_env))
+    if overlay is None:
+        prefix = resolve_conda_env_prefix(conda_env)
+        if prefix is None:
+            return snapshot[1]
+        overlay = MappingProxyType(_build_conda_env_overlay(snapshot[1], conda_env, prefix))
+        with _clean_env_lock:
+            _conda_env_overlays[(key, conda_env)] = overlay
+    return overlay
 
 
 def get_clean_env_for_conda() -> Dict[str, str]:
+    """返回基础执行环境的可修改副本。"""
+    return dict(get_clean_env_snapshot())
+
+
+def resolve_conda_env_prefix(conda_env: str) -> Optional[str]:
+    """
+    把环境名称 (或前缀路径) 解析为环境目录；找不到时返回 None。
+    优先使用 `conda env list --json` 的结果 (缓存，可找到 envs_dirs 中其他位置的环境)，再按 <CONDA_ROOT>/envs/<name> 推断。
+    """
+    if os.path.isabs(conda_env):
+        return conda_env if os.path.isdir(os.path.join(conda_env, "conda-meta")) else None
+    prefix = get_conda_env_prefixes().get(conda_env)
+    if prefix and os.path.isdir(os.path.join(prefix, "conda-meta")):
+        return prefix
+    if not CONDA_ROOT_PATH:
+        return None
+    if conda_env == "base":
+        return CONDA_ROOT_PATH
+    prefix = os.path.join(CONDA_ROOT_PATH, "envs", conda_env)
+    return prefix if os.path.isdir(os.path.join(prefix, "conda-meta")) else None
+
+
+def _conda_executable(env: Optional[Mapping[str, str]] = None) -> Optional[str]:
+    # Unix 上路径探测只认 CONDA_EXE 环境变量，这里再从 PATH 中找一次 conda
+    return CONDA_EXE_PATH or CONDA_BAT_PATH or shutil.which("conda", path=(env or {}).get("PATH"))
+
+
+def get_conda_env_prefixes() -> Dict[str, str]:
+    """
+    环境名称 -> 前缀目录，来自 `conda env list --json`，只在第一次使用时执行 (需要约 1 秒)。
+    base 对应根前缀，其他环境以目录名作为名称。conda 不可用或执行失败时返回空字典 (同样缓存)。
+    """
+    global _conda_env_prefixes
+    prefixes = _conda_env_prefixes
+    if prefixes is not None:
+        return prefixes
+    with _conda_env_prefixes_lock:
+        if _conda_env_prefixes is not None:
+            return _conda_env_prefixes
+        prefixes = {}
+        ensure_conda_paths()
+        conda_exe = _conda_executable(get_clean_env_snapshot())
+        if conda_exe:
+            try:
+                result = subprocess.run([conda_exe, "env", "list", "--json"], capture_output=True, text=True,
+                                        encoding="utf-8", errors="replace", env=dict(get_clean_env_snapshot()),
+                                        timeout=60, check=False)
+                env_list = json.loads(result.stdout) if result.returncode == 0 else {}
+                root_prefix = env_list.get("root_prefix") or CONDA_ROOT_PATH
+                for prefix in env_list.get("envs") or []:
+                    if root_prefix and os.path.normcase(os.path.normpath(prefix)) == \
+                            os.path.normcase(os.path.normpath(root_prefix)):
+                        prefixes["base"] = prefix
+                    else:
+                        prefixes.setdefault(os.path.basename(os.path.normpath(prefix)), prefix)
+                print(f"[INFO] Conda env list: {len(prefixes)} environment(s) found via '{conda_exe} env list --json'.")
+            except (OSError, ValueError, subprocess.TimeoutExpired) as e:
+                print(f"[WARN] 'conda env list --json' failed, falling back to path-based env resolution: {e}")
+        _conda_env_prefixes = prefixes
+        return prefixes
+
+
+def invalidate_conda_env_caches():
+    """conda create/remove/install 等命令之后调用：环境列表、环境变量叠加和常驻 shell 都需要在下次使用时重新计算。"""
+    global _conda_env_prefixes
+    with _conda_env_prefixes_lock:
+        _conda_env_prefixes = None
+    with _clean_env_lock:
+        _conda_env_overlays.clear()
+    mark_persistent_shells_stale()
+
+
+def rewrite_conda_run_command(run_args: List[str], working_directory: Optional[str]
+                              ) -> Optional[Tuple[List[str], Optional[str], str]]:
+    """
+    把 `conda run -n <env> python ...` (以及 pythonX.Y、pip) 改写为直接执行环境中的解释器，
+    返回 (命令参数, 工作目录, 环境名称)；调用方用 get_clean_env_snapshot(环境名称) 作为与激活等价的环境变量。
+    无法安全改写时返回 None，回退到 conda run：选项无法识别、环境不存在、解释器不存在，
+    或环境带有 activate.d 脚本 (可能设置 CUDA_HOME 等变量，只有真正激活才会执行)。
+    """
+    parsed = parse_conda_run_command(run_args)
+    if parsed is None:
+        return None
+    conda_env, run_cwd, command_args = parsed
+    program = os.path.basename(command_args[0]) if command_args[0] == os.path.basename(command_args[0]) else None
+    if not program:
+        return None
+    is_windows = platform.system() == "Windows"
+    program_name = program[:-4] if is_windows and program.lower().endswith(".exe") else program
+    is_pip = re.fullmatch(r"pip(\d+(\.\d+)?)?", program_name) is not None
+    if not is_pip and re.fullmatch(r"python(\d+(\.\d+)?)?", program_name) is None:
+        return None
+    prefix = resolve_conda_env_prefix(conda_env)
+    if prefix is None:
+        return None
+    activate_d = os.path.join(prefix, "etc", "conda", "activate.d")
+    if os.path.isdir(activate_d) and os.listdir(activate_d):
+        return None
+    if is_windows:
+        interpreter = os.path.join(prefix, "python.exe" if is_pip else program_name + ".exe")
+    else:
+        interpreter = os.path.join(prefix, "bin", "python" if is_pip else program_name)
+    if not os.path.isfile(interpreter):
+        return None
+    rewritten = [interpreter, "-m", "pip"] + command_args[1:] if is_pip else [interpreter] + command_args[1:]
+    if run_cwd and working_directory and not os.path.isabs(run_cwd):
+        run_cwd = os.path.join(working_directory, run_cwd)
+    return rewritten, run_cwd or working_directory, conda_env
+
+
+def _build_conda_env_overlay(base_env: Mapping[str, str], conda_env: str, prefix: str) -> Dict[str, str]:
+    env = dict(base_env)
+    if platform.system() == "Windows":
+        env_paths = [prefix, os.path.join(prefix, "Library", "mingw-w64", "bin"),
+                     os.path.join(prefix, "Library", "usr", "bin"), os.path.join(prefix, "Library", "bin"),
+                     os.path.join(prefix, "Scripts")]
+    else:
+        env_paths = [os.path.join(prefix, "bin")]
+    env_paths = [p for p in env_paths if os.path.isdir(p)]
+    env['PATH'] = os.pathsep.join(env_paths + [env.get('PATH', '')])
+    env['CONDA_PREFIX'] = prefix
+    env['CONDA_DEFAULT_ENV'] = conda_env
+    env['CONDA_SHLVL'] = "1"
+    env['CONDA_PROMPT_MODIFIER'] = f"({conda_env}) "
+    print(f"[INFO] Env overlay for Conda env '{conda_env}' ({prefix}) - Prepended to PATH: {os.pathsep.join(env_paths)}")
+    return env
+
+
+def _build_clean_env_for_conda() -> Dict[str, str]:
     env = {}
-    essential_vars = ["SYSTEMROOT", "WINDIR", "TEMP", "TMP", "USERPROFILE", "USERNAME", "PROGRAMFILES",
-                      "PROGRAMFILES(X86)", "PROGRAMDATA", "ALLUSERSPROFILE", "PUBLIC", "COMPUTERNAME", "SystemDrive",
-                      "HOMEDRIVE", "HOMEPATH", "APPDATA", "LOCALAPPDATA"]
-    for var in essential_vars:
+    for var in CLEAN_ENV_ESSENTIAL_VARS:
         if var in os.environ: env[var] = os.environ[var]
     paths_to_prepend = []
     if CONDA_CONDABIN_PATH and os.path.isdir(CONDA_CONDABIN_PATH): paths_to_prepend.append(CONDA_CONDABIN_PATH)
@@ -156,26 +422,431 @@ def get_clean_env_for_conda() -> Dict[str, str]:
     return env
 
 
-def _threaded_read_pipe(pipe, q, stream_type, encoding, errors_policy):
-    try:
-        for byte_chunk in iter(lambda: pipe.read(128), b''):
+def parse_conda_run_command(run_args: List[str]) -> Optional[Tuple[str, Optional[str], List[str]]]:
+    """
+    解析 `conda run` 之后的参数，返回 (环境名称或前缀, --cwd 的值, 要执行的命令参数)。
+    没有指定环境、没有命令或包含无法识别的选项时返回 None，由调用方回退到真正的 conda run。
+    """
+    conda_env: Optional[str] = None
+    run_cwd: Optional[str] = None
+    index = 0
+    while index < len(run_args) and run_args[index].startswith("-"):
+        option, has_inline_value, inline_value = run_args[index].partition("=")
+        if option in CONDA_RUN_FLAG_OPTIONS and not has_inline_value:
+            index += 1
+            continue
+        if option not in CONDA_RUN_VALUE_OPTIONS:
+            return None
+        if has_inline_value:
+            value = inline_value
+            index += 1
+        elif index + 1 < len(run_args):
+            value = run_args[index + 1]
+            index += 2
+        else:
+            return None
+        if option == "--cwd":
+            run_cwd = value
+        else:
+            conda_env = value
+    if not conda_env or index >= len(run_args):
+        return None
+    return conda_env, run_cwd, run_args[index:]
+
+
+class PersistentCondaShell:
+    """
+    一个已激活某个 Conda 环境的常驻 bash，依次执行命令以省去每条 `conda run` 的启动开销。
+    每条命令在子 shell 中运行 (cd、export 等不会影响后续命令)，标准输入为 /dev/null；
+    命令结束后 shell 在 stdout 打印 RETURN_CODE_MARKER_PREFIX + 返回码 + END_OF_COMMAND_MARKER，在 stderr 打印
+    END_OF_COMMAND_MARKER，据此从流中切分出每条命令的输出和返回码。shell 退出或命令被中途放弃时关闭，下次使用时自动重启。
+    调用方需持有 self.lock，保证同一时间只有一条命令在执行。
+    """
+
+    def __init__(self, conda_env: str):
+        self.conda_env = conda_env
+        self.lock = threading.Lock()
+        self.process: Optional[subprocess.Popen] = None
+        self.stale = False  # 环境可能已被其他 conda 命令修改 (install/remove/create)，下次使用前重启
+        self.commands_run = 0
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._decoders: Dict[str, Any] = {}
+        self._pending: Dict[str, str] = {}
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def ensure_started(self) -> bool:
+        """确保 shell 正在运行且已激活环境；启动或激活失败时返回 False。"""
+        if self.is_alive() and not self.stale:
+            return True
+        shell_env = dict(get_clean_env_snapshot())
+        bash_path = shutil.which("bash")
+        conda_exe = _conda_executable(shell_env)
+        if not bash_path or not conda_exe:
+            return False
+        if self.process is not None:
+            print(f"[INFO] Restarting persistent shell for Conda env '{self.conda_env}' "
+                  f"({'stale' if self.stale else f'exited with {self.process.poll()}'}).")
+        self.close()
+        started = time.monotonic()
+        try:
+            self.process = subprocess.Popen([bash_path, "--noprofile", "--norc"], stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                            env=shell_env, close_fds=True, start_new_session=True)
+        except OSError as e:
+            print(f"[WARN] Failed to start persistent shell for Conda env '{self.conda_env}': {e}")
+            self.process = None
+            return False
+        self._decoders = {name: codecs.getincrementaldecoder("utf-8")("replace") for name in ("stdout", "stderr")}
+        self._pending = {"stdout": "", "stderr": ""}
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.process.stdout.fileno(), selectors.EVENT_READ, "stdout")
+        self._selector.register(self.process.stderr.fileno(), selectors.EVENT_READ, "stderr")
+        activation = (f"__aes_activate=\"$({shlex.quote(conda_exe)} shell.posix activate "
+                      f"{shlex.quote(self.conda_env)})\" && eval \"$__aes_activate\"")
+        output: List[str] = []
+        return_code: Optional[int] = None
+        try:
+            for event_type, value in self._run_script(activation, time.monotonic() + PERSISTENT_SHELL_START_TIMEOUT):
+                if event_type == "return_code":
+                    return_code = value
+                else:
+                    output.append(value)
+        except TimeoutError:
+            output.append("激活超时")
+        if return_code != 0:
+            print(f"[WARN] Activating Conda env '{self.conda_env}' in persistent shell failed (rc={return_code}): "
+                  f"{''.join(output).strip()[:500]}")
+            self.close()
+            return False
+        self.stale = False
+        self.commands_run = 0
+        print(f"[INFO] Persistent shell for Conda env '{self.conda_env}' ready (pid {self.process.pid}) "
+              f"in {time.monotonic() - started:.2f}s.")
+        return True
+
+    def run(self, command_args: List[str], working_directory: Optional[str] = None, timeout: float = 0,
+            idle_timeout: float = 0) -> Iterator[Tuple[str, Any]]:
+        """
+        在已激活的 shell 中执行一条命令，产出与 execute_command_stream 相同的事件。需先调用 ensure_started。
+        超过 timeout 或连续 idle_timeout 秒没有输出时终止整个 shell 进程组 (下次使用时重启)，返回 COMMAND_TIMEOUT_RETURN_CODE。
+        """
+        script = (f"cd -- {shlex.quote(working_directory or os.getcwd())} && "
+                  f"( {shlex.join(command_args)} ) </dev/null")
+        self.commands_run += 1
+        try:
+            yield from self._run_script(script, time.monotonic() + timeout if timeout > 0 else None, idle_timeout,
+                                        timeout_reason=describe_command_timeout(timeout, "timeout"))
+        except TimeoutError as e:
+            yield "stderr", f"\n[命令已被终止: {e}。已终止整个进程组，常驻 shell 将在下次使用时重启。]\n"
+            yield "return_code", COMMAND_TIMEOUT_RETURN_CODE
+
+    def _run_script(self, script: str, deadline: Optional[float] = None, idle_timeout: float = 0,
+                    timeout_reason: str = "persistent shell did not respond in time") -> Iterator[Tuple[str, Any]]:
+        framed = (f"{script}\n__aes_rc=$?\n"
+                  f"printf '\\n%s%s%s\\n' {shlex.quote(RETURN_CODE_MARKER_PREFIX)} \"$__aes_rc\" "
+                  f"{shlex.quote(END_OF_COMMAND_MARKER)}\n"
+                  f"printf '\\n%s\\n' {shlex.quote(END_OF_COMMAND_MARKER)} >&2\n")
+        completed = False
+        try:
             try:
-                decoded_chunk = byte_chunk.decode(encoding, errors=errors_policy)
-                q.put((stream_type, decoded_chunk))
-            except Exception as e_decode:
-                q.put(('stderr', f"[_threaded_read_pipe decode error: {e_decode}]"))
-    except BrokenPipeError:
+                self.process.stdin.write(framed.encode("utf-8"))
+                self.process.stdin.flush()
+            except (BrokenPipeError, OSError) as e:
+                yield "stderr", f"错误：常驻 shell 已退出，无法执行命令: {e}"
+                yield "return_code", -1
+                completed = True
+                return
+            return_code: Optional[int] = None
+            finished = {"stdout": False, "stderr": False}
+            last_activity = time.monotonic()
+            while not all(finished.values()):
+                timeout = 1.0 if deadline is None else max(0.0, min(1.0, deadline - time.monotonic()))
+                ready = self._selector.select(timeout)
+                if not ready:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise TimeoutError(timeout_reason)
+                    if idle_timeout > 0 and time.monotonic() - last_activity >= idle_timeout:
+                        raise TimeoutError(describe_command_timeout(idle_timeout, "idle"))
+                    if self.process.poll() is not None:
+                        break
+                    continue
+                last_activity = time.monotonic()
+                for key, _ in ready:
+                    stream_type = key.data
+                    data = os.read(key.fd, 65536)
+                    if not data:
+                        # shell 在命令执行中退出 (例如命令里执行了 exit/exec)
+                        finished[stream_type] = True
+                        self._selector.unregister(key.fd)
+                        self._pending[stream_type] += self._decoders[stream_type].decode(b"", final=True)
+                        if self._pending[stream_type]:
+                            yield stream_type, self._pending[stream_type]
+                            self._pending[stream_type] = ""
+                        continue
+                    self._pending[stream_type] += self._decoders[stream_type].decode(data)
+                    if finished[stream_type]:
+                        continue  # 标记之后的输出来自后台进程，留给下一条命令
+                    output, marker_rc, found = self._take_output(stream_type)
+                    if output:
+                        yield stream_type, output
+                    if found:
+                        finished[stream_type] = True
+                        if stream_type == "stdout":
+                            return_code = marker_rc
+            if return_code is None:
+                exit_code = self.process.wait()
+                yield "stderr", f"\n常驻 shell 意外退出 (返回码 {exit_code})，下次执行命令时将自动重启。"
+                return_code = exit_code if exit_code else -1
+                self.close()
+            yield "return_code", return_code
+            completed = True
+        finally:
+            if not completed:
+                self.close()  # 命令被中途放弃或超时：shell 状态未知，直接关闭
+
+    def _take_output(self, stream_type: str) -> Tuple[str, Optional[int], bool]:
+        # 返回 (可以产出的输出, 返回码, 是否遇到了结束标记)。标记前一定有一个由 printf 加上的换行，切分时一并去掉；
+        # 缓冲区末尾可能是不完整的标记时保留 "\n" + 最后一行，等待更多数据
+        text = self._pending[stream_type]
+        marker_head = "\n" + (RETURN_CODE_MARKER_PREFIX if stream_type == "stdout" else END_OF_COMMAND_MARKER)
+        if stream_type == "stdout":
+            match = re.search(re.escape(marker_head) + r"(-?\d+)" + re.escape(END_OF_COMMAND_MARKER) + r"\n", text)
+        else:
+            match = re.search(re.escape(marker_head) + r"\n", text)
+        if match:
+            self._pending[stream_type] = text[match.end():]
+            return text[:match.start()], int(match.group(1)) if stream_type == "stdout" else None, True
+        last_newline = text.rfind("\n")
+        if last_newline == -1:
+            self._pending[stream_type] = ""
+            return text, None, False
+        tail = text[last_newline:]
+        if marker_head.startswith(tail) or tail.startswith(marker_head):
+            self._pending[stream_type] = tail
+            return text[:last_newline], None, False
+        self._pending[stream_type] = ""
+        return text, None, False
+
+    def close(self):
+        process, self.process = self.process, None
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        if process is None:
+            return
+        if process.poll() is None:
+            terminate_process_group(process)
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            try:
+                if pipe: pipe.close()
+            except OSError:
+                pass
+        try:
+            process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+
+
+_persistent_shells: Dict[str, PersistentCondaShell] = {}
+_persistent_shells_lock = threading.Lock()
+
+
+def get_persistent_shell(conda_env: str) -> PersistentCondaShell:
+    with _persistent_shells_lock:
+        shell = _persistent_shells.get(conda_env)
+        if shell is None:
+            shell = _persistent_shells[conda_env] = PersistentCondaShell(conda_env)
+        return shell
+
+
+def mark_persistent_shells_stale():
+    """conda install/remove/create 等命令可能修改了环境 (包括 activate.d 脚本)，让所有常驻 shell 在下次使用前重启。"""
+    with _persistent_shells_lock:
+        for shell in _persistent_shells.values():
+            shell.stale = True
+
+
+def close_persistent_shells():
+    with _persistent_shells_lock:
+        shells = list(_persistent_shells.values())
+        _persistent_shells.clear()
+    for shell in shells:
+        shell.close()
+
+
+atexit.register(close_persistent_shells)
+
+
+def _run_in_persistent_shell(run_args: List[str], working_directory: Optional[str], timeout: float = 0,
+                             idle_timeout: float = 0) -> Optional[Iterator[Tuple[str, Any]]]:
+    # 返回事件迭代器；无法使用常驻 shell (解析失败、shell 正忙、启动或激活失败) 时返回 None，由调用方走 conda run
+    parsed = parse_conda_run_command(run_args)
+    if parsed is None:
+        return None
+    conda_env, run_cwd, command_args = parsed
+    shell = get_persistent_shell(conda_env)
+    if not shell.lock.acquire(blocking=False):
+        return None
+    try:
+        if not shell.ensure_started():
+            shell.lock.release()
+            return None
+    except BaseException:
+        shell.lock.release()
+        raise
+    if run_cwd and working_directory and not os.path.isabs(run_cwd):
+        run_cwd = os.path.join(working_directory, run_cwd)
+
+    def events() -> Iterator[Tuple[str, Any]]:
+        try:
+            print(f"EXECUTOR_DEBUG: Persistent shell for Conda env '{conda_env}' (pid {shell.process.pid}): "
+                  f"{command_args}")
+            # 命令是常驻 shell 的子进程，无法单独取得 rusage，只统计墙钟时间和输出字节数
+            started_at = time.monotonic()
+            output_bytes = {"stdout": 0, "stderr": 0}
+            for event_type, value in shell.run(command_args, run_cwd or working_directory, timeout, idle_timeout):
+                if event_type in output_bytes:
+                    output_bytes[event_type] += len(value.encode("utf-8", "replace"))
+                elif event_type == "return_code":
+                    usage = build_resource_usage(time.monotonic() - started_at, None,
+                                                 output_bytes["stdout"], output_bytes["stderr"])
+                    if value == COMMAND_TIMEOUT_RETURN_CODE:
+                        usage["timed_out"] = True
+                    yield "resource_usage", usage
+                yield event_type, value
+        finally:
+            shell.lock.release()
+
+    return events()
+
+
+def describe_command_timeout(seconds: float, kind: str) -> str:
+    if kind == "idle":
+        return f"连续 {seconds:g} 秒没有任何输出"
+    return f"运行时间超过 {seconds:g} 秒"
+
+
+def terminate_process_group(process: subprocess.Popen, grace_seconds: float = COMMAND_KILL_GRACE_SECONDS):
+    """
+    终止命令及其所有子孙进程：Unix 上向进程组 (命令以 start_new_session 启动，组号即其 pid) 发送 SIGTERM，
+    grace_seconds 内未退出再发送 SIGKILL；Windows 上先发送 CTRL_BREAK_EVENT，之后用 taskkill /T /F 结束整个进程树。
+    不回收子进程，调用方之后仍需 wait。
+    """
+    if platform.system() == "Windows":
+        if process.poll() is not None:
+            return
+        try:
+            process.send_signal(signal.CTRL_BREAK_EVENT)
+        except (OSError, ValueError):
+            pass
+        deadline = time.monotonic() + grace_seconds
+        while process.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if process.poll() is None:
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(process.pid)], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, creationflags=subprocess.CREATE_NO_WINDOW, check=False)
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    except OSError:
         pass
-    except Exception as e_read:
-        q.put(('stderr', f"[_threaded_read_pipe read error: {e_read}]"))
-    finally:
-        if pipe and not pipe.closed: pipe.close()
-        q.put((stream_type, None))
+    deadline = time.monotonic() + grace_seconds
+    while not process_has_exited(process) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    # 进程组组长退出后，仍在组内的子孙进程 (例如 pip 启动的编译器) 也一并 KILL
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+class CommandWatchdog:
+    """
+    在后台线程中监视一条命令的总运行时间和连续无输出时间 (0 表示不限制)，超时后终止其整个进程组；
+    进程组退出后管道关闭，读取循环随之结束。调用方每收到输出调用 touch()，结束时调用 stop()。
+    """
+
+    CHECK_INTERVAL = 0.5
+
+    def __init__(self, process: subprocess.Popen, timeout: float = 0, idle_timeout: float = 0,
+                 grace_seconds: float = COMMAND_KILL_GRACE_SECONDS):
+        self.process = process
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.grace_seconds = grace_seconds
+        self.reason: Optional[str] = None  # 超时原因，未超时为 None
+        self._started = self._last_activity = time.monotonic()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if timeout > 0 or idle_timeout > 0:
+            self._thread = threading.Thread(target=self._watch, name=f"command-watchdog-{process.pid}", daemon=True)
+            self._thread.start()
+
+    def touch(self):
+        self._last_activity = time.monotonic()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _watch(self):
+        while not self._stopped.wait(self.CHECK_INTERVAL):
+            now = time.monotonic()
+            if self.timeout > 0 and now - self._started >= self.timeout:
+                reason = describe_command_timeout(self.timeout, "timeout")
+            elif self.idle_timeout > 0 and now - self._last_activity >= self.idle_timeout:
+                reason = describe_command_timeout(self.idle_timeout, "idle")
+            else:
+                continue
+            if self._stopped.is_set() or process_has_exited(self.process):
+                return
+            self.reason = reason
+            print(f"[WARN] Command (pid {self.process.pid}) timed out: {reason}; terminating its process group.")
+            terminate_process_group(self.process, self.grace_seconds)
+            return
+
+
+def _wait_with_rusage(process: subprocess.Popen) -> Tuple[int, Optional[Any]]:
+    """Unix 上用 os.wait4 回收子进程并取得其资源使用 (含它已回收的子孙进程，例如 conda run 启动的 python)；其他平台退回 wait()。"""
+    if hasattr(os, "wait4") and process.returncode is None:
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            return process.wait(), None
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return process.returncode, rusage
+    return process.wait(), None
+
+
+def build_resource_usage(wall_seconds: float, rusage: Optional[Any] = None, stdout_bytes: int = 0,
+                         stderr_bytes: int = 0) -> Dict[str, Any]:
+    """命令的资源使用：墙钟时间、用户态/内核态 CPU 时间、峰值常驻内存 (字节) 和输出字节数。没有 rusage 时 CPU 与内存为 None。"""
+    peak_rss_bytes = None
+    if rusage is not None:
+        # ru_maxrss 在 Linux 上以 KB 为单位，在 macOS 上以字节为单位
+        peak_rss_bytes = rusage.ru_maxrss if platform.system() == "Darwin" else rusage.ru_maxrss * 1024
+    return {"wall_seconds": wall_seconds,
+            "user_cpu_seconds": rusage.ru_utime if rusage is not None else None,
+            "sys_cpu_seconds": rusage.ru_stime if rusage is not None else None,
+            "peak_rss_bytes": peak_rss_bytes,
+            "stdout_bytes": stdout_bytes, "stderr_bytes": stderr_bytes}
 
 
 def execute_command_stream(command: Union[str, List[str]],
-                           working_directory: Optional[str] = None
+                           working_directory: Optional[str] = None,
+                           timeout: Optional[float] = None,
+                           idle_timeout: Optional[float] = None
                            ) -> Iterator[Tuple[str, Any]]:
+    """
+    执行命令并流式产出 ("stdout"/"stderr", 文本)，最后产出 ("resource_usage", dict) 和 ("return_code", int)。
+    命令在独立的进程组中运行，标准输入为空；timeout / idle_timeout (秒，None 使用模块默认值，0 不限制) 超时后
+    终止整个进程组并返回 COMMAND_TIMEOUT_RETURN_CODE。
+    """
+    timeout = COMMAND_TIMEOUT_SECONDS if timeout is None else timeout
+    idle_timeout = COMMAND_IDLE_TIMEOUT_SECONDS if idle_timeout is None else idle_timeout
     cmd_list_for_exec: List[str];
     cmd_str_for_log: str
     if isinstance(command, str):
@@ -194,6 +865,7 @@ def execute_command_stream(command: Union[str, List[str]],
         yield "stderr", "错误：命令参数类型无效."; yield "return_code", -1; return
     if not cmd_list_for_exec: yield "stderr", "错误：处理后命令列表为空."; yield "return_code", -1; return
 
+    ensure_conda_paths()
     first_arg_lower = cmd_list_for_exec[0].lower()
     is_conda_cmd_on_windows = platform.system() == "Windows" and \
                               ((CONDA_BAT_PATH and os.path.normcase(cmd_list_for_exec[0]) == os.path.normcase(
@@ -205,19 +877,36 @@ def execute_command_stream(command: Union[str, List[str]],
                             first_arg_lower == "conda")
     is_conda_cmd = is_conda_cmd_on_windows or is_conda_cmd_on_unix
     is_conda_run = is_conda_cmd and len(cmd_list_for_exec) > 1 and cmd_list_for_exec[1].lower() == "run"
+    direct_conda_env: Optional[str] = None
+    # conda create/remove/install 等会改变环境：执行前失效，执行期间其他线程可能又填充了缓存，进程结束后 (finally) 再失效一次
+    invalidates_conda_envs = is_conda_cmd and not is_conda_run
+    if invalidates_conda_envs:
+        invalidate_conda_env_caches()
+    elif is_conda_run:
+        rewritten = rewrite_conda_run_command(cmd_list_for_exec[2:], working_directory) if CONDA_RUN_BYPASS else None
+        if rewritten is not None:
+            cmd_list_for_exec, working_directory, direct_conda_env = rewritten
+            is_conda_cmd = is_conda_run = False
+            print(f"EXECUTOR_DEBUG: conda run bypassed for env '{direct_conda_env}': {cmd_list_for_exec}")
+        elif PERSISTENT_CONDA_SHELL and platform.system() != "Windows":
+            shell_events = _run_in_persistent_shell(cmd_list_for_exec[2:], working_directory, timeout, idle_timeout)
+            if shell_events is not None:
+                yield from shell_events
+                return
 
     final_popen_cmd_list: List[str];
     shell_for_popen = False;
     temp_bat_file_path: Optional[str] = None
     output_encoding = 'utf-8';
     errors_policy = 'replace'
-    current_env = get_clean_env_for_conda()
-    popen_kwargs: Dict[str, Any] = {"stdout": subprocess.PIPE, "stderr": subprocess.PIPE, "cwd": working_directory,
-                                    "env": current_env, "universal_newlines": False,
+    current_env = dict(get_clean_env_snapshot(direct_conda_env))
+    # 标准输入为空 (等待输入的命令读到 EOF 而不是挂起)；每条命令一个新的进程组，超时或中止时可以连同子孙进程一起终止
+    popen_kwargs: Dict[str, Any] = {"stdin": subprocess.DEVNULL, "stdout": subprocess.PIPE, "stderr": subprocess.PIPE,
+                                    "cwd": working_directory, "env": current_env, "universal_newlines": False,
                                     "close_fds": platform.system() != "Windows"}
 
     if platform.system() == "Windows":
-        popen_kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+        popen_kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP
         try:
             import ctypes; codepage = ctypes.windll.kernel32.GetACP(); output_encoding = f"cp{codepage}"
         except Exception:
@@ -257,90 +946,36 @@ def execute_command_stream(command: Union[str, List[str]],
                 f"EXECUTOR_DEBUG: Win General (shell=False): {final_popen_cmd_list}")
     else:
         output_encoding = 'utf-8'
+        popen_kwargs["start_new_session"] = True
         if is_conda_cmd and CONDA_EXE_PATH: cmd_list_for_exec[0] = CONDA_EXE_PATH
         final_popen_cmd_list = cmd_list_for_exec;
         shell_for_popen = False
         print(f"EXECUTOR_DEBUG: Unix command (shell=False): {final_popen_cmd_list}")
 
     process = None
+    watchdog: Optional[CommandWatchdog] = None
     try:
         print(
             f"EXECUTOR_FINAL_POPEN: Popen CMD List='{final_popen_cmd_list}', shell={shell_for_popen}, cwd={popen_kwargs.get('cwd')}, decode_as='{output_encoding}'")
+        started_at = time.monotonic()
         process = subprocess.Popen(final_popen_cmd_list, shell=shell_for_popen, **popen_kwargs)
 
-        # Check if fcntl is available before using it
-        use_threaded_reader = platform.system() == "Windows" or fcntl is None  # Use threads if on Windows OR fcntl is not imported
-
-        if use_threaded_reader:
-            print("[INFO] Using threaded reader for process output.")
-            q: queue.Queue[Tuple[str, Optional[str]]] = queue.Queue()
-            stdout_thread = threading.Thread(target=_threaded_read_pipe,
-                                             args=(process.stdout, q, 'stdout', output_encoding, errors_policy))
-            stderr_thread = threading.Thread(target=_threaded_read_pipe,
-                                             args=(process.stderr, q, 'stderr', output_encoding, errors_policy))
-            stdout_thread.daemon = True;
-            stderr_thread.daemon = True
-            stdout_thread.start();
-            stderr_thread.start()
-            streams_open = 2
-            while streams_open > 0:
-                try:
-                    stream_type, chunk = q.get(timeout=0.05)
-                    if chunk is None: streams_open -= 1; continue
-                    yield stream_type, chunk
-                except queue.Empty:
-                    if process.poll() is not None and not stdout_thread.is_alive() and not stderr_thread.is_alive():
-                        while not q.empty():
-                            try:
-                                s_type, chk = q.get_nowait();
-                            except queue.Empty:
-                                break
-                            if chk is None:
-                                pass
-                            else:
-                                yield s_type, chk
-                        break
-                    elif process.poll() is not None and streams_open == 0:
-                        break
-            if stdout_thread.is_alive(): stdout_thread.join(timeout=0.5)
-            if stderr_thread.is_alive(): stderr_thread.join(timeout=0.5)
-        else:  # Unix with fcntl (we know fcntl is not None here)
-            print("[INFO] Using fcntl/select reader for process output.")
-            streams_map = {}
-            if process.stdout: fcntl.fcntl(process.stdout.fileno(), fcntl.F_SETFL, os.O_NONBLOCK); streams_map[
-                process.stdout.fileno()] = ('stdout', process.stdout)  # type: ignore
-            if process.stderr: fcntl.fcntl(process.stderr.fileno(), fcntl.F_SETFL, os.O_NONBLOCK); streams_map[
-                process.stderr.fileno()] = ('stderr', process.stderr)  # type: ignore
-            active_filenos = list(streams_map.keys())
-            while active_filenos:
-                readable_fds, _, _ = select.select(active_filenos, [], [], 0.05)
-                for fd in readable_fds:
-                    stream_type, stream_obj = streams_map[fd]
-                    try:
-                        byte_chunk = stream_obj.read(256)
-                        if byte_chunk:
-                            yield stream_type, byte_chunk.decode(output_encoding, errors_policy)
-                        else:
-                            stream_obj.close(); active_filenos.remove(fd)
-                    except BlockingIOError:
-                        pass
-                    except Exception as e_read_unix:
-                        yield "stderr", f"[Unix read error on {stream_type}: {e_read_unix}]"
-                        if fd in active_filenos: stream_obj.close(); active_filenos.remove(fd)
-                if process.poll() is not None and not active_filenos: break
-                if process.poll() is not None and not readable_fds:
-                    for fd_check in list(active_filenos):
-                        s_type, s_obj = streams_map[fd_check]
-                        if not s_obj.closed:
-                            try:
-                                last_byte_chunk = s_obj.read(4096)
-                            except:
-                                last_byte_chunk = b''
-                            if last_byte_chunk: yield s_type, last_byte_chunk.decode(output_encoding, errors_policy)
-                            s_obj.close()
-                        if fd_check in active_filenos: active_filenos.remove(fd_check)
-                    if not active_filenos: break
-        return_code = process.wait()
+        watchdog = CommandWatchdog(process, timeout, idle_timeout)
+
+        output_reader = ProcessOutputReader(process, output_encoding, errors_policy)
+        for stream_type, chunk in output_reader:
+            watchdog.touch()
+            yield stream_type, chunk
+        return_code, rusage = _wait_with_rusage(process)
+        watchdog.stop()
+        resource_usage = build_resource_usage(time.monotonic() - started_at, rusage,
+                                              output_reader.bytes_by_stream.get("stdout", 0),
+                                              output_reader.bytes_by_stream.get("stderr", 0))
+        if watchdog.reason:
+            yield "stderr", f"\n[命令已被终止: {watchdog.reason}。已终止整个进程组。]\n"
+            resource_usage["timed_out"] = True
+            return_code = COMMAND_TIMEOUT_RETURN_CODE
+        yield "resource_usage", resource_usage
         yield "return_code", return_code
     except FileNotFoundError:
         cmd_name_fnf = final_popen_cmd_list[0]
@@ -351,27 +986,20 @@ def execute_command_stream(command: Union[str, List[str]],
         yield "stderr", f"执行命令时发生未知错误: {e_outer}\n{traceback.format_exc()}"
         yield "return_code", -99
     finally:
+        if watchdog is not None:
+            watchdog.stop()
         if process:
             for p_stream in [process.stdout, process.stderr]:
                 if p_stream and not p_stream.closed: p_stream.close()
+            # 命令被中途放弃 (调用方不再迭代) 或出错：终止整个进程组。正常退出后留下的后台进程 (例如启动的服务) 不受影响
             if process.poll() is None:
-                try:
-                    process.terminate()
-                except OSError:
-                    pass
+                terminate_process_group(process)
                 try:
                     process.wait(timeout=1)
-                except subprocess.TimeoutExpired:
-                    try:
-                        process.kill()
-                    except OSError:
-                        pass
-                    try:
-                        process.wait(timeout=1)
-                    except subprocess.TimeoutExpired:
-                        pass
-                except OSError:
+                except (subprocess.TimeoutExpired, OSError):
                     pass
+        if invalidates_conda_envs:
+            invalidate_conda_env_caches()
         if temp_bat_file_path and os.path.exists(temp_bat_file_path):
             try:
                 os.remove(temp_bat_file_path)
@@ -379,27 +1007,15 @@ def execute_command_stream(command: Union[str, List[str]],
                 print(f"[WARN] 删除临时批处理文件失败: {temp_bat_file_path}, Error: {e_del}")
 
 
-# git_clone and scan_directory (remain same)
-def git_clone(git_url: str, local_path: str, clean_before_clone: bool = False) -> Dict[str, Any]:
-    if clean_before_clone and os.path.exists(local_path):
-        try:
-            shutil.rmtree(local_path)
-        except Exception as e:
-            return {"command_executed": f"shutil.rmtree('{local_path}')", "return_code": -1, "stdout": [],
-                    "stderr": [f"清理目录失败: {e}"]}
-    command = ["git", "clone", git_url, local_path];
-    command_str = subprocess.list2cmdline(command)
-    try:
-        result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='replace',
-                                check=False)
-        return {"command_executed": command_str, "return_code": result.returncode,
-                "stdout": result.stdout.splitlines() if result.stdout else [],
-                "stderr": result.stderr.splitlines() if result.stderr else []}
-    except FileNotFoundError:
-        return {"command_executed": command_str, "return_code": -1, "stdout": [], "stderr": ["错误：'git' 命令未找到。"]}
-    except Exception as e:
-        return {"command_executed": command_str, "return_code": -1, "stdout": [],
-                "stderr": [f"执行 git clone 时发生错误: {e}"]}
+# git_clone and scan_directory
+def git_clone(git_url: str, local_path: str, clean_before_clone: bool = False,
+              mode: str = git_mirror.GIT_CLONE_MODE, cache_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    通过按 URL 缓存的本地裸镜像准备 local_path (见 git_mirror.GitMirrorCache.prepare_workspace)。
+    clean_before_clone 为 False 时已有的检出会被增量刷新，否则删除后重新克隆。
+    """
+    cache = git_mirror.GitMirrorCache(cache_dir or git_mirror.default_mirror_cache_dir(local_path))
+    return cache.prepare_workspace(git_url, local_path, mode, reuse_existing=not clean_before_clone)
 
 
 def scan_directory(directory_path: str, max_depth: int = -1) -> Dict[str, Any]:
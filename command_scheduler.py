@@ -0,0 +1,155 @@
+# command_scheduler.py
+
+import re
+import shlex
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+# 命令类别：
+#   barrier - 可能修改环境或项目 (conda create/install、pip install、运行脚本、git checkout、写文件…)，
+#             等待之前的所有命令完成，之后的所有命令也都等待它
+#   fetch   - 只下载到独立位置 (pip download)，可与其他 fetch / read 并行；之后的 read 会等待它 (可能要查看下载结果)
+#   read    - 只读检查 (查看文件、版本、已安装的包)，可与其他 read / fetch 并行
+COMMAND_KIND_BARRIER = "barrier"
+COMMAND_KIND_FETCH = "fetch"
+COMMAND_KIND_READ = "read"
+
+READ_ONLY_PROGRAMS = ("ls", "dir", "cat", "type", "tree", "head", "tail", "find", "grep", "findstr", "wc", "file",
+                      "echo", "pwd", "which", "where", "whoami", "uname", "nvidia-smi", "ldd", "lscpu", "free", "df",
+                      "printenv", "stat")
+# find 带这些参数时会修改文件或执行其他程序
+FIND_ACTION_ARGS = ("-delete", "-exec", "-execdir", "-ok", "-okdir", "-fprint", "-fprintf", "-fls")
+READ_ONLY_SUBCOMMANDS = {
+    "git": ("status", "log", "show", "diff", "rev-parse", "describe", "ls-files"),
+    "pip": ("show", "list", "freeze", "check", "--version", "-V", "debug", "index"),
+    "conda": ("list", "info", "--version", "-V", "search"),
+}
+FETCH_SUBCOMMANDS = {"pip": ("download",)}
+# 查询版本/帮助的参数：带这些参数的任意程序都视为只读 (例如 `python --version`)
+VERSION_FLAGS = ("--version", "-V", "version", "--help", "-h")
+# -v 对多数程序表示 verbose (`python -v` 会启动交互式解释器)，只有这些编译器用它输出版本信息
+VERSION_V_FLAG_PROGRAMS = ("gcc", "g++", "cc", "c++", "clang", "clang++", "gfortran")
+# 会改变状态的 shell 语法 (重定向写文件、后台、管道到可能写入的程序等)，出现时一律按 barrier 处理
+SHELL_WRITE_PATTERN = re.compile(r"(>|\btee\b|&(?!&)|\bcd\b|\bset\b|\bexport\b|\bsetx\b)")
+
+
+def _command_words(command_line: str) -> Optional[List[str]]:
+    try:
+        return shlex.split(command_line, posix=True)
+    except ValueError:
+        return None
+
+
+def _strip_conda_run(words: List[str]) -> List[str]:
+    # `conda run -n env <cmd>` 按内部命令分类
+    if len(words) > 2 and words[0].lower() == "conda" and words[1] == "run":
+        index = 2
+        while index < len(words) and words[index].startswith("-"):
+            index += 1 if "=" in words[index] or words[index] in ("--no-capture-output", "--live-stream") else 2
+        return words[index:]
+    return words
+
+
+def classify_command(command_line: str) -> str:
+    """保守地判断命令类别；无法确定时一律视为 barrier。"""
+    if SHELL_WRITE_PATTERN.search(command_line) or ";" in command_line or "|" in command_line:
+        return COMMAND_KIND_BARRIER
+    words = _command_words(command_line)
+    if not words:
+        return COMMAND_KIND_BARRIER
+    words = _strip_conda_run(words)
+    if not words:
+        return COMMAND_KIND_BARRIER
+    program = re.sub(r"\.(exe|bat|cmd)$", "", words[0].replace("\\", "/").rsplit("/", 1)[-1].lower())
+    args = words[1:]
+    if re.fullmatch(r"python(\d+(\.\d+)?)?", program) and len(args) >= 2 and args[0] == "-m" and args[1] == "pip":
+        program, args = "pip", args[2:]
+    elif re.fullmatch(r"pip\d*(\.\d+)?", program):
+        program = "pip"
+    if program in READ_ONLY_PROGRAMS:
+        if program == "find" and any(arg in FIND_ACTION_ARGS for arg in args):
+            return COMMAND_KIND_BARRIER
+        return COMMAND_KIND_READ
+    subcommand = args[0] if args else ""
+    if subcommand in FETCH_SUBCOMMANDS.get(program, ()):
+        return COMMAND_KIND_FETCH
+    if subcommand in READ_ONLY_SUBCOMMANDS.get(program, ()):
+        return COMMAND_KIND_READ
+    if program == "conda" and args[:2] == ["env", "list"]:
+        return COMMAND_KIND_READ
+    if len(args) == 1 and (args[0] in VERSION_FLAGS or (args[0] == "-v" and program in VERSION_V_FLAG_PROGRAMS)):
+        return COMMAND_KIND_READ
+    return COMMAND_KIND_BARRIER
+
+
+def build_command_dag(commands: Sequence[Dict[str, Any]]) -> List[Set[int]]:
+    """
+    为一批命令计算依赖关系，返回每条命令依赖的 (更早的) 命令下标集合。
+    commands 中每项至少包含 "command_line"，可选 "depends_on" (更早命令的从 0 开始的下标列表)。
+    显式依赖与保守推断的依赖取并集：
+      - barrier 依赖之前所有命令；所有命令都依赖最近的 barrier (例如 `conda create -n X` 之后的命令都等待它)；
+      - read 还依赖自最近 barrier 以来的所有 fetch。
+    """
+    dependencies: List[Set[int]] = []
+    last_barrier: Optional[int] = None
+    fetches_since_barrier: List[int] = []
+    for index, command in enumerate(commands):
+        kind = command.get("kind") or classify_command(command["command_line"])
+        if kind == COMMAND_KIND_BARRIER:
+            deps = set(range(index))
+            last_barrier, fetches_since_barrier = index, []
+        else:
+            deps = {last_barrier} if last_barrier is not None else set()
+            if kind == COMMAND_KIND_READ:
+                deps.update(fetches_since_barrier)
+            else:
+                fetches_since_barrier.append(index)
+        for dep in command.get("depends_on") or []:
+            if isinstance(dep, int) and not isinstance(dep, bool) and 0 <= dep < index:
+                deps.add(dep)
+        dependencies.append(deps)
+    return dependencies
+
+
+def run_command_dag(commands: Sequence[Dict[str, Any]], run_command: Callable[[int, Dict[str, Any]], Dict[str, Any]],
+                    max_workers: int = 4, stop_on_failure: bool = True) -> List[Optional[Dict[str, Any]]]:
+    """
+    按依赖关系执行一批命令：依赖都已成功的命令进入就绪队列，由最多 max_workers 个线程并行执行 (1 即严格顺序执行)。
+    run_command(index, command) 执行一条命令并返回结果字典 (含 return_code)。
+    某条命令失败后，依赖它的命令不再执行；stop_on_failure 时也不再启动任何新命令 (已在运行的会执行完)，与顺序执行时
+    "遇到错误即中断批次" 的行为一致。返回与 commands 顺序一致的结果列表，未执行的命令对应 None。
+    """
+    dependencies = build_command_dag(commands)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(commands)
+    remaining = {index: set(deps) for index, deps in enumerate(dependencies)}
+    stopped = False
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="command-dag") as pool:
+        running: Dict[Any, int] = {}
+        while remaining or running:
+            if not stopped:
+                ready = sorted(index for index, deps in remaining.items() if not deps)
+                for index in ready:
+                    if len(running) >= max(1, max_workers):
+                        break
+                    del remaining[index]
+                    running[pool.submit(run_command, index, commands[index])] = index
+            if not running:
+                break  # 剩下的命令依赖了失败的命令 (或批次已中断)
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    results[index] = {"return_code": -9999, "stdout": "", "stderr": f"调度执行命令时出错: {e}",
+                                      "command_executed": commands[index].get("command_line")}
+                if results[index].get("return_code", -1) != 0:
+                    stopped = stopped or stop_on_failure
+                else:
+                    for deps in remaining.values():
+                        deps.discard(index)
+    return results
+
+
+__all__ = ["COMMAND_KIND_BARRIER", "COMMAND_KIND_FETCH", "COMMAND_KIND_READ", "classify_command",
+           "build_command_dag", "run_command_dag"]
@@ -0,0 +1,210 @@
+# git_mirror.py
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# 工作区的创建方式：
+#   reference - 从本地镜像 (file:// URL) 完整克隆：完整历史，对象复制进工作区，不依赖镜像继续存在
+#   shallow   - 从本地镜像 `git clone --depth 1`：只有最新提交
+#   partial   - 从本地镜像 `git clone --filter=blob:none`：完整提交历史，文件内容按需下载
+GIT_CLONE_MODES = ("reference", "shallow", "partial")
+GIT_CLONE_MODE = os.environ.get("GIT_CLONE_MODE", "reference")
+# 裸镜像缓存目录 (按远程 URL 区分)；为空时使用工作区所在目录下的 .git-mirrors
+GIT_MIRROR_CACHE_DIR = os.environ.get("GIT_MIRROR_CACHE_DIR", "")
+
+RunCommand = Callable[[List[str], Optional[str]], Dict[str, Any]]
+
+_mirror_locks: Dict[str, threading.Lock] = {}
+_mirror_locks_lock = threading.Lock()
+
+
+def normalize_git_url(git_url: str) -> str:
+    """同一仓库的不同写法 (末尾的 / 或 .git、主机名大小写) 归一化后作为缓存键。"""
+    url = git_url.strip().rstrip("/")
+    if url.endswith(".git"):
+        url = url[:-4]
+    match = re.match(r"^([a-zA-Z][a-zA-Z0-9+.-]*://)([^/]*)(.*)$", url)
+    if match:
+        url = match.group(1).lower() + match.group(2).lower() + match.group(3)
+    return url
+
+
+def mirror_path_for_url(cache_dir: str, git_url: str) -> str:
+    url = normalize_git_url(git_url)
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", url.replace("\\", "/").rsplit("/", 1)[-1]) or "repo"
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{name}-{digest}.git")
+
+
+def default_mirror_cache_dir(workspace_path: str) -> str:
+    return GIT_MIRROR_CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(workspace_path)), ".git-mirrors")
+
+
+def run_git_command(command: List[str], cwd: Optional[str] = None) -> Dict[str, Any]:
+    """不需要流式输出时执行 git 命令，返回与 command_executor.git_clone 相同结构的结果。"""
+    command_str = subprocess.list2cmdline(command)
+    try:
+        result = subprocess.run(command, cwd=cwd, capture_output=True, text=True, encoding="utf-8",
+                                errors="replace", stdin=subprocess.DEVNULL, check=False)
+        return {"command_executed": command_str, "return_code": result.returncode,
+                "stdout": result.stdout.splitlines() if result.stdout else [],
+                "stderr": result.stderr.splitlines() if result.stderr else []}
+    except FileNotFoundError:
+        return {"command_executed": command_str, "return_code": -1, "stdout": [], "stderr": ["错误：'git' 命令未找到。"]}
+    except Exception as e:
+        return {"command_executed": command_str, "return_code": -1, "stdout": [],
+                "stderr": [f"执行 git 命令时发生错误: {e}"]}
+
+
+def _git_output(args: List[str], cwd: str) -> Optional[str]:
+    # 查询类 git 命令 (不展示给用户)，失败时返回 None
+    try:
+        result = subprocess.run(["git"] + args, cwd=cwd, capture_output=True, text=True, encoding="utf-8",
+                                errors="replace", stdin=subprocess.DEVNULL, check=False)
+    except OSError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def _file_url(path: str) -> str:
+    # --depth / --filter 对本地路径形式的源会被忽略，必须使用 file:// URL
+    path = os.path.abspath(path).replace("\\", "/")
+    return "file://" + (path if path.startswith("/") else "/" + path)
+
+
+def _remote_default_branch(workspace_path: str) -> Optional[str]:
+    # `ls-remote --symref origin HEAD` 的第一行形如 "ref: refs/heads/main\tHEAD"
+    output = _git_output(["ls-remote", "--symref", "origin", "HEAD"], workspace_path)
+    match = re.match(r"^ref: refs/heads/(\S+)\tHEAD", output or "")
+    return match.group(1) if match else None
+
+
+def _mirror_lock(mirror_path: str) -> threading.Lock:
+    with _mirror_locks_lock:
+        lock = _mirror_locks.get(mirror_path)
+        if lock is None:
+            lock = _mirror_locks[mirror_path] = threading.Lock()
+        return lock
+
+
+def _ok(result: Optional[Dict[str, Any]]) -> bool:
+    return result is not None and result.get("return_code", -1) == 0
+
+
+class GitMirrorCache:
+    """
+    按远程 URL 缓存仓库的裸镜像 (`git clone --mirror`)，用它快速创建或刷新项目工作区。
+    run_command(command, cwd) 执行一条 git 命令并返回结果字典 (含 return_code)，调用方可以借此流式展示输出；
+    默认使用 run_git_command。同一进程内对同一镜像的更新和克隆串行进行。
+    """
+
+    def __init__(self, cache_dir: str, run_command: Optional[RunCommand] = None):
+        self.cache_dir = cache_dir
+        self.run_command: RunCommand = run_command or run_git_command
+
+    def update_mirror(self, git_url: str) -> Dict[str, Any]:
+        """创建或增量更新 git_url 的裸镜像。首次克隆先写入临时目录，成功后再改名，中断时不会留下残缺的镜像。"""
+        mirror_path = mirror_path_for_url(self.cache_dir, git_url)
+        if os.path.isfile(os.path.join(mirror_path, "HEAD")):
+            return self.run_command(["git", "--git-dir", mirror_path, "fetch", "--prune", "origin"], None)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f"{mirror_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        result = self.run_command(["git", "clone", "--mirror", git_url, temp_path], None)
+        if _ok(result):
+            # 允许从镜像做部分克隆 (--filter=blob:none)
+            _git_output(["--git-dir", temp_path, "config", "uploadpack.allowFilter", "true"], self.cache_dir)
+            shutil.rmtree(mirror_path, ignore_errors=True)
+            os.replace(temp_path, mirror_path)
+        else:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        return result
+
+    def clone(self, git_url: str, workspace_path: str, mode: str = "reference") -> Dict[str, Any]:
+        """先更新镜像，再按 mode 创建新的工作区 (workspace_path 不能已存在)。镜像不可用时直接从远程克隆。"""
+        if mode not in GIT_CLONE_MODES:
+            print(f"[WARN] Unknown git clone mode '{mode}', using 'reference'.")
+            mode = "reference"
+        option = {"reference": [], "shallow": ["--depth", "1"], "partial": ["--filter=blob:none"]}[mode]
+        mirror_path = mirror_path_for_url(self.cache_dir, git_url)
+        with _mirror_lock(mirror_path):
+            try:
+                mirror_ready = _ok(self.update_mirror(git_url))
+            except OSError as e:
+                print(f"[WARN] Git mirror cache '{mirror_path}' unavailable: {e}")
+                mirror_ready = False
+            if not mirror_ready:
+                print(f"[WARN] Git mirror for '{git_url}' could not be updated; cloning directly from the remote.")
+                return self.run_command(["git", "clone"] + option + [git_url, workspace_path], None)
+            # 镜像刚刚更新过，直接从镜像克隆，不再访问远程
+            result = self.run_command(["git", "clone"] + option + [_file_url(mirror_path), workspace_path], None)
+        if not _ok(result):
+            return result
+        # 之后的 fetch (以及部分克隆按需下载的文件内容) 直接访问真正的远程
+        set_url = self.run_command(["git", "remote", "set-url", "origin", git_url], workspace_path)
+        return set_url if not _ok(set_url) else result
+
+    def refresh_workspace(self, git_url: str, workspace_path: str) -> Optional[Dict[str, Any]]:
+        """
+        把已有的工作区更新为远程默认分支的最新状态，并删除所有未跟踪和被忽略的文件 (与重新克隆的结果一致)：
+        fetch + checkout -B <默认分支> + clean -ffdx。工作区不是 git_url 的检出或任何一步失败时返回 None。
+        """
+        workspace_path = os.path.abspath(workspace_path)
+        if not os.path.isdir(os.path.join(workspace_path, ".git")):
+            return None
+        top_level = _git_output(["rev-parse", "--show-toplevel"], workspace_path)
+        origin_url = _git_output(["config", "--get", "remote.origin.url"], workspace_path)
+        if top_level is None or os.path.normcase(os.path.realpath(top_level)) != \
+                os.path.normcase(os.path.realpath(workspace_path)):
+            return None
+        if origin_url is None or normalize_git_url(origin_url) != normalize_git_url(git_url):
+            return None
+        fetch_command = ["git", "fetch", "--prune", "origin"]
+        remote_branch = None
+        if _git_output(["rev-parse", "--is-shallow-repository"], workspace_path) == "true":
+            fetch_command[2:2] = ["--depth", "1"]
+            # 浅克隆只跟踪克隆时的那一个分支，远程默认分支改变后要先改跟踪的分支，否则 fetch 会失败
+            remote_branch = _remote_default_branch(workspace_path)
+            if remote_branch:
+                _git_output(["config", "remote.origin.fetch",
+                             f"+refs/heads/{remote_branch}:refs/remotes/origin/{remote_branch}"], workspace_path)
+        if not _ok(self.run_command(fetch_command, workspace_path)):
+            return None
+        # 远程默认分支可能已改变，fetch 不会更新 origin/HEAD
+        _git_output(["remote", "set-head", "origin", remote_branch or "--auto"], workspace_path)
+        default_ref = _git_output(["symbolic-ref", "--short", "refs/remotes/origin/HEAD"], workspace_path)
+        if not default_ref or "/" not in default_ref:
+            return None
+        branch = default_ref.split("/", 1)[1]
+        if not _ok(self.run_command(["git", "checkout", "--force", "-B", branch, default_ref], workspace_path)):
+            return None
+        result = self.run_command(["git", "clean", "-ffdx"], workspace_path)
+        return result if _ok(result) else None
+
+    def prepare_workspace(self, git_url: str, workspace_path: str, mode: str = "reference",
+                          reuse_existing: bool = True) -> Dict[str, Any]:
+        """
+        准备 workspace_path 作为 git_url 的干净检出：能刷新已有工作区时只做增量更新，否则删除旧目录后从镜像克隆。
+        返回最后一条命令的结果，额外包含 workspace_strategy ("refreshed" 或 "cloned")。
+        """
+        if reuse_existing and os.path.exists(workspace_path):
+            result = self.refresh_workspace(git_url, workspace_path)
+            if result is not None:
+                return dict(result, workspace_strategy="refreshed")
+            print(f"[INFO] Workspace '{workspace_path}' cannot be refreshed in place; recloning.")
+        if os.path.exists(workspace_path):
+            try:
+                shutil.rmtree(workspace_path)
+            except Exception as e:
+                return {"command_executed": f"shutil.rmtree('{workspace_path}')", "return_code": -1, "stdout": [],
+                        "stderr": [f"清理目录失败: {e}"], "workspace_strategy": "cloned"}
+        return dict(self.clone(git_url, workspace_path, mode), workspace_strategy="cloned")
+
+
+__all__ = ["GitMirrorCache", "GIT_CLONE_MODES", "GIT_CLONE_MODE", "GIT_MIRROR_CACHE_DIR", "normalize_git_url",
+           "mirror_path_for_url", "default_mirror_cache_dir", "run_git_command"]
@@ -1,10 +1,238 @@
 # llm.py
 
 import requests
+from requests.adapters import HTTPAdapter
+import asyncio
+import contextlib
 import json
-from typing import List, Dict, Optional, Iterator, Tuple
+import ssl
+import threading
+import time
+import urllib.parse
+from typing import List, Dict, Optional, Iterator, AsyncIterator, Tuple, Any, Callable
 import re
 
+from llm_cache import LLMResponseCache
+from llm_metrics import LLMCallMetrics
+from llm_router import LLMEndpointRouter, get_shared_router, parse_base_urls
+from sse_parser import SSEParser, loads_payload
+from stream_json import THINK_CLOSE_TAG, THINK_OPEN_TAG, ReasoningSplitter, StreamingActionParser
+
+# 内部流只在 get_response_stream 内部消费、不对外产出的元数据事件：结束原因、服务器返回的 usage、实际使用的端点
+INTERNAL_STREAM_EVENTS = ("finish_reason", "usage", "endpoint")
+
+# 默认连接池大小：同时进行的配置会话数通常不多，但需覆盖README提取等并发请求
+DEFAULT_HTTP_POOL_MAXSIZE = 10
+
+_shared_sessions: Dict[Tuple[int, int], requests.Session] = {}
+_shared_sessions_lock = threading.Lock()
+
+# 路由器中的端点全部被排除、一个都没有尝试时返回的错误
+NO_LLM_ENDPOINT_ERROR = "没有可用的LLM端点 (no LLM endpoint available)"
+# 请求被 LLMClient.abort() 中止时返回的错误
+LLM_REQUEST_ABORTED_ERROR = "LLM请求已被中止 (request aborted)"
+
+# 思考预算用尽时 (nudge 模式) 追加的提示，要求模型停止思考并直接给出答案
+REASONING_BUDGET_NUDGE_PROMPT = "你的思考已经超出预算。请不要再继续思考，立即根据以上已有的分析直接输出最终答案。"
+
+# 服务器不支持 response_format (json_schema) 时通常返回的状态码
+STRUCTURED_OUTPUT_UNSUPPORTED_STATUSES = (400, 422)
+# 各端点是否支持结构化输出：True 支持，False 不支持，未记录表示尚未探测。进程内共享，避免每个新建的客户端重新探测
+_structured_output_support: Dict[str, bool] = {}
+_structured_output_support_lock = threading.Lock()
+
+
+def create_pooled_session(pool_connections: int = 4, pool_maxsize: int = DEFAULT_HTTP_POOL_MAXSIZE) -> requests.Session:
+    """创建一个带连接池和 keep-alive 的 requests.Session。重试交由调用方处理，这里不做自动重试。"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0,
+                          pool_block=False)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def get_shared_session(pool_connections: int = 4, pool_maxsize: int = DEFAULT_HTTP_POOL_MAXSIZE) -> requests.Session:
+    """
+    返回进程内共享的连接池 Session。
+    LLMClient 会被频繁重建（连接、开始任务、修改配置时），共享 Session 可以让已建立的 TCP/TLS 连接跨实例复用。
+    """
+    key = (pool_connections, pool_maxsize)
+    with _shared_sessions_lock:
+        session = _shared_sessions.get(key)
+        if session is None:
+            session = create_pooled_session(pool_connections, pool_maxsize)
+            _shared_sessions[key] = session
+        return session
+
+
+def get_structured_output_support(endpoint: str) -> Optional[bool]:
+    with _structured_output_support_lock:
+        return _structured_output_support.get(endpoint)
+
+
+def set_structured_output_support(endpoint: str, supported: bool):
+    with _structured_output_support_lock:
+        if _structured_output_support.get(endpoint) != supported:
+            print(f"LLM_STREAM_INFO: Structured output (response_format) {'supported' if supported else 'not supported'} by {endpoint}.")
+        _structured_output_support[endpoint] = supported
+
+
+class _ReasoningFieldMerger:
+    """把 reasoning_content 字段 (delta_reasoning 事件) 改写为 <think> 包裹的 delta_content，下游只需处理一种格式。"""
+
+    def __init__(self):
+        self.in_reasoning = False
+
+    def feed(self, event: Tuple[str, Optional[str]]) -> Tuple[str, Optional[str]]:
+        if event[0] == "delta_reasoning":
+            text = event[1] if self.in_reasoning else THINK_OPEN_TAG + event[1]
+            self.in_reasoning = True
+            return "delta_content", text
+        if event[0] == "delta_content" and self.in_reasoning:
+            self.in_reasoning = False
+            return "delta_content", THINK_CLOSE_TAG + event[1]
+        return event
+
+    def finish(self) -> List[Tuple[str, Optional[str]]]:
+        return [("delta_content", THINK_CLOSE_TAG)] if self.in_reasoning else []
+
+
+class _EndpointAttempt:
+    """
+    路由器模式下对一个端点的一次尝试：记录首 token 时间和输出量，判断是否应在产出任何内容之前切换到下一个端点，
+    结束时把 TTFT / 速度 / 失败情况反馈给路由器。
+    """
+
+    def __init__(self, router: LLMEndpointRouter, base_url: str, tried: List[str]):
+        self.router = router
+        self.base_url = base_url
+        self.tried = tried
+        self.attempt: Dict[str, Any] = {"retryable": False}
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.delta_count = 0
+        self.failed_over = False
+
+    @classmethod
+    def choose(cls, router: LLMEndpointRouter, tried: List[str]) -> Optional["_EndpointAttempt"]:
+        base_url = router.choose(exclude=tried)
+        if base_url is None:
+            return None
+        tried.append(base_url)
+        return cls(router, base_url, tried)
+
+    def should_fail_over(self, event: Tuple[str, Optional[str]]) -> bool:
+        if event[0] == "error" and self.attempt["retryable"] and self.delta_count == 0 \
+                and self.router.has_alternative(self.tried):
+            print(f"LLM_ROUTER: {self.base_url} failed before producing content, failing over. ({event[1]})")
+            self.failed_over = True
+            return True
+        if event[0] == "delta_content":
+            if self.first_token_at is None:
+                self.first_token_at = time.monotonic()
+            self.delta_count += 1
+        return False
+
+    def release(self):
+        finished_at = time.monotonic()
+        self.router.release(
+            self.base_url,
+            ttft=(self.first_token_at - self.started_at) if self.first_token_at is not None else None,
+            output_tokens=self.delta_count,
+            generation_seconds=(finished_at - self.first_token_at) if self.first_token_at is not None else 0.0,
+            failed=self.attempt["retryable"])
+
+
+class _CompletionCall:
+    """
+    一次 get_response_stream 调用中与 I/O 无关的部分：缓存命中时的重放、收集输出、提前结束 (JSON 已完整 / 思考超出预算)、
+    nudge 续写请求、写入缓存和性能数据。同步与异步客户端共用，各自只实现读取服务器事件的循环。
+    """
+
+    def __init__(self, client: "LLMClient", user_message: str, temperature: float, max_tokens: int,
+                 stop_after_json: bool, response_schema: Optional[Dict[str, Any]],
+                 reasoning_budget: Optional[int], reasoning_budget_mode: str):
+        self.client = client
+        self.endpoint, self.headers, self.data = client._prepare_request(user_message, temperature, max_tokens,
+                                                                         response_schema)
+        self.request_data: Optional[Dict[str, Any]] = self.data  # 下一个要发出的请求，None 表示结束
+        self.call_metrics = LLMCallMetrics(self.data, endpoint=client.base_url)
+        self.cache_key = client._cache_key_for(self.data)
+        self.collected_content: List[str] = []
+        self.had_error = False
+        self.json_detector = StreamingActionParser() if stop_after_json else None
+        self.reasoning_budget = reasoning_budget
+        self.reasoning_budget_mode = reasoning_budget_mode
+        self.splitter = ReasoningSplitter() if reasoning_budget else None
+        self.active_budget = reasoning_budget
+        self.budget_exceeded = False
+        client.last_response_from_cache = False
+        client.last_stream_stopped_early = False
+        client.last_reasoning_budget_exceeded = False
+
+    def cached_events(self) -> Optional[List[Tuple[str, Optional[str]]]]:
+        """缓存命中时返回要重放的全部事件 (含 stream_end)，否则返回 None。"""
+        if not self.cache_key:
+            return None
+        cached_completion = self.client.response_cache.get(self.cache_key)
+        if cached_completion is None:
+            return None
+        print(f"LLM_CACHE: Hit for request {self.cache_key[:12]}, replaying {len(cached_completion)} chars.")
+        self.client.last_response_from_cache = True
+        events = list(self.client._replay_cached_completion(cached_completion))
+        for event in events:
+            self.call_metrics.on_event(*event)
+        return events + [("stream_end", None)]
+
+    def on_server_event(self, event: Tuple[str, Optional[str]]) -> Tuple[bool, bool]:
+        """处理服务器流中的一个事件，返回 (是否产出给调用方, 产出后是否关闭当前服务器流)。"""
+        self.call_metrics.on_event(*event)
+        if event[0] in INTERNAL_STREAM_EVENTS:
+            return False, False
+        if event[0] == "error":
+            self.had_error = True
+        if event[0] != "delta_content":
+            return True, False
+        self.collected_content.append(event[1])
+        if self.json_detector and self.client._json_object_closed(self.json_detector, event[1]):
+            print("LLM_STREAM_INFO: Complete top-level JSON object received, closing stream early.")
+            self.client.last_stream_stopped_early = True
+            return True, True
+        if self.splitter and self.client._reasoning_over_budget(self.splitter, event[1], self.active_budget):
+            self.budget_exceeded = True
+            return True, True
+        return True, False
+
+    def end_server_stream(self) -> List[Tuple[str, Optional[str]]]:
+        """
+        一个服务器流结束后调用，返回需要补发的事件。思考超出预算时补发 "</think>"，nudge 模式下把 request_data
+        换成带上已有思考的续写请求 (只续写一次)；否则把 request_data 置为 None。
+        """
+        current_request, self.request_data = self.request_data, None
+        if not self.budget_exceeded:
+            return []
+        self.budget_exceeded = False
+        self.client.last_reasoning_budget_exceeded = True
+        self.call_metrics.on_event("delta_content", THINK_CLOSE_TAG)
+        self.collected_content.append(THINK_CLOSE_TAG)
+        if self.reasoning_budget_mode == "nudge" and current_request is self.data:
+            print(f"LLM_STREAM_INFO: Reasoning exceeded {self.active_budget} tokens, nudging the model to answer.")
+            self.request_data = self.client._nudge_request_data(self.data, self.splitter.reasoning_text)
+            self.splitter = ReasoningSplitter()
+            self.active_budget = max(1, self.reasoning_budget // 4)
+        else:
+            print(f"LLM_STREAM_INFO: Reasoning exceeded {self.active_budget} tokens, aborting stream.")
+        return [("delta_content", THINK_CLOSE_TAG)]
+
+    def finish(self) -> List[Tuple[str, Optional[str]]]:
+        if self.cache_key and not self.had_error and not self.client.last_reasoning_budget_exceeded \
+                and self.collected_content:
+            self.client.response_cache.put(self.cache_key, "".join(self.collected_content), self.data)
+        print("LLM_STREAM_INFO: get_response_stream generator is about to exit and yield stream_end.")
+        return [("stream_end", None)]
+
 
 class LLMClient:
     def __init__(
@@ -14,7 +242,12 @@ class LLMClient:
             base_url: str,
             system_prompt: str = "You are a helpful AI assistant.",
             max_history_turns: int = 5,  # 注意：在main.py中我们为指令生成任务设置了历史长度
-            timeout: int = 300  # 增加超时时间以应对可能较慢的流
+            timeout: int = 300,  # 增加超时时间以应对可能较慢的流
+            session: Optional[requests.Session] = None,  # 不传则使用进程内共享的连接池
+            pool_maxsize: int = DEFAULT_HTTP_POOL_MAXSIZE,
+            response_cache: Optional[LLMResponseCache] = None,  # 确定性调用 (temperature=0) 的磁盘缓存
+            router: Optional[LLMEndpointRouter] = None,  # 多端点路由；base_url 中用逗号分隔多个地址时自动使用共享路由器
+            metrics_callback: Optional[Callable[[Dict[str, Any]], None]] = None  # 每次调用结束后接收性能数据
     ):
         if not api_key:
             raise ValueError("API key cannot be empty.")
@@ -25,11 +258,27 @@ class LLMClient:
 
         self.api_key = api_key
         self.model_name = model_name
-        self.base_url = base_url.rstrip('/')
+        base_urls = parse_base_urls(base_url)
+        if not base_urls:
+            raise ValueError("Base URL cannot be empty.")
+        self.base_url = base_urls[0]
+        if router is None and len(base_urls) > 1:
+            router = get_shared_router(base_urls)
+        self.router = router
         self.system_prompt_content = system_prompt
         self.max_history_messages = max_history_turns * 2
         self.timeout = timeout
         self.history: List[Dict[str, str]] = []
+        self.session = session if session is not None else get_shared_session(pool_maxsize=pool_maxsize)
+        self.response_cache = response_cache
+        self.last_response_from_cache = False
+        self.last_stream_stopped_early = False
+        self.last_reasoning_budget_exceeded = False
+        self.metrics_callback = metrics_callback
+        self.last_call_metrics: Optional[Dict[str, Any]] = None
+        self._abort_requested = False
+        self._open_responses: set = set()
+        self._open_responses_lock = threading.Lock()
 
     def _prepare_messages(self, user_message_content: str) -> List[Dict[str, str]]:
         current_user_message = {"role": "user", "content": user_message_content}
@@ -51,100 +300,228 @@ class LLMClient:
             self,
             user_message: str,
             temperature: float = 0.7,
-            max_tokens: int = 34374  # 确保有足够的max_tokens
+            max_tokens: int = 34374,  # 确保有足够的max_tokens
+            stop_after_json: bool = False,
+            response_schema: Optional[Dict[str, Any]] = None,
+            reasoning_budget: Optional[int] = None,
+            reasoning_budget_mode: str = "abort"
     ) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        stop_after_json=True 时，一旦在 <think> 块之外收到一个完整且可解析的顶层JSON对象，就立即关闭HTTP流，
+        不再等待模型输出的尾随文本、[DONE] 或 max_tokens 上限；连接断开后服务器 (如 LM Studio) 会停止生成并释放推理槽位。
+        response_schema ({"name": ..., "schema": {...}}) 以 response_format=json_schema 发送，由服务器按模式约束解码；
+        端点以 400/422 拒绝该字段时自动去掉它重发，并记住该端点不支持，后续请求直接不带此字段。
+        reasoning_budget 限制 <think> 思考过程的 token 数 (reasoning_content 字段会被改写为 <think> 包裹的正文)。
+        超出后关闭流并补发一个 "</think>"；reasoning_budget_mode="nudge" 时再带上已有的思考要求模型直接作答
+        (续写请求的思考预算为原来的 1/4)，"abort" 时直接结束，由调用方按无效输出处理。
+        """
         if not user_message:
             yield "error", "用户消息不能为空。"
             return
 
-        endpoint = f"{self.base_url}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "Accept": "text/event-stream"
-        }
-        messages_payload = self._prepare_messages(user_message)
-        data = {
-            "model": self.model_name,
-            "messages": messages_payload,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "stream": True
-        }
+        call = _CompletionCall(self, user_message, temperature, max_tokens, stop_after_json, response_schema,
+                               reasoning_budget, reasoning_budget_mode)
+        try:
+            cached_events = call.cached_events()
+            if cached_events is not None:
+                yield from cached_events
+                return
+            while call.request_data is not None:
+                server_stream = self._merge_reasoning_field(
+                    self._stream_with_failover(call.endpoint, call.headers, call.request_data))
+                try:
+                    for event in server_stream:
+                        forward, stop = call.on_server_event(event)
+                        if forward:
+                            yield event
+                        if stop:
+                            break
+                finally:
+                    # 提前结束时关闭内部生成器，响应随之关闭，未读完的连接被断开而不是放回连接池
+                    server_stream.close()
+                yield from call.end_server_stream()
+            yield from call.finish()
+        finally:
+            # 调用方在收到 error / stream_end 后通常直接 break，放在 finally 中保证每次调用都会记录
+            self._report_call_metrics(call.call_metrics)
+
+    def _report_call_metrics(self, call_metrics: LLMCallMetrics):
+        self.last_call_metrics = call_metrics.finish(from_cache=self.last_response_from_cache,
+                                                     stopped_early=self.last_stream_stopped_early)
+        self.last_call_metrics["reasoning_budget_exceeded"] = self.last_reasoning_budget_exceeded
+        if self.metrics_callback is not None:
+            try:
+                self.metrics_callback(self.last_call_metrics)
+            except Exception as e:
+                print(f"LLM_METRICS_WARNING: metrics callback failed: {e}")
+
+    @staticmethod
+    def _merge_reasoning_field(events: Iterator[Tuple[str, Optional[str]]]) -> Iterator[Tuple[str, Optional[str]]]:
+        """把 reasoning_content 字段 (delta_reasoning 事件) 改写为 <think> 包裹的 delta_content，下游只需处理一种格式。"""
+        merger = _ReasoningFieldMerger()
+        try:
+            for event in events:
+                yield merger.feed(event)
+            yield from merger.finish()
+        finally:
+            events.close()
+
+    def _stream_with_failover(self, endpoint: str, headers: Dict[str, str], data: Dict[str, Any]
+                              ) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        配置了路由器时，按路由器的选择依次尝试各端点：在产出任何内容之前遇到连接错误或 5xx 时，吞掉该错误并切换到下一个端点；
+        已经产出内容后出错则照常返回错误事件 (调用方会按无效输出重试)。每次尝试结束后把 TTFT / 速度 / 失败情况反馈给路由器。
+        """
+        if self.router is None:
+            yield from self._stream_with_structured_fallback(endpoint, headers, data)
+            return
+        tried: List[str] = []
+        while True:
+            endpoint_attempt = _EndpointAttempt.choose(self.router, tried)
+            if endpoint_attempt is None:
+                if not tried:
+                    yield "error", NO_LLM_ENDPOINT_ERROR
+                return
+            server_stream = self._stream_with_structured_fallback(
+                f"{endpoint_attempt.base_url}/chat/completions", headers, data, endpoint_attempt.attempt)
+            try:
+                yield "endpoint", endpoint_attempt.base_url
+                for event in server_stream:
+                    if endpoint_attempt.should_fail_over(event):
+                        break
+                    yield event
+            finally:
+                server_stream.close()
+                endpoint_attempt.release()
+            if not endpoint_attempt.failed_over:
+                return
 
+    def _stream_with_structured_fallback(self, endpoint: str, headers: Dict[str, str], data: Dict[str, Any],
+                                         attempt: Optional[Dict[str, Any]] = None
+                                         ) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        带 response_format 的请求被端点以 400/422 拒绝时，去掉该字段在同一端点重发一次。
+        只有重发成功才把端点记为不支持，避免把提示过长等其他原因导致的 400 误判为不支持结构化输出。
+        """
+        attempt = attempt if attempt is not None else {}
+        data = self._structured_request_data(endpoint, data)
+        if "response_format" not in data:
+            yield from self._stream_from_server(endpoint, headers, data, attempt)
+            return
+        server_stream = self._stream_from_server(endpoint, headers, data, attempt)
+        try:
+            for event in server_stream:
+                if self._structured_output_rejected(event, attempt):
+                    break
+                self._note_structured_output(endpoint, event, True)
+                yield event
+            else:
+                return
+        finally:
+            server_stream.close()
+        fallback_stream = self._stream_from_server(endpoint, headers,
+                                                   self._structured_fallback_data(endpoint, data, attempt), attempt)
+        try:
+            for event in fallback_stream:
+                self._note_structured_output(endpoint, event, False)
+                yield event
+        finally:
+            fallback_stream.close()
+
+    def abort(self):
+        """
+        从其他线程中止本客户端进行中的流式请求：立即断开连接 (推理服务器随之停止生成)，正在读取的流以
+        LLM_REQUEST_ABORTED_ERROR 结束，不换端点重试也不写缓存；之后的请求直接返回该错误。用于一次性的辅助客户端。
+        AsyncLLMClient 不使用此机制，取消正在迭代的任务即可断开连接。
+        """
+        with self._open_responses_lock:
+            self._abort_requested = True
+            responses = list(self._open_responses)
+        for response in responses:
+            self._shutdown_response(response)
+
+    @staticmethod
+    def _shutdown_response(response: requests.Response):
+        # 关闭读方向可以唤醒阻塞在 recv 上的读取线程；直接 close 套接字做不到
+        try:
+            response.raw.shutdown()
+        except (AttributeError, ValueError, RuntimeError, OSError):
+            pass
+
+    @contextlib.contextmanager
+    def _abortable(self, response: requests.Response):
+        with self._open_responses_lock:
+            self._open_responses.add(response)
+            aborted = self._abort_requested
+        if aborted:
+            self._shutdown_response(response)
+        try:
+            yield
+        finally:
+            with self._open_responses_lock:
+                self._open_responses.discard(response)
+
+    def _stream_from_server(self, endpoint: str, headers: Dict[str, str], data: Dict[str, Any],
+                            attempt: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Optional[str]]]:
+        # attempt 用于向上层报告本次错误是否值得换一个端点重试 (连接错误、超时、5xx)，以及 HTTP 错误的状态码
+        attempt = attempt if attempt is not None else {}
+        if not self._abort_requested:
+            events = self._read_server_stream(endpoint, headers, data, attempt)
+            try:
+                # 中止后读到的 EOF 或连接错误都不是服务器的问题：统一报告为中止，不换端点重试
+                for event in events:
+                    if self._abort_requested:
+                        break
+                    yield event
+            finally:
+                events.close()
+        if self._abort_requested:
+            attempt["retryable"] = False
+            yield "error", LLM_REQUEST_ABORTED_ERROR
+
+    def _read_server_stream(self, endpoint: str, headers: Dict[str, str], data: Dict[str, Any],
+                            attempt: Dict[str, Any]) -> Iterator[Tuple[str, Optional[str]]]:
         # print(f"DEBUG LLM Request: POST {endpoint}, Data: {json.dumps(data, indent=2, ensure_ascii=False)}")
 
         try:
-            with requests.post(endpoint, headers=headers, json=data, timeout=self.timeout, stream=True) as response:
+            with self.session.post(endpoint, headers=headers, json=data, timeout=self.timeout,
+                                   stream=True) as response, self._abortable(response):
                 response.raise_for_status()
                 # print(f"DEBUG LLM Response Status: {response.status_code}")
 
                 processed_chunks_count = 0
-                # has_received_content_after_last_potential_stop = False # 用于更精细的停止逻辑
-
-                for line in response.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8', errors='replace')
-                        # print(f"LLM_STREAM_RAW_LINE: {decoded_line}") # 非常详细的日志
-
-                        if decoded_line.startswith('data: '):
-                            json_str = decoded_line[len('data: '):].strip()
-                            if json_str == "[DONE]":
-                                print("LLM_STREAM_EVENT: [DONE] received, stopping stream.")
-                                break
-                            if not json_str:
-                                # print("LLM_STREAM_EVENT: Empty data line skipped.")
-                                continue
-
-                            try:
-                                chunk = json.loads(json_str)
-                                processed_chunks_count += 1
-                                # print(f"LLM_STREAM_CHUNK_{processed_chunks_count}: {json.dumps(chunk, ensure_ascii=False)}")
-
-                                if chunk.get("choices") and len(chunk["choices"]) > 0:
-                                    choice = chunk["choices"][0]
-                                    delta = choice.get("delta", {})  # 确保delta存在
-                                    finish_reason = choice.get("finish_reason")
-
-                                    delta_content_str = None
-                                    if "content" in delta and delta["content"] is not None:
-                                        delta_content_str = delta["content"]
-                                        # print(f"LLM_STREAM_YIELDING_CONTENT: '{delta_content_str}'")
-                                        yield "delta_content", delta_content_str
-                                        # has_received_content_after_last_potential_stop = True
-
-                                    # print(f"LLM_STREAM_DEBUG: DeltaContent='{delta_content_str}', FinishReason='{finish_reason}'")
-
-                                    # 结束条件：只有当收到明确的 "stop" 或 "length" finish_reason，
-                                    # 并且当前块没有实际内容时，才中断。
-                                    # [DONE] 是更优先的结束信号。
-                                    if finish_reason in ["stop", "length"]:
-                                        if not delta_content_str:  # 如果这个块没有内容，并且是stop/length
-                                            print(
-                                                f"LLM_STREAM_INFO: Breaking due to finish_reason: '{finish_reason}' and no new content in this chunk.")
-                                            break
-                                        else:  # 这个块有内容，即使有stop/length，也处理完这个块的内容
-                                            print(
-                                                f"LLM_STREAM_INFO: Processed content with finish_reason: '{finish_reason}'. Will break if next is [DONE] or similar.")
-                                            # 让循环自然结束或等待 [DONE]
-                                            # has_received_content_after_last_potential_stop = False
-                                    elif finish_reason and finish_reason != "null":  # 其他非空的finish_reason
-                                        print(
-                                            f"LLM_STREAM_WARNING: Received unusual finish_reason: '{finish_reason}' with content: '{delta_content_str}'. Continuing stream.")
-                                        # 不因为其他 finish_reason (如 tool_calls) 而中断
-
-                            except json.JSONDecodeError as e:
-                                print(f"LLM_STREAM_ERROR: JSONDecodeError on chunk: '{json_str}'. Error: {e}")
-                                yield "error", f"流式响应JSON解析错误: {json_str}"
-                        elif decoded_line.strip():
-                            print(f"LLM_STREAM_UNHANDLED_LINE: '{decoded_line}'")  # 其他非data:开头的行
-                    # else:
-                    # print("LLM_STREAM_EVENT: Empty line from iter_lines.")
-
-                print(f"LLM_STREAM_INFO: iter_lines loop finished. Processed {processed_chunks_count} data chunks.")
+                sse_parser = SSEParser()
+                stream_finished = False
+
+                chunk_iter = self._iter_raw_chunks(response)
+                for raw_chunk in chunk_iter:
+                    for payload in sse_parser.feed(raw_chunk):
+                        if SSEParser.is_done_marker(payload):
+                            print("LLM_STREAM_EVENT: [DONE] received, stopping stream.")
+                            stream_finished = True
+                            break
+                        processed_chunks_count += 1
+                        chunk_events, should_stop = self._parse_stream_payload(payload)
+                        yield from chunk_events
+                        if should_stop:
+                            stream_finished = True
+                            break
+                    if stream_finished:
+                        break
+                else:
+                    # 服务器直接关闭了流：处理最后一个未以空行结尾的事件
+                    for payload in sse_parser.flush():
+                        if not SSEParser.is_done_marker(payload) and payload.strip():
+                            processed_chunks_count += 1
+                            yield from self._parse_stream_payload(payload)[0]
+
+                print(f"LLM_STREAM_INFO: SSE loop finished. Processed {processed_chunks_count} data chunks.")
+                self._drain_stream(chunk_iter)
 
         except requests.exceptions.HTTPError as http_err:
             error_details = f"HTTP错误: {http_err}"
+            attempt["retryable"] = http_err.response is not None and http_err.response.status_code >= 500
+            attempt["status_code"] = http_err.response.status_code if http_err.response is not None else None
             try:
                 error_details += f" - 响应状态: {response.status_code} - 响应内容: {response.text}"
             except:
@@ -152,9 +529,11 @@ class LLMClient:
             yield "error", error_details
             print(f"LLM_STREAM_ERROR: {error_details}")
         except requests.exceptions.ConnectionError as conn_err:
+            attempt["retryable"] = True
             yield "error", f"连接错误: {conn_err}"
             print(f"LLM_STREAM_ERROR: Connection error: {conn_err}")
         except requests.exceptions.Timeout as timeout_err:
+            attempt["retryable"] = True
             yield "error", f"超时错误: {timeout_err}"
             print(f"LLM_STREAM_ERROR: Timeout error: {timeout_err}")
         except requests.exceptions.RequestException as req_err:
@@ -166,8 +545,170 @@ class LLMClient:
             yield "error", error_msg
             print(f"LLM_STREAM_ERROR: Unexpected error in get_response_stream: {error_msg}")
 
-        print("LLM_STREAM_INFO: get_response_stream generator is about to exit and yield stream_end.")
-        yield "stream_end", None
+    @staticmethod
+    def _json_object_closed(json_detector: StreamingActionParser, content: str) -> bool:
+        # 只在对象能被完整解析时才提前结束；第一个平衡的对象解析失败 (如正文里的花括号) 时按原样读完整个流
+        for event_type, value in json_detector.feed(content):
+            if event_type == "object_complete":
+                return value is not None
+        return False
+
+    @staticmethod
+    def _reasoning_over_budget(splitter: ReasoningSplitter, content: str, budget: int) -> bool:
+        splitter.feed(content)
+        return splitter.in_reasoning and splitter.reasoning_tokens > budget
+
+    @staticmethod
+    def _nudge_request_data(data: Dict[str, Any], reasoning_text: str) -> Dict[str, Any]:
+        # 已有的思考作为普通文本 (不带 <think> 标签) 放进 assistant 消息，部分聊天模板会删除历史消息中的思考块
+        nudged = dict(data)
+        nudged["messages"] = list(data["messages"]) + [
+            {"role": "assistant", "content": reasoning_text},
+            {"role": "user", "content": REASONING_BUDGET_NUDGE_PROMPT},
+        ]
+        return nudged
+
+    def _cache_key_for(self, request_data: Dict[str, Any]) -> Optional[str]:
+        # 只有确定性的调用 (temperature=0) 才能安全地复用缓存结果
+        if self.response_cache is None or request_data.get("temperature") != 0:
+            return None
+        return self.response_cache.make_key(request_data)
+
+    @staticmethod
+    def _replay_cached_completion(completion: str, piece_size: int = 64) -> Iterator[Tuple[str, Optional[str]]]:
+        # 按小段重放缓存内容，前端依旧能以流式方式显示
+        for i in range(0, len(completion), piece_size):
+            yield "delta_content", completion[i:i + piece_size]
+
+    def _prepare_request(self, user_message: str, temperature: float, max_tokens: int,
+                         response_schema: Optional[Dict[str, Any]] = None
+                         ) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        endpoint = f"{self.base_url}/chat/completions"
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
+        }
+        data = {
+            "model": self.model_name,
+            "messages": self._prepare_messages(user_message),
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        if response_schema:
+            data["response_format"] = {"type": "json_schema", "json_schema": response_schema}
+        return endpoint, headers, data
+
+    @staticmethod
+    def _without_response_format(data: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in data.items() if key != "response_format"}
+
+    @classmethod
+    def _structured_request_data(cls, endpoint: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        # 已知不支持结构化输出的端点直接不带 response_format
+        if "response_format" in data and get_structured_output_support(endpoint) is False:
+            return cls._without_response_format(data)
+        return data
+
+    @staticmethod
+    def _structured_output_rejected(event: Tuple[str, Optional[str]], attempt: Dict[str, Any]) -> bool:
+        return event[0] == "error" and attempt.get("status_code") in STRUCTURED_OUTPUT_UNSUPPORTED_STATUSES
+
+    @staticmethod
+    def _note_structured_output(endpoint: str, event: Tuple[str, Optional[str]], supported: bool):
+        # 收到正文才说明这次请求 (带或不带 response_format) 被端点接受
+        if event[0] == "delta_content":
+            set_structured_output_support(endpoint, supported)
+
+    @classmethod
+    def _structured_fallback_data(cls, endpoint: str, data: Dict[str, Any], attempt: Dict[str, Any]) -> Dict[str, Any]:
+        print(f"LLM_STREAM_INFO: {endpoint} rejected response_format (HTTP {attempt['status_code']}), retrying without it.")
+        attempt.update(retryable=False, status_code=None)
+        return cls._without_response_format(data)
+
+    @staticmethod
+    def _iter_raw_chunks(response: requests.Response) -> Iterator[bytes]:
+        # 分块传输时按到达的 HTTP 块产出；否则用 read1 读取当前可用的数据，避免为凑满固定大小而阻塞。
+        # requests 以 decode_content=False 打开原始流，代理返回 gzip/deflate 压缩的 SSE 时需要显式解压
+        if getattr(response.raw, "chunked", False) or not hasattr(response.raw, "read1"):
+            return response.iter_content(chunk_size=None)
+        return iter(lambda: response.raw.read1(65536, decode_content=True), b"")
+
+    @classmethod
+    def _parse_stream_payload(cls, payload: str) -> Tuple[List[Tuple[str, Optional[str]]], bool]:
+        """解析一个 SSE data 负载，返回 (要产出的事件列表, 是否应结束流)。同步与异步客户端共用此逻辑。"""
+        try:
+            chunk = loads_payload(payload)
+        except json.JSONDecodeError as e:
+            if not payload.strip():
+                return [], False
+            if "\n" in payload:
+                # 部分服务器连续发送多行 data: 却不以空行分隔，按规范会被拼接成一个事件，这里逐行兼容解析
+                events: List[Tuple[str, Optional[str]]] = []
+                for line_payload in payload.split("\n"):
+                    if SSEParser.is_done_marker(line_payload):
+                        return events, True
+                    if line_payload.strip():
+                        line_events, should_stop = cls._parse_stream_payload(line_payload)
+                        events.extend(line_events)
+                        if should_stop:
+                            return events, True
+                return events, False
+            print(f"LLM_STREAM_ERROR: JSONDecodeError on chunk: '{payload}'. Error: {e}")
+            return [("error", f"流式响应JSON解析错误: {payload}")], False
+        return cls._events_from_chunk(chunk)
+
+    @staticmethod
+    def _events_from_chunk(chunk: Dict[str, Any]) -> Tuple[List[Tuple[str, Optional[str]]], bool]:
+        events: List[Tuple[str, Optional[str]]] = []
+        # print(f"LLM_STREAM_CHUNK: {json.dumps(chunk, ensure_ascii=False)}")
+
+        if chunk.get("usage"):  # 部分服务器在最后一个块 (choices 可能为空) 中附带 token 用量
+            events.append(("usage", chunk["usage"]))
+        if not (chunk.get("choices") and len(chunk["choices"]) > 0):
+            return events, False
+        choice = chunk["choices"][0]
+        delta = choice.get("delta", {})  # 确保delta存在
+        finish_reason = choice.get("finish_reason")
+        if finish_reason:
+            events.append(("finish_reason", finish_reason))
+
+        # vLLM、LM Studio 等把推理模型的思考过程放在单独的 reasoning_content 字段中
+        reasoning_str = delta.get("reasoning_content") or delta.get("reasoning")
+        if isinstance(reasoning_str, str) and reasoning_str:
+            events.append(("delta_reasoning", reasoning_str))
+
+        delta_content_str = None
+        if "content" in delta and delta["content"] is not None:
+            delta_content_str = delta["content"]
+            events.append(("delta_content", delta_content_str))
+
+        # 结束条件：只有当收到明确的 "stop" 或 "length" finish_reason，
+        # 并且当前块没有实际内容时，才中断。
+        # [DONE] 是更优先的结束信号。
+        if finish_reason in ["stop", "length"]:
+            if not delta_content_str:  # 如果这个块没有内容，并且是stop/length
+                print(f"LLM_STREAM_INFO: Breaking due to finish_reason: '{finish_reason}' and no new content in this chunk.")
+                return events, True
+            # 这个块有内容，即使有stop/length，也处理完这个块的内容，让循环自然结束或等待 [DONE]
+            print(f"LLM_STREAM_INFO: Processed content with finish_reason: '{finish_reason}'. Will break if next is [DONE] or similar.")
+        elif finish_reason and finish_reason != "null":  # 其他非空的finish_reason
+            # 不因为其他 finish_reason (如 tool_calls) 而中断
+            print(f"LLM_STREAM_WARNING: Received unusual finish_reason: '{finish_reason}' with content: '{delta_content_str}'. Continuing stream.")
+        return events, False
+
+    @staticmethod
+    def _drain_stream(chunk_iter: Iterator[bytes], max_chunks: int = 64):
+        # [DONE] 之后通常只剩下分块传输的结束标记。把同一个迭代器读到底，连接才能干净地回到连接池被下一次请求复用；
+        # 提前中断的迭代器会让 urllib3 认为该连接已失效而重新握手。剩余内容过多时放弃复用，由关闭响应来断开连接。
+        try:
+            for drained_count, _ in enumerate(chunk_iter):
+                if drained_count >= max_chunks:
+                    print("LLM_STREAM_WARNING: Too much data after end of stream, connection will not be reused.")
+                    break
+        except Exception as e:
+            print(f"LLM_STREAM_WARNING: Failed to drain stream for connection reuse: {e}")
 
     def clear_history(self):
         self.history = []
@@ -181,6 +722,309 @@ class LLMClient:
         print(f"系统提示词已更新为： '{new_system_prompt}'")
 
 
+class AsyncLLMClient(LLMClient):
+    """
+    LLMClient 的 asyncio 版本。get_response_stream 是异步迭代器，产出的事件与同步版本完全一致
+    ("delta_content" / "error" / "stream_end")，多个配置会话可以在同一个事件循环上并发，而不必各占一个线程。
+    仅依赖标准库：自行实现 HTTP/1.1 请求与分块传输解码，并在同一事件循环内复用空闲的 keep-alive 连接。
+    一个实例只应在一个事件循环中使用。
+    """
+
+    def __init__(self, *args, max_idle_connections: int = DEFAULT_HTTP_POOL_MAXSIZE, **kwargs):
+        kwargs.pop("session", None)
+        kwargs.pop("pool_maxsize", None)
+        super().__init__(*args, session=None, **kwargs)
+        self.session = None  # 异步客户端不使用 requests.Session
+        self.max_idle_connections = max_idle_connections
+        self._idle_connections: Dict[Tuple[str, str, int], List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+
+    async def __aenter__(self) -> "AsyncLLMClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        for connections in self._idle_connections.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle_connections = {}
+
+    async def _open_connection(self, scheme: str, host: str, port: int
+                               ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        idle = self._idle_connections.get((scheme, host, port))
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        ssl_context = ssl.create_default_context() if scheme == "https" else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context, server_hostname=host if ssl_context else None),
+            timeout=self.timeout)
+        return reader, writer, False
+
+    def _release_connection(self, key: Tuple[str, str, int], reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter):
+        idle = self._idle_connections.setdefault(key, [])
+        if len(idle) < self.max_idle_connections and not writer.is_closing():
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def _read_response_head(self, reader: asyncio.StreamReader) -> Tuple[int, str, Dict[str, str]]:
+        status_line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+        if not status_line:
+            raise ConnectionError("服务器在返回响应前关闭了连接")
+        parts = status_line.decode("latin-1").strip().split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise ConnectionError(f"无效的HTTP响应行: {status_line!r}")
+        status_code = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ""
+        response_headers: Dict[str, str] = {}
+        while True:
+            header_line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+            if header_line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header_line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        return status_code, reason, response_headers
+
+    async def _iter_body(self, reader: asyncio.StreamReader, response_headers: Dict[str, str]
+                         ) -> AsyncIterator[bytes]:
+        if "chunked" in response_headers.get("transfer-encoding", "").lower():
+            while True:
+                size_line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+                if not size_line:
+                    raise ConnectionError("分块传输在结束标记前中断")
+                chunk_size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                if chunk_size == 0:
+                    # 读掉可能存在的 trailer 以及最后的空行
+                    while (await asyncio.wait_for(reader.readline(), timeout=self.timeout)) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                chunk_data = await asyncio.wait_for(reader.readexactly(chunk_size + 2), timeout=self.timeout)
+                yield chunk_data[:-2]
+        elif "content-length" in response_headers:
+            remaining = int(response_headers["content-length"])
+            while remaining > 0:
+                body_data = await asyncio.wait_for(reader.read(min(remaining, 65536)), timeout=self.timeout)
+                if not body_data:
+                    raise ConnectionError("响应体在 Content-Length 之前中断")
+                remaining -= len(body_data)
+                yield body_data
+        else:
+            while True:
+                body_data = await asyncio.wait_for(reader.read(65536), timeout=self.timeout)
+                if not body_data:
+                    return
+                yield body_data
+
+    async def get_response_stream(
+            self,
+            user_message: str,
+            temperature: float = 0.7,
+            max_tokens: int = 34374,
+            stop_after_json: bool = False,
+            response_schema: Optional[Dict[str, Any]] = None,
+            reasoning_budget: Optional[int] = None,
+            reasoning_budget_mode: str = "abort"
+    ) -> AsyncIterator[Tuple[str, Optional[str]]]:
+        if not user_message:
+            yield "error", "用户消息不能为空。"
+            return
+
+        call = _CompletionCall(self, user_message, temperature, max_tokens, stop_after_json, response_schema,
+                               reasoning_budget, reasoning_budget_mode)
+        try:
+            cached_events = call.cached_events()
+            if cached_events is not None:
+                for event in cached_events:
+                    yield event
+                return
+            while call.request_data is not None:
+                server_stream = self._merge_reasoning_field(
+                    self._stream_with_failover(call.endpoint, call.headers, call.request_data))
+                try:
+                    async for event in server_stream:
+                        forward, stop = call.on_server_event(event)
+                        if forward:
+                            yield event
+                        if stop:
+                            break
+                finally:
+                    await server_stream.aclose()
+                for event in call.end_server_stream():
+                    yield event
+            for event in call.finish():
+                yield event
+        finally:
+            self._report_call_metrics(call.call_metrics)
+
+    @staticmethod
+    async def _merge_reasoning_field(events: AsyncIterator[Tuple[str, Optional[str]]]
+                                     ) -> AsyncIterator[Tuple[str, Optional[str]]]:
+        merger = _ReasoningFieldMerger()
+        try:
+            async for event in events:
+                yield merger.feed(event)
+            for event in merger.finish():
+                yield event
+        finally:
+            await events.aclose()
+
+    async def _stream_with_failover(self, endpoint: str, headers: Dict[str, str], data: Dict[str, Any]
+                                    ) -> AsyncIterator[Tuple[str, Optional[str]]]:
+        # 与同步版本相同的端点选择与故障切换逻辑
+        if self.router is None:
+            async for event in self._stream_with_structured_fallback(endpoint, headers, data):
+                yield event
+            return
+        tried: List[str] = []
+        while True:
+            endpoint_attempt = _EndpointAttempt.choose(self.router, tried)
+            if endpoint_attempt is None:
+                if not tried:
+                    yield "error", NO_LLM_ENDPOINT_ERROR
+                return
+            server_stream = self._stream_with_structured_fallback(
+                f"{endpoint_attempt.base_url}/chat/completions", headers, data, endpoint_attempt.attempt)
+            try:
+                yield "endpoint", endpoint_attempt.base_url
+                async for event in server_stream:
+                    if endpoint_attempt.should_fail_over(event):
+                        break
+                    yield event
+            finally:
+                await server_stream.aclose()
+                endpoint_attempt.release()
+            if not endpoint_attempt.failed_over:
+                return
+
+    async def _stream_with_structured_fallback(self, endpoint: str, headers: Dict[str, str], data: Dict[str, Any],
+                                               attempt: Optional[Dict[str, Any]] = None
+                                               ) -> AsyncIterator[Tuple[str, Optional[str]]]:
+        # 与同步版本相同的结构化输出回退逻辑
+        attempt = attempt if attempt is not None else {}
+        data = self._structured_request_data(endpoint, data)
+        if "response_format" not in data:
+            async for event in self._stream_from_server(endpoint, headers, data, attempt):
+                yield event
+            return
+        server_stream = self._stream_from_server(endpoint, headers, data, attempt)
+        try:
+            async for event in server_stream:
+                if self._structured_output_rejected(event, attempt):
+                    break
+                self._note_structured_output(endpoint, event, True)
+                yield event
+            else:
+                return
+        finally:
+            await server_stream.aclose()
+        fallback_stream = self._stream_from_server(endpoint, headers,
+                                                   self._structured_fallback_data(endpoint, data, attempt), attempt)
+        try:
+            async for event in fallback_stream:
+                self._note_structured_output(endpoint, event, False)
+                yield event
+        finally:
+            await fallback_stream.aclose()
+
+    async def _stream_from_server(self, endpoint: str, headers: Dict[str, str], data: Dict[str, Any],
+                                  attempt: Optional[Dict[str, Any]] = None
+                                  ) -> AsyncIterator[Tuple[str, Optional[str]]]:
+        attempt = attempt if attempt is not None else {}
+        url = urllib.parse.urlsplit(endpoint)
+        scheme = url.scheme or "http"
+        host = url.hostname or ""
+        port = url.port or (443 if scheme == "https" else 80)
+        path = url.path + (f"?{url.query}" if url.query else "")
+        key = (scheme, host, port)
+        body = json.dumps(data).encode("utf-8")
+        host_header = host if url.port is None else f"{host}:{port}"
+        request_head = (f"POST {path} HTTP/1.1\r\nHost: {host_header}\r\n"
+                        + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+                        + f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n").encode("latin-1")
+
+        writer: Optional[asyncio.StreamWriter] = None
+        reusable = False
+        try:
+            # 复用的空闲连接可能已被服务器关闭，此时换一条新连接重发一次
+            for connect_try in range(2):
+                reader, writer, from_pool = await self._open_connection(scheme, host, port)
+                try:
+                    writer.write(request_head + body)
+                    await writer.drain()
+                    status_code, reason, response_headers = await self._read_response_head(reader)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    writer = None
+                    if not from_pool or connect_try > 0:
+                        raise
+
+            if status_code >= 400:
+                attempt["retryable"] = status_code >= 500
+                attempt["status_code"] = status_code
+                error_body = b"".join([piece async for piece in self._iter_body(reader, response_headers)])
+                error_details = (f"HTTP错误: {status_code} {reason} for url: {endpoint}"
+                                 f" - 响应状态: {status_code} - 响应内容: {error_body.decode('utf-8', errors='replace')}")
+                yield "error", error_details
+                print(f"LLM_STREAM_ERROR: {error_details}")
+            else:
+                processed_chunks_count = 0
+                sse_parser = SSEParser()
+                stream_finished = False
+                body_iter = self._iter_body(reader, response_headers)
+                async for body_piece in body_iter:
+                    for payload in sse_parser.feed(body_piece):
+                        if SSEParser.is_done_marker(payload):
+                            print("LLM_STREAM_EVENT: [DONE] received, stopping stream.")
+                            stream_finished = True
+                            break
+                        processed_chunks_count += 1
+                        chunk_events, should_stop = self._parse_stream_payload(payload)
+                        for event in chunk_events:
+                            yield event
+                        if should_stop:
+                            stream_finished = True
+                            break
+                    if stream_finished:
+                        break
+                else:
+                    for payload in sse_parser.flush():
+                        if not SSEParser.is_done_marker(payload) and payload.strip():
+                            processed_chunks_count += 1
+                            for event in self._parse_stream_payload(payload)[0]:
+                                yield event
+                print(f"LLM_STREAM_INFO: async stream loop finished. Processed {processed_chunks_count} data chunks.")
+                # 与同步版本一致：把剩余的结束标记读完，连接才能复用
+                async for _ in body_iter:
+                    pass
+            reusable = response_headers.get("connection", "").lower() != "close"
+        except (asyncio.TimeoutError, TimeoutError) as timeout_err:
+            attempt["retryable"] = True
+            yield "error", f"超时错误: {timeout_err!r}"
+            print(f"LLM_STREAM_ERROR: Timeout error: {timeout_err!r}")
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, ssl.SSLError) as conn_err:
+            attempt["retryable"] = True
+            yield "error", f"连接错误: {conn_err}"
+            print(f"LLM_STREAM_ERROR: Connection error: {conn_err}")
+        except Exception as e:
+            import traceback
+            error_msg = f"获取流式响应时发生意外错误: {e}\n{traceback.format_exc()}"
+            yield "error", error_msg
+            print(f"LLM_STREAM_ERROR: Unexpected error in async get_response_stream: {error_msg}")
+        finally:
+            # 调用方提前停止迭代时连接上可能还有未读数据，只有完整读完的连接才放回池中
+            if writer is not None:
+                if reusable:
+                    self._release_connection(key, reader, writer)
+                else:
+                    writer.close()
+
+
 # Example Usage (for llm.py standalone testing)
 if __name__ == "__main__":
     print("LLM 客户端流式响应示例 (需要有效的API凭据和端点)")
@@ -0,0 +1,119 @@
+# llm_cache.py
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# 参与缓存键计算的请求字段：模型名、完整消息（含系统提示）以及采样参数
+CACHE_KEY_FIELDS = ("model", "messages", "temperature", "max_tokens", "top_p", "response_format")
+
+
+class LLMResponseCache:
+    """
+    基于内容寻址的LLM响应磁盘缓存，仅用于确定性调用（temperature=0）。
+    每条缓存是一个以请求摘要命名的JSON文件；命中时更新文件 mtime，超过容量上限时按 mtime 淘汰最久未使用的条目 (LRU)。
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, int]] = {}  # key -> (最后访问时间, 文件大小)
+        self._total_bytes = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(request_data: Dict[str, Any]) -> str:
+        key_material = {field: request_data.get(field) for field in CACHE_KEY_FIELDS}
+        canonical = json.dumps(key_material, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self):
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            self._entries[name[:-len(".json")]] = (st.st_mtime, st.st_size)
+            self._total_bytes += st.st_size
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path_for(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+                completion = record["completion"]
+                now = time.time()
+                os.utime(path, (now, now))
+                self._entries[key] = (now, self._entries[key][1])
+            except (OSError, ValueError, KeyError) as e:
+                print(f"LLM_CACHE_WARNING: Dropping unreadable cache entry {key}: {e}")
+                self._remove_entry(key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return completion
+
+    def put(self, key: str, completion: str, request_data: Optional[Dict[str, Any]] = None):
+        record = {"completion": completion, "created_at": time.time(),
+                  "model": (request_data or {}).get("model")}
+        payload = json.dumps(record, ensure_ascii=False).encode("utf-8")
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            path = self._path_for(key)
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)  # 原子替换，避免并发读到半个文件
+            except OSError as e:
+                print(f"LLM_CACHE_WARNING: Failed to write cache entry {key}: {e}")
+                return
+            if key in self._entries:
+                self._total_bytes -= self._entries[key][1]
+            self._entries[key] = (time.time(), len(payload))
+            self._total_bytes += len(payload)
+            self._evict_if_needed()
+
+    def _remove_entry(self, key: str):
+        _, size = self._entries.pop(key, (0.0, 0))
+        self._total_bytes -= size
+        try:
+            os.remove(self._path_for(key))
+        except OSError:
+            pass
+
+    def _evict_if_needed(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key, _ in sorted(self._entries.items(), key=lambda item: item[1][0]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._remove_entry(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "total_bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove_entry(key)
@@ -0,0 +1,143 @@
+# llm_metrics.py
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class LLMCallMetrics:
+    """
+    单次 get_response_stream 调用的性能数据：首 token 延迟 (TTFT)、总耗时、delta 事件数、输出速度、提示大小和结束原因。
+    prompt_tokens / completion_tokens 只有在服务器返回 usage 时才有值 (llama.cpp、vLLM 等会在最后一个块中附带)，
+    否则输出速度按 delta 事件数估算 (OpenAI 兼容服务器通常每个 token 一个事件)。
+    """
+
+    def __init__(self, request_data: Dict[str, Any], endpoint: Optional[str] = None):
+        messages = request_data.get("messages") or []
+        self.model = request_data.get("model")
+        self.temperature = request_data.get("temperature")
+        self.max_tokens = request_data.get("max_tokens")
+        self.prompt_messages = len(messages)
+        self.prompt_chars = sum(len(message.get("content") or "") for message in messages)
+        self.endpoint = endpoint
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.delta_count = 0
+        self.output_chars = 0
+        self.finish_reason: Optional[str] = None
+        self.usage: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+
+    def on_event(self, event_type: str, value: Any):
+        if event_type == "delta_content":
+            if self.first_token_at is None:
+                self.first_token_at = time.monotonic()
+            self.delta_count += 1
+            self.output_chars += len(value or "")
+        elif event_type == "error":
+            self.error = str(value)[:500]
+        elif event_type == "finish_reason":
+            self.finish_reason = value
+        elif event_type == "usage" and isinstance(value, dict):
+            self.usage = value
+        elif event_type == "endpoint":
+            self.endpoint = value
+
+    def finish(self, from_cache: bool = False, stopped_early: bool = False) -> Dict[str, Any]:
+        finished_at = time.monotonic()
+        ttft = (self.first_token_at - self.started_at) if self.first_token_at is not None else None
+        prompt_tokens = (self.usage or {}).get("prompt_tokens")
+        completion_tokens = (self.usage or {}).get("completion_tokens")
+        output_tokens = completion_tokens if completion_tokens else self.delta_count
+        generation_seconds = (finished_at - self.first_token_at) if self.first_token_at is not None else 0.0
+        tokens_per_sec = output_tokens / generation_seconds if output_tokens > 1 and generation_seconds > 0 else None
+        finish_reason = self.finish_reason
+        if stopped_early:
+            finish_reason = "early_stop"
+        elif self.error:
+            finish_reason = "error"
+        elif finish_reason is None:
+            finish_reason = "cached" if from_cache else "incomplete"  # incomplete: 调用方在流结束前停止了读取
+        return {
+            "model": self.model, "endpoint": None if from_cache else self.endpoint, "temperature": self.temperature,
+            "max_tokens": self.max_tokens, "prompt_messages": self.prompt_messages, "prompt_chars": self.prompt_chars,
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "ttft": ttft, "total_time": finished_at - self.started_at, "delta_count": self.delta_count,
+            "output_chars": self.output_chars, "tokens_per_sec": tokens_per_sec, "finish_reason": finish_reason,
+            "from_cache": from_cache, "stopped_early": stopped_early, "error": self.error,
+        }
+
+
+SLOWEST_COMMANDS_KEPT = 5
+
+
+class SessionMetrics:
+    """
+    按配置会话汇总 LLM 调用和命令执行的耗时，用于判断慢在模型、提示大小还是命令执行。
+    命令带有资源使用数据 (command_executor.build_resource_usage) 时，还汇总 CPU 时间、峰值内存、输出字节数和最慢的几条命令。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: List[Dict[str, Any]] = []
+        self.command_count = 0
+        self.command_seconds = 0.0
+        self.command_user_cpu_seconds = 0.0
+        self.command_sys_cpu_seconds = 0.0
+        self.command_peak_rss_bytes: Optional[int] = None
+        self.command_output_bytes = 0
+        self.slowest_commands: List[Dict[str, Any]] = []
+
+    def record_call(self, call_metrics: Dict[str, Any]):
+        with self._lock:
+            self.calls.append(call_metrics)
+
+    def record_command(self, duration_seconds: float, command: Optional[str] = None,
+                       resource_usage: Optional[Dict[str, Any]] = None):
+        usage = resource_usage or {}
+        with self._lock:
+            self.command_count += 1
+            self.command_seconds += duration_seconds
+            self.command_user_cpu_seconds += usage.get("user_cpu_seconds") or 0.0
+            self.command_sys_cpu_seconds += usage.get("sys_cpu_seconds") or 0.0
+            if usage.get("peak_rss_bytes") is not None:
+                self.command_peak_rss_bytes = max(self.command_peak_rss_bytes or 0, usage["peak_rss_bytes"])
+            self.command_output_bytes += (usage.get("stdout_bytes") or 0) + (usage.get("stderr_bytes") or 0)
+            if command is not None:
+                cpu_seconds = None
+                if usage.get("user_cpu_seconds") is not None:
+                    cpu_seconds = usage["user_cpu_seconds"] + (usage.get("sys_cpu_seconds") or 0.0)
+                self.slowest_commands.append({"command": command[:200], "seconds": duration_seconds,
+                                              "cpu_seconds": cpu_seconds,
+                                              "peak_rss_bytes": usage.get("peak_rss_bytes")})
+                self.slowest_commands.sort(key=lambda c: c["seconds"], reverse=True)
+                del self.slowest_commands[SLOWEST_COMMANDS_KEPT:]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self.calls)
+            command_count, command_seconds = self.command_count, self.command_seconds
+            command_usage = {
+                "command_user_cpu_seconds": self.command_user_cpu_seconds,
+                "command_sys_cpu_seconds": self.command_sys_cpu_seconds,
+                "command_peak_rss_bytes": self.command_peak_rss_bytes,
+                "command_output_bytes": self.command_output_bytes,
+                "slowest_commands": [dict(c) for c in self.slowest_commands],
+            }
+        ttfts = [c["ttft"] for c in calls if c.get("ttft") is not None and not c.get("from_cache")]
+        speeds = [c["tokens_per_sec"] for c in calls if c.get("tokens_per_sec") and not c.get("from_cache")]
+        return {
+            "llm_calls": len(calls),
+            "llm_seconds": sum(c.get("total_time") or 0.0 for c in calls),
+            "avg_ttft": sum(ttfts) / len(ttfts) if ttfts else None,
+            "max_ttft": max(ttfts) if ttfts else None,
+            "avg_tokens_per_sec": sum(speeds) / len(speeds) if speeds else None,
+            "total_prompt_chars": sum(c.get("prompt_chars") or 0 for c in calls),
+            "total_output_deltas": sum(c.get("delta_count") or 0 for c in calls),
+            "cache_hits": sum(1 for c in calls if c.get("from_cache")),
+            "early_stops": sum(1 for c in calls if c.get("stopped_early")),
+            "errors": sum(1 for c in calls if c.get("error")),
+            "command_count": command_count,
+            "command_seconds": command_seconds,
+            **command_usage,
+        }
@@ -0,0 +1,131 @@
+# llm_router.py
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 用于把 TTFT 和生成速度折算成"预计完成一次请求的时间"的参考输出长度 (token)
+REFERENCE_OUTPUT_TOKENS = 1000
+
+
+def parse_base_urls(value: str) -> List[str]:
+    """解析逗号 (或空白) 分隔的多个 Base URL，去掉末尾的 '/' 并去重，保持原有顺序。"""
+    urls: List[str] = []
+    for part in value.replace(",", " ").split():
+        url = part.strip().rstrip("/")
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+class EndpointStats:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.in_flight = 0
+        self.ewma_ttft: Optional[float] = None  # 首 token 延迟 (秒)
+        self.ewma_tokens_per_sec: Optional[float] = None
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"base_url": self.base_url, "in_flight": self.in_flight, "ewma_ttft": self.ewma_ttft,
+                "ewma_tokens_per_sec": self.ewma_tokens_per_sec, "consecutive_failures": self.consecutive_failures,
+                "total_requests": self.total_requests, "total_failures": self.total_failures}
+
+
+class LLMEndpointRouter:
+    """
+    多个 OpenAI 兼容推理端点之间的路由器，由同一进程内的所有 LLMClient 共享。
+    每个端点记录进行中的请求数，以及首 token 延迟 (TTFT) 和生成速度 (tokens/sec) 的指数移动平均。
+    choose() 选择预计完成时间最短的端点，预计时间 = (TTFT + 参考长度 / 速度) * (进行中请求数 + 1)；
+    还没有统计数据的端点优先被选中，以便尽快测出其性能。
+    连接错误或 5xx 会让端点进入冷却期 (连续失败时冷却期倍增)，冷却期内只有在没有其他可用端点时才会被选中。
+    """
+
+    def __init__(self, base_urls: Iterable[str], ewma_alpha: float = 0.3, failure_cooldown: float = 15.0,
+                 max_cooldown: float = 300.0):
+        self._endpoints: Dict[str, EndpointStats] = {url: EndpointStats(url) for url in base_urls}
+        if not self._endpoints:
+            raise ValueError("LLM endpoint pool cannot be empty.")
+        self.ewma_alpha = ewma_alpha
+        self.failure_cooldown = failure_cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+
+    @property
+    def base_urls(self) -> List[str]:
+        return list(self._endpoints)
+
+    def _expected_cost(self, stats: EndpointStats) -> float:
+        if stats.ewma_ttft is None:
+            return 0.0
+        generation_time = REFERENCE_OUTPUT_TOKENS / stats.ewma_tokens_per_sec if stats.ewma_tokens_per_sec else 0.0
+        return (stats.ewma_ttft + generation_time) * (stats.in_flight + 1)
+
+    def choose(self, exclude: Iterable[str] = ()) -> Optional[str]:
+        """选择下一个请求使用的端点并把它的进行中计数加一；所有端点都已排除时返回 None。调用方用完后必须调用 release()。"""
+        excluded = set(exclude)
+        now = time.monotonic()
+        with self._lock:
+            candidates = [stats for url, stats in self._endpoints.items() if url not in excluded]
+            if not candidates:
+                return None
+            healthy = [stats for stats in candidates if stats.cooldown_until <= now]
+            pool = healthy or sorted(candidates, key=lambda stats: stats.cooldown_until)[:1]
+            best = min(pool, key=lambda stats: (self._expected_cost(stats), stats.in_flight))
+            best.in_flight += 1
+            best.total_requests += 1
+            return best.base_url
+
+    def release(self, base_url: str, ttft: Optional[float] = None, output_tokens: int = 0,
+                generation_seconds: float = 0.0, failed: bool = False):
+        with self._lock:
+            stats = self._endpoints.get(base_url)
+            if stats is None:
+                return
+            stats.in_flight = max(0, stats.in_flight - 1)
+            if failed:
+                stats.total_failures += 1
+                stats.consecutive_failures += 1
+                cooldown = min(self.max_cooldown, self.failure_cooldown * 2 ** (stats.consecutive_failures - 1))
+                stats.cooldown_until = time.monotonic() + cooldown
+                return
+            stats.consecutive_failures = 0
+            stats.cooldown_until = 0.0
+            if ttft is not None:
+                stats.ewma_ttft = self._ewma(stats.ewma_ttft, ttft)
+            if output_tokens > 1 and generation_seconds > 0:
+                stats.ewma_tokens_per_sec = self._ewma(stats.ewma_tokens_per_sec, output_tokens / generation_seconds)
+
+    def _ewma(self, previous: Optional[float], sample: float) -> float:
+        if previous is None:
+            return sample
+        return self.ewma_alpha * sample + (1 - self.ewma_alpha) * previous
+
+    def has_alternative(self, exclude: Iterable[str]) -> bool:
+        excluded = set(exclude)
+        return any(url not in excluded for url in self._endpoints)
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        with self._lock:
+            return [stats.to_dict() for stats in self._endpoints.values()]
+
+
+_shared_routers: Dict[Tuple[str, ...], LLMEndpointRouter] = {}
+_shared_routers_lock = threading.Lock()
+
+
+def get_shared_router(base_urls: Iterable[str]) -> LLMEndpointRouter:
+    """
+    返回进程内共享的路由器 (以端点列表为键)。
+    main.py 在修改配置、开始新任务时会重建 LLMClient，共享路由器可以保留已测得的延迟统计和进行中的请求计数。
+    """
+    key = tuple(base_urls)
+    with _shared_routers_lock:
+        router = _shared_routers.get(key)
+        if router is None:
+            router = LLMEndpointRouter(key)
+            _shared_routers[key] = router
+        return router
@@ -2,20 +2,52 @@ from flask import Flask, render_template, request
 from flask_socketio import SocketIO
 import os
 import platform
+import queue
 import threading
 import time
-import shutil
+import itertools
 import json
 import re
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional, List, Dict, Any, Tuple, Union
+import command_scheduler
+import git_mirror
 import llm
+import llm_cache
+import llm_metrics
+import output_capture
+import readme_chunking
+import stream_json
+import token_counter
 import command_executor as executor
 
 
 LLM_API_KEY = os.environ.get("LMSTUDIO_API_KEY", "lmstudio")
 LLM_MODEL_NAME = os.environ.get("LMSTUDIO_MODEL", "nikolaykozloff/deepseek-r1-0528-qwen3-8b")
+# 可用逗号分隔多个 OpenAI 兼容端点，请求会按各端点的首 token 延迟、生成速度和进行中请求数分配，失败时自动切换
 LLM_BASE_URL = os.environ.get("LMSTUDIO_BASE_URL", "http://192.168.0.32:1234/v1")
+# LLM HTTP 连接池大小。客户端在连接/开始任务/修改配置时会重建，但连接池在进程内共享，已建立的连接不会被丢弃
+LLM_HTTP_POOL_MAXSIZE = int(os.environ.get("LLM_HTTP_POOL_MAXSIZE", "10"))
+# 确定性LLM调用 (temperature=0，例如README提取) 的磁盘缓存。重复配置同一仓库时可直接复用结果
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", os.path.join(os.path.expanduser('~'), ".agentic_env_setup", "llm_cache"))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024
+# 收到完整的行动JSON后立即关闭LLM流，不再等待推理模型在JSON之后继续输出的文本。
+# 默认关闭 (LLM_STOP_AFTER_JSON=1 开启)：JSON 之后的输出会被丢弃
+LLM_STOP_AFTER_JSON = os.environ.get("LLM_STOP_AFTER_JSON", "0") == "1"
+# 通过 response_format=json_schema 让服务器按行动JSON的模式约束解码 (不支持的端点自动回退)。
+# 推理模型在约束解码下可能无法输出 <think> 思考过程，因此默认关闭
+LLM_STRUCTURED_OUTPUT = os.environ.get("LLM_STRUCTURED_OUTPUT", "0") == "1"
+# 推理模型 <think> 思考过程的 token 预算 (0 表示不限制)。超出后 "nudge" 模式要求模型停止思考直接作答，"abort" 模式直接结束本次请求
+LLM_REASONING_BUDGET_TOKENS = int(os.environ.get("LLM_REASONING_BUDGET_TOKENS", "0"))
+LLM_REASONING_BUDGET_MODE = os.environ.get("LLM_REASONING_BUDGET_MODE", "nudge")
+# 超过该长度的README按Markdown章节分块，只把安装/依赖/配置/运行相关的片段并发发送给LLM提取，再合并结果 (代替截断)
+README_CHUNKED_EXTRACTION_MIN_CHARS = int(os.environ.get("README_CHUNKED_EXTRACTION_MIN_CHARS", "24000"))
+README_EXTRACTION_CHUNK_CHARS = int(os.environ.get("README_EXTRACTION_CHUNK_CHARS", "12000"))
+README_EXTRACTION_MAX_CHUNKS = int(os.environ.get("README_EXTRACTION_MAX_CHUNKS", "12"))
+README_EXTRACTION_CONCURRENCY = int(os.environ.get("README_EXTRACTION_CONCURRENCY", "3"))  # 同时进行的分块提取请求数
 
 DEFAULT_SYSTEM_PROMPT_TEMPLATE = (
     "你是一位精确、严谨、高效的AI自动化工程师，专注于为给定的项目自动配置Conda虚拟环境并安装所有必要的依赖。你的任务是分析项目信息和用户指令，然后生成一个结构化的JSON对象作为行动指令。不要有过多思考，尽快给出命令。"
@@ -35,12 +67,13 @@ DEFAULT_SYSTEM_PROMPT_TEMPLATE = (
     "\n  \"thought_summary\": \"(字符串, 可选但强烈推荐) 对你当前决策的详细中文总结。解释你为什么选择读取这些文件或执行这些命令，你的分析过程，以及你期望此步骤完成后达成的状态或下一步计划。如果配置完成，请明确说明。\",\n"
     "  \"files_to_read\": [\"(字符串数组, 可选) 相对于<PROJECT_ROOT_PATH_PLACEHOLDER>的文件路径列表。仅用于读取纯文本文件以获取配置信息 (如 requirements.txt, setup.py, pyproject.toml, .md, .yaml, .json, Dockerfile 等)。严禁请求读取二进制文件、大型数据文件或压缩包。如果你在本轮指定了要读取的文件，则`commands_to_execute`数组(如果提供)将被忽略，系统会先读取文件并将内容反馈给你，然后你再决定下一步。如果无需读取文件，则此键可省略或设置为空数组 `[]`。\"],你读取README全文一次后，接下来的三次操作内容不能再读取README。\n"
     "  \"commands_to_execute\": [ (对象数组, 可选) "
-    "\n    // 每个对象代表一条独立的、按顺序执行的shell命令。"
+    "\n    // 每个对象代表一条独立的shell命令。系统按数组顺序执行，但会并行执行互不影响的只读检查命令 (如查看文件、版本) 和 `pip download`；修改环境或项目的命令总是等待之前的命令完成。"
     "\n    // 如果本轮指定了`files_to_read`，则此数组将被忽略，应设置为空数组 `[]` 或省略。"
     "\n    // 如果没有命令要执行（例如，等待文件读取结果，或配置已完成），则此键可省略或设置为空数组 `[]`。"
     "\n    { "
     "\n      \"command_line\": \"(字符串, 必需) 要执行的单行shell命令。每个逻辑操作应是数组中的一个独立命令对象，但是如果需要设置环境变量等必须一次执行多个命令的场景，可以使用 `;` 来连接，严禁使用 `&&` 连接多个逻辑命令。\",\n"
-    "      \"description\": \"(字符串, 必需, 中文) 对该命令目的的简短中文描述。\"\n"
+    "      \"description\": \"(字符串, 必需, 中文) 对该命令目的的简短中文描述。\",\n"
+    "      \"depends_on\": \"(整数数组, 可选) 该命令必须等待的更早命令在本数组中的下标 (从0开始)，例如检查下载结果的命令依赖下载命令。\"\n"
     "    }"
     "\n    // ... (更多命令对象) ... "
     "\n  ]\n"
@@ -84,6 +117,37 @@ DEFAULT_SYSTEM_PROMPT_TEMPLATE = (
     "\n--- 请严格按照上述指南和JSON结构规范生成你的唯一JSON响应 ---"
 )
 
+# 行动JSON的模式，与上面的“JSON对象结构规范”一致，用于结构化输出 (LLM_STRUCTURED_OUTPUT)
+ACTION_RESPONSE_SCHEMA = {
+    "name": "setup_action",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "thought_summary": {"type": "string"},
+            "files_to_read": {"type": "array", "items": {"type": "string"}},
+            "commands_to_execute": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"command_line": {"type": "string"}, "description": {"type": "string"},
+                                   "depends_on": {"type": "array", "items": {"type": "integer"}}},
+                    "required": ["command_line", "description"],
+                },
+            },
+            "files_to_write": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"path": {"type": "string"}, "content": {"type": "string"},
+                                   "description": {"type": "string"}},
+                    "required": ["path", "content"],
+                },
+            },
+        },
+        "required": ["thought_summary"],
+    },
+}
+
 # README提取专用系统提示
 README_EXTRACTION_SYSTEM_PROMPT = (
     "你是一个专门负责从项目README文件中提取关键信息的AI助手。你的任务是仔细阅读给定的README全文，然后识别并提取与项目【安装】、【配置】、【依赖】和【基本使用/运行方法】相关的所有重要文本片段。"
@@ -107,31 +171,111 @@ MAX_TOTAL_PROMPT_CHARS_APPROX = 100000
 MAX_CONVERSATION_HISTORY_CHARS = 80000
 MAX_LLM_OUTPUT_TOKENS = 12000
 MAX_LLM_RETRIES = 2
+# 对冲请求：每一步同时发出 N 个补全请求 (温度依次递增)，取第一个通过结构检查的结果并取消其余请求。1 表示关闭
+LLM_HEDGE_COUNT = max(1, int(os.environ.get("LLM_HEDGE_COUNT", "1")))
+LLM_HEDGE_TEMPERATURE_STEP = float(os.environ.get("LLM_HEDGE_TEMPERATURE_STEP", "0.2"))
+# 对冲请求整体的等待上限 (秒)：0 表示取 LLM 客户端读超时的 3 倍 (读超时只限制两次读取之间的间隔，不限制整个流式响应)
+LLM_HEDGE_TIMEOUT_SECONDS = float(os.environ.get("LLM_HEDGE_TIMEOUT_SECONDS", "0"))
 MAX_HISTORY_ITEMS = 70
+# 一批命令中互不依赖的命令 (只读检查、pip download 等) 最多同时执行的数量。1 表示严格按顺序执行
+COMMAND_SCHEDULER_WORKERS = max(1, int(os.environ.get("COMMAND_SCHEDULER_WORKERS", "4")))
+# 命令输出在内存中只保留开头和结尾 (与 format_history_entry 送入提示的片段一致)，完整输出写入每个配置会话的日志目录
+COMMAND_OUTPUT_HEAD_CHARS = 10000
+COMMAND_OUTPUT_TAIL_CHARS = 10000
+COMMAND_OUTPUT_LOG_DIR = os.environ.get("COMMAND_OUTPUT_LOG_DIR",
+                                        os.path.join(tempfile.gettempdir(), "agentic_env_setup_logs"))
+# 除当前会话外最多保留的旧会话日志目录数 (每次连接都会开始新会话)；-1 表示不清理
+COMMAND_OUTPUT_KEEP_SESSIONS = int(os.environ.get("COMMAND_OUTPUT_KEEP_SESSIONS",
+                                                  str(output_capture.DEFAULT_KEEP_SESSIONS)))
 
 # LLM提示总长度的硬性限制 (系统提示 + 用户输入部分)
 MAX_TOTAL_PROMPT_CHARS_HARD_LIMIT = 25000
 
+# 按 token 计算的提示预算：中文为主的系统提示和英文为主的命令输出，每字符对应的 token 数相差很大，按字符预算会严重偏离
+LLM_CONTEXT_WINDOW_TOKENS = int(os.environ.get("LLM_CONTEXT_WINDOW_TOKENS", "32768"))
+MIN_LLM_OUTPUT_TOKENS = int(os.environ.get("LLM_MIN_OUTPUT_TOKENS", "8192"))  # 提示再长也至少为输出保留的 token 数
+MAX_TOTAL_PROMPT_TOKENS = LLM_CONTEXT_WINDOW_TOKENS - MIN_LLM_OUTPUT_TOKENS
+LLM_TOKENIZER = os.environ.get("LLM_TOKENIZER", "approx")  # "approx" 或 "tiktoken"
+
+# 提示布局："classic" (动态信息代入系统提示，历史按类型分组) 或 "prefix_stable" (静态前缀 + 按时间追加，利于服务器端提示缓存复用)
+LLM_PROMPT_LAYOUT = os.environ.get("LLM_PROMPT_LAYOUT", "classic")
+PREFIX_STABLE_HISTORY_REFILL_RATIO = 0.7  # 前缀稳定模式下历史超出预算时，一次裁剪到预算的这个比例
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_very_secret_key_please_change_it_now_!@#$%^&*()_+'
 socketio = SocketIO(app, async_mode='threading')
 
 llm_client: Optional[llm.LLMClient] = None
+prompt_token_counter = token_counter.create_token_counter(LLM_TOKENIZER)
+llm_response_cache: Optional[llm_cache.LLMResponseCache] = None
+if LLM_CACHE_ENABLED:
+    try:
+        llm_response_cache = llm_cache.LLMResponseCache(LLM_CACHE_DIR, max_bytes=LLM_CACHE_MAX_BYTES)
+    except OSError as e:
+        print(f"[WARN] LLM响应缓存目录 '{LLM_CACHE_DIR}' 不可用，缓存已禁用: {e}")
 project_file_cache: Dict[str, str] = {}
 conversation_history: List[Dict[str, Any]] = []
+session_metrics = llm_metrics.SessionMetrics()  # 当前配置会话的LLM调用与命令执行耗时汇总
+# 当前配置会话的命令输出日志
+command_output_spill = output_capture.OutputSpillDirectory(COMMAND_OUTPUT_LOG_DIR, COMMAND_OUTPUT_KEEP_SESSIONS)
+command_block_ids = itertools.count(1)  # 命令输出块的编号，并行执行时界面据此把输出写入各自的块
+prefix_stable_history_cutoff = 0.0  # 前缀稳定模式下，早于该时间戳的历史记录已被整体丢弃
+last_llm_prompt_sent = ""  # 上一次发送的完整提示 (系统 + 用户)，用于统计与本次请求共享的前缀长度
 initial_readme_summary_for_llm: Optional[str] = None  # 现在存储的是提取后的JSON字符串或错误信息
 
 
+def record_llm_call_metrics(call_metrics: Dict[str, Any]):
+    session_metrics.record_call(call_metrics)
+    ttft = call_metrics.get("ttft")
+    speed = call_metrics.get("tokens_per_sec")
+    print(f"LLM_METRICS: endpoint={call_metrics.get('endpoint')} prompt_chars={call_metrics.get('prompt_chars')} "
+          f"prompt_tokens={call_metrics.get('prompt_tokens')} ttft={f'{ttft:.2f}s' if ttft is not None else 'N/A'} "
+          f"total={call_metrics.get('total_time', 0.0):.2f}s deltas={call_metrics.get('delta_count')} "
+          f"tokens/s={f'{speed:.1f}' if speed else 'N/A'} finish={call_metrics.get('finish_reason')}")
+
+
+def action_stream_options() -> Dict[str, Any]:
+    """生成行动JSON的请求 (普通与对冲模式) 共用的 get_response_stream 参数。"""
+    return {"stop_after_json": LLM_STOP_AFTER_JSON,
+            "response_schema": ACTION_RESPONSE_SCHEMA if LLM_STRUCTURED_OUTPUT else None,
+            "reasoning_budget": LLM_REASONING_BUDGET_TOKENS or None,
+            "reasoning_budget_mode": LLM_REASONING_BUDGET_MODE}
+
+
+def emit_llm_stream_tokens(sid: str, splitter: stream_json.ReasoningSplitter, chunk: Optional[str] = None):
+    """把LLM输出按思考/正文拆分后推送到界面，kind 为 "reasoning" 或 "content"；chunk 为 None 时推送暂存的尾部文本。"""
+    segments = splitter.feed(chunk) if chunk is not None else splitter.flush()
+    for kind, text in segments:
+        socketio.emit('llm_general_stream', {'token': text, 'kind': kind}, room=sid, namespace='/')
+
+
+def emit_llm_metrics(sid: str, call_metrics: Optional[Dict[str, Any]] = None):
+    if call_metrics is None and llm_client:
+        call_metrics = llm_client.last_call_metrics
+    socketio.emit('llm_metrics', {'call': call_metrics,
+                                  'session': session_metrics.summary()}, room=sid, namespace='/')
+
+
 def initialize_llm_client(system_prompt_template: str, sid: Optional[str] = None) -> bool:
     global llm_client, project_file_cache, conversation_history, initial_readme_summary_for_llm
+    global prefix_stable_history_cutoff, last_llm_prompt_sent, session_metrics, command_output_spill
     project_file_cache = {}
     conversation_history = []
+    prefix_stable_history_cutoff = 0.0
+    last_llm_prompt_sent = ""
+    session_metrics = llm_metrics.SessionMetrics()
+    command_output_spill = output_capture.OutputSpillDirectory(COMMAND_OUTPUT_LOG_DIR, COMMAND_OUTPUT_KEEP_SESSIONS)
     initial_readme_summary_for_llm = None
     try:
         llm_client = llm.LLMClient(api_key=LLM_API_KEY, model_name=LLM_MODEL_NAME, base_url=LLM_BASE_URL,
                                    system_prompt=system_prompt_template,
-                                   max_history_turns=0)  # 主LLM客户端历史由我们自己管理
+                                   max_history_turns=0,  # 主LLM客户端历史由我们自己管理
+                                   pool_maxsize=LLM_HTTP_POOL_MAXSIZE,
+                                   response_cache=llm_response_cache,
+                                   metrics_callback=record_llm_call_metrics)
         msg = f"LLM客户端已使用模型 {LLM_MODEL_NAME} 初始化。"
+        if llm_client.router:
+            msg += f" 共 {len(llm_client.router.base_urls)} 个推理端点，按延迟与负载自动分配。"
         print(msg if not sid else f"SID {sid}: {msg}")
         if sid: socketio.emit('status_update', {'message': msg, 'type': 'info'}, room=sid, namespace='/')
         return True
@@ -145,6 +289,85 @@ def initialize_llm_client(system_prompt_template: str, sid: Optional[str] = None
 initialize_llm_client(DEFAULT_SYSTEM_PROMPT_TEMPLATE)
 
 
+def create_auxiliary_llm_client(system_prompt: str) -> llm.LLMClient:
+    """创建与主客户端配置相同的独立LLMClient (共享连接池、端点路由、缓存和指标)，供并发请求使用，避免多个线程修改同一客户端的状态。"""
+    return llm.LLMClient(api_key=LLM_API_KEY, model_name=LLM_MODEL_NAME, base_url=LLM_BASE_URL,
+                         system_prompt=system_prompt, max_history_turns=0, pool_maxsize=LLM_HTTP_POOL_MAXSIZE,
+                         response_cache=llm_response_cache, metrics_callback=record_llm_call_metrics)
+
+
+def extract_readme_chunk_with_llm(readme_filename: str, chunk: Dict[str, Any], chunk_index: int,
+                                  total_chunks: int) -> Optional[Dict[str, Any]]:
+    """提取单个README片段。每个片段使用独立的LLMClient，不必切换全局客户端的系统提示。"""
+    chunk_client = create_auxiliary_llm_client(README_EXTRACTION_SYSTEM_PROMPT)
+    headings = "、".join(chunk["headings"]) or "开头简介"
+    chunk_prompt = (f"README 文件名: '{readme_filename}' (第 {chunk_index + 1}/{total_chunks} 个片段，所含章节: {headings})\n"
+                    f"README 片段如下:\n```markdown\n{chunk['text']}\n```\n"
+                    "这只是README的一部分，请只根据此片段提取关键信息，片段中没有涉及的字段直接省略。")
+    accumulated_text = ""
+    for event_type, content_chunk in chunk_client.get_response_stream(
+            chunk_prompt, temperature=0.0,
+            max_tokens=compute_max_output_tokens(README_EXTRACTION_SYSTEM_PROMPT, chunk_prompt,
+                                                 MAX_LLM_OUTPUT_TOKENS // 2)):
+        if event_type == "delta_content" and content_chunk is not None:
+            accumulated_text += content_chunk
+        elif event_type == "error":
+            print(f"[WARN] README片段 {chunk_index + 1}/{total_chunks} 提取失败: {content_chunk}")
+            return None
+        elif event_type == "stream_end":
+            break
+    extracted_json_str = extract_json_from_llm_response(accumulated_text)
+    if not extracted_json_str:
+        return None
+    try:
+        parsed = json.loads(extracted_json_str)
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def extract_readme_info_chunked(sid: str, readme_full_content: str, readme_filename: str) -> Optional[str]:
+    """
+    大README的 map-reduce 提取：按Markdown章节分块，只保留与安装/依赖/配置/运行相关的片段，
+    以有限并发 (README_EXTRACTION_CONCURRENCY) 分别提取后按原文顺序合并为同一JSON结构。所有片段都失败时返回 None。
+    """
+    chunks, skipped_sections = readme_chunking.build_extraction_chunks(
+        readme_full_content, max_chunk_chars=README_EXTRACTION_CHUNK_CHARS, max_chunks=README_EXTRACTION_MAX_CHUNKS)
+    if not chunks:
+        return None
+    selected_chars = sum(len(chunk["text"]) for chunk in chunks)
+    socketio.emit('status_update', {
+        'message': f"README '{readme_filename}' 较长({len(readme_full_content)} chars)，按章节分为 {len(chunks)} 个片段"
+                   f"(共 {selected_chars} chars，跳过 {skipped_sections} 个无关章节/片段)，并发提取中...",
+        'type': 'info'}, room=sid, namespace='/')
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(chunks)
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max(1, README_EXTRACTION_CONCURRENCY)) as pool:
+        futures = {pool.submit(extract_readme_chunk_with_llm, readme_filename, chunk, index, len(chunks)): index
+                   for index, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                print(f"[WARN] README片段 {index + 1}/{len(chunks)} 提取异常: {e}")
+            completed += 1
+            socketio.emit('status_update', {
+                'message': f"README片段提取进度: {completed}/{len(chunks)}"
+                           + ("" if results[index] is not None else f" (片段 {index + 1} 未得到有效JSON)"),
+                'type': 'info' if results[index] is not None else 'warning'}, room=sid, namespace='/')
+
+    partials = [result for result in results if result is not None]
+    if not partials:
+        return None
+    merged = readme_chunking.merge_extraction_results(partials, total_chunks=len(chunks))
+    socketio.emit('status_update', {
+        'message': f"成功从 '{readme_filename}' 分块提取并合并结构化信息 ({len(partials)}/{len(chunks)} 个片段)。",
+        'type': 'info'}, room=sid, namespace='/')
+    return json.dumps(merged, ensure_ascii=False)
+
+
 # 新增函数：使用LLM提取README信息
 def extract_readme_info_with_llm(sid: str, readme_full_content: str, readme_filename: str) -> str:
     global llm_client
@@ -154,6 +377,13 @@ def extract_readme_info_with_llm(sid: str, readme_full_content: str, readme_file
         return json.dumps(
             {"error": "LLM client not initialized.", "extraction_summary": "LLM客户端未初始化，无法提取信息。"})
 
+    if len(readme_full_content) > README_CHUNKED_EXTRACTION_MIN_CHARS:
+        chunked_result = extract_readme_info_chunked(sid, readme_full_content, readme_filename)
+        if chunked_result is not None:
+            return chunked_result
+        socketio.emit('status_update', {'message': f"README '{readme_filename}' 分块提取未得到有效结果，改为整体截断提取。",
+                                        'type': 'warning'}, room=sid, namespace='/')
+
     # 确保README内容不会超长到让提取LLM崩溃
     max_readme_len_for_extraction = 40000
     if len(readme_full_content) > max_readme_len_for_extraction:
@@ -178,7 +408,9 @@ def extract_readme_info_with_llm(sid: str, readme_full_content: str, readme_file
     try:
         temp_conv_hist_for_extraction = []
         for event_type, content_chunk in llm_client.get_response_stream(
-                extraction_prompt, max_tokens=MAX_LLM_OUTPUT_TOKENS // 2, temperature=0.0):
+                extraction_prompt, temperature=0.0,
+                max_tokens=compute_max_output_tokens(README_EXTRACTION_SYSTEM_PROMPT, extraction_prompt,
+                                                     MAX_LLM_OUTPUT_TOKENS // 2)):
             if event_type == "delta_content" and content_chunk is not None:
                 accumulated_extraction_text += content_chunk
             elif event_type == "error":
@@ -187,6 +419,11 @@ def extract_readme_info_with_llm(sid: str, readme_full_content: str, readme_file
                 break
         if not accumulated_extraction_text.strip():
             raise Exception("LLM提取返回为空。")
+        if llm_client.last_response_from_cache and llm_response_cache:
+            cache_stats = llm_response_cache.stats()
+            socketio.emit('status_update', {
+                'message': f"README提取结果命中本地缓存 (命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']})。",
+                'type': 'info'}, room=sid, namespace='/')
     except Exception as e:
         error_msg = f"使用LLM提取 '{readme_filename}' 信息时发生错误: {e}"
         socketio.emit('error_message', {'message': error_msg, 'type': 'error'}, room=sid, namespace='/')
@@ -232,6 +469,158 @@ def extract_readme_info_with_llm(sid: str, readme_full_content: str, readme_file
         })
 
 
+def compute_max_output_tokens(system_prompt: str, user_input: str, upper_limit: int = MAX_LLM_OUTPUT_TOKENS) -> int:
+    """根据提示实际占用的 token 数计算本次请求的 max_tokens，保证提示 + 输出不超过模型上下文窗口。"""
+    prompt_tokens = token_counter.count_message_tokens(
+        prompt_token_counter, [{"content": system_prompt}, {"content": user_input}])
+    return max(1, min(upper_limit, LLM_CONTEXT_WINDOW_TOKENS - prompt_tokens))
+
+
+def format_history_entry(entry: Dict[str, Any], default_env_name: str) -> str:
+    """把一条对话历史格式化为提示文本；同一条记录每次格式化的结果完全相同 (便于 token 计数缓存和服务器端前缀缓存复用)。"""
+    max_cmd_output_snippet = 20000  # 保持不变
+    entry_str = ""
+    entry_type = entry.get("type")
+    content = entry.get("content")
+    env_name_hist = entry.get("env_name_at_time", default_env_name)
+
+    if entry_type == "command_execution_result" and isinstance(content, dict):
+        stdout_s = str(content.get('stdout', ''))
+        stderr_s = str(content.get('stderr', ''))
+        if len(stdout_s) > max_cmd_output_snippet: stdout_s = stdout_s[
+                                                              :max_cmd_output_snippet // 2] + "\n...\n(输出过长已截断)\n...\n" + stdout_s[
+                                                                                                                                 -max_cmd_output_snippet // 2:]
+        if len(stderr_s) > max_cmd_output_snippet: stderr_s = stderr_s[
+                                                              :max_cmd_output_snippet // 2] + "\n...\n(输出过长已截断)\n...\n" + stderr_s[
+                                                                                                                                 -max_cmd_output_snippet // 2:]
+        entry_str = (f"\n[上一个系统操作结果 - 命令执行]:\n"
+                     f"  命令: `{content.get('command_executed', 'N/A')}`\n"
+                     f"  工作目录: `{content.get('working_directory', '默认')}`\n"
+                     f"  返回码: {content.get('return_code', 'N/A')}\n"
+                     f"  标准输出:\n```text\n{stdout_s or '(无标准输出)'}\n```\n"
+                     f"  标准错误:\n```text\n{stderr_s or '(无标准错误)'}\n```\n")
+    elif entry_type == "user_input_to_llm" and isinstance(content, dict):
+        entry_str = f"\n[先前发送给你的指令上下文 (当时目标环境: '{env_name_hist}')]:\n{content.get('context_summary', '无总结')}\n"
+    elif entry_type == "llm_structured_output" and isinstance(content, dict):
+        summary = content.get('thought_summary', '(无总结)')
+        files_req = content.get('files_to_read', [])
+        cmds_req = content.get('commands_to_execute', [])
+        files_write_req = content.get('files_to_write', [])  # +++ Added for history +++
+        entry_str = f"\n[你之前的JSON响应 (当时目标环境: '{env_name_hist}')]:\n  思考总结: {summary}\n"
+        if files_req: entry_str += f"  请求读取文件: {files_req}\n"
+        if files_write_req: entry_str += f"  请求写入文件: {[fw.get('path', 'N/A') for fw in files_write_req if isinstance(fw, dict)]}\n"  # +++ Added for history +++
+        if cmds_req: entry_str += f"  请求执行命令: {[c.get('command_line', 'N/A') for c in cmds_req if isinstance(c, dict)]}\n"
+    elif entry_type == "llm_raw_unparsable_output" and isinstance(content, str):
+        raw_output_snippet = content[:2000]  # 保持不变
+        if len(content) > 2000: raw_output_snippet += "\n...(原始输出过长已截断)...\n"
+        entry_str = f"\n[你先前未解析的原始输出 (这通常表示格式错误)]:\n```text\n{raw_output_snippet}\n```\n"
+    # +++ START OF NEW CODE for file_write_result history +++
+    elif entry_type == "file_write_result" and isinstance(content, dict):
+        filepath = content.get('filepath', 'N/A')
+        success = content.get('success', False)
+        message = content.get('message', '无消息')
+        entry_str = (f"\n[上一个系统操作结果 - 文件写入]:\n"
+                     f"  文件路径: `{filepath}`\n"
+                     f"  操作状态: {'成功' if success else '失败'}\n"
+                     f"  详细信息: {message}\n")
+    return entry_str
+
+
+def format_readme_summary_for_prompt(readme_summary: Optional[str]) -> str:
+    readme_placeholder_content = "未提供或未成功提取README信息。"
+    if readme_summary:
+        try:
+            parsed_readme_json = json.loads(readme_summary)
+            readme_placeholder_content = f"```json\n{json.dumps(parsed_readme_json, indent=2, ensure_ascii=False)}\n```"
+        except json.JSONDecodeError:
+            max_len_fallback_readme = 20000  # min(MAX_TOTAL_PROMPT_CHARS_HARD_LIMIT // 7, 20000)
+            if len(readme_summary) > max_len_fallback_readme:
+                readme_placeholder_content = readme_summary[:max_len_fallback_readme] + "\n...(README提取内容过长已截断)..."
+            else:
+                readme_placeholder_content = readme_summary
+    return readme_placeholder_content
+
+
+def build_prefix_stable_llm_input(
+        current_user_query_segment: str,
+        project_root: str,
+        env_name: str,
+        readme_summary: Optional[str]
+) -> Tuple[str, str]:
+    """
+    前缀稳定的提示布局 (LLM_PROMPT_LAYOUT=prefix_stable)，便于 llama.cpp / LM Studio 复用上一轮的 KV 缓存：
+    - 系统提示不再代入任何动态信息，每一步都逐字节相同；
+    - 用户消息开头是任务状态 (项目根目录、环境名、README摘要)，它们在克隆和README提取之后基本不再变化；
+    - 之后是按时间顺序排列的完整对话历史，新记录只追加在末尾，最后才是本步的指令；
+    - 超出预算时一次性丢弃一批最早的历史 (留出余量)，而不是每步丢弃一条，使前缀在之后若干步内保持不变。
+    """
+    global prefix_stable_history_cutoff
+    count_tokens = prompt_token_counter.count
+
+    HISTORY_HEADER_TEXT = "\n\n--- 对话历史回顾 (按时间顺序，最早的在前，包含关键信息和你的先前决策，请仔细阅读以保持上下文连贯性) ---\n"
+    TRUNCATION_MESSAGE = "(注意：为满足长度限制，较早的一部分对话历史已被省略。)\n"
+    CURRENT_QUERY_INTRO_TEXT = "\n\n--- 当前用户指令/反馈 (请基于此和上述历史及系统提示进行回应) ---\n"
+
+    final_system_prompt = DEFAULT_SYSTEM_PROMPT_TEMPLATE
+    for placeholder in ("<PROJECT_ROOT_PATH_PLACEHOLDER>", "<ENV_NAME_PLACEHOLDER>", "<README_CONTENT_PLACEHOLDER>"):
+        final_system_prompt = final_system_prompt.replace(placeholder, "见用户消息开头的“当前任务状态”")
+
+    task_state_str = ("--- 当前任务状态 ---"
+                      f"\n- **项目根目录**: {project_root or '当前未设置或未知'}"
+                      f"\n- **目标Conda环境名称**: {env_name or '当前未设置或未知'}"
+                      f"\n- **从README提取的关键信息**: {format_readme_summary_for_prompt(readme_summary)}")
+    current_query_block_str = CURRENT_QUERY_INTRO_TEXT + current_user_query_segment
+
+    fixed_tokens = (count_tokens(final_system_prompt) + count_tokens(task_state_str)
+                    + count_tokens(HISTORY_HEADER_TEXT) + count_tokens(TRUNCATION_MESSAGE)
+                    + 2 * token_counter.MESSAGE_OVERHEAD_TOKENS + 20)
+    query_budget = MAX_TOTAL_PROMPT_TOKENS - fixed_tokens
+    if count_tokens(current_query_block_str) > query_budget:
+        print("[CRITICAL WARNING] 前缀稳定模式: 当前指令超出提示预算，已截断。")
+        current_query_block_str = token_counter.truncate_to_tokens(
+            prompt_token_counter, current_query_block_str, max(query_budget - 30, 0)) + "\n...(当前指令过长，已被截断)...\n"
+    history_budget = query_budget - count_tokens(current_query_block_str)
+
+    history_parts: List[Tuple[float, str, int]] = []
+    for entry in conversation_history:
+        timestamp = entry.get("timestamp", 0.0)
+        if timestamp < prefix_stable_history_cutoff:
+            continue
+        entry_str = format_history_entry(entry, env_name)
+        if entry_str:
+            history_parts.append((timestamp, entry_str, count_tokens(entry_str)))
+
+    history_tokens = sum(part[2] for part in history_parts)
+    if history_tokens > history_budget:
+        # 一次丢到预算的 PREFIX_STABLE_HISTORY_REFILL_RATIO 以下，为后续若干步的新历史留出空间
+        target_tokens = int(history_budget * PREFIX_STABLE_HISTORY_REFILL_RATIO)
+        drop_count = 0
+        while drop_count < len(history_parts) and history_tokens > target_tokens:
+            history_tokens -= history_parts[drop_count][2]
+            drop_count += 1
+        history_parts = history_parts[drop_count:]
+        prefix_stable_history_cutoff = history_parts[0][0] if history_parts else time.time()
+        print(f"[INFO] 前缀稳定模式丢弃了 {drop_count} 条最早的历史记录。")
+
+    history_str = HISTORY_HEADER_TEXT
+    if prefix_stable_history_cutoff > 0:
+        history_str += TRUNCATION_MESSAGE
+    history_str += "".join(part[1] for part in history_parts)
+    return final_system_prompt, task_state_str + history_str + current_query_block_str
+
+
+def shared_prefix_length(previous: str, current: str) -> int:
+    """两段文本的公共前缀长度 (按切片二分比较，避免逐字符的 Python 循环)。"""
+    low, high = 0, min(len(previous), len(current))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if previous[:mid] == current[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
 def build_llm_input_for_client(
         current_user_query_segment: str,
         project_root_for_system_prompt: str,
@@ -239,6 +628,10 @@ def build_llm_input_for_client(
         readme_summary_for_system_prompt: Optional[str]
 ) -> Tuple[str, str]:
     global conversation_history
+    if LLM_PROMPT_LAYOUT == "prefix_stable":
+        return build_prefix_stable_llm_input(current_user_query_segment, project_root_for_system_prompt,
+                                             env_name_for_system_prompt, readme_summary_for_system_prompt)
+    count_tokens = prompt_token_counter.count
 
     HISTORY_HEADER_TEXT = "\n\n--- 对话历史回顾 (最近的交互在前，包含关键信息和你的先前决策，请仔细阅读以保持上下文连贯性) ---\n"
     CURRENT_QUERY_INTRO_TEXT = "\n--- 当前用户指令/反馈 (请基于此和上述历史及系统提示进行回应) ---\n"
@@ -252,50 +645,41 @@ def build_llm_input_for_client(
     final_system_prompt = final_system_prompt.replace("<ENV_NAME_PLACEHOLDER>",
                                                       env_name_for_system_prompt or "当前未设置或未知")
 
-    readme_placeholder_content = "未提供或未成功提取README信息。"
-    if readme_summary_for_system_prompt:
-        try:
-            parsed_readme_json = json.loads(readme_summary_for_system_prompt)
-            readme_placeholder_content = f"```json\n{json.dumps(parsed_readme_json, indent=2, ensure_ascii=False)}\n```"
-        except json.JSONDecodeError:
-            max_len_fallback_readme = 20000  # min(MAX_TOTAL_PROMPT_CHARS_HARD_LIMIT // 7, 20000)
-            if len(readme_summary_for_system_prompt) > max_len_fallback_readme:
-                readme_placeholder_content = readme_summary_for_system_prompt[
-                                             :max_len_fallback_readme] + "\n...(README提取内容过长已截断)..."
-            else:
-                readme_placeholder_content = readme_summary_for_system_prompt
-
+    readme_placeholder_content = format_readme_summary_for_prompt(readme_summary_for_system_prompt)
     final_system_prompt = final_system_prompt.replace("<README_CONTENT_PLACEHOLDER>", readme_placeholder_content)
-    len_sys_prompt = len(final_system_prompt)
+    # 以下预算均以 token 计 (系统消息和用户消息各有固定的 chat template 开销)
+    len_sys_prompt = count_tokens(final_system_prompt) + token_counter.MESSAGE_OVERHEAD_TOKENS
 
     current_query_block_str = CURRENT_QUERY_INTRO_TEXT + current_user_query_segment
-    len_current_query_block = len(current_query_block_str)
+    len_current_query_block = count_tokens(current_query_block_str) + token_counter.MESSAGE_OVERHEAD_TOKENS
 
-    budget_for_history_accumulator = MAX_TOTAL_PROMPT_CHARS_HARD_LIMIT - (len_sys_prompt + len_current_query_block)
+    budget_for_history_accumulator = MAX_TOTAL_PROMPT_TOKENS - (len_sys_prompt + len_current_query_block)
     history_accumulator_str = ""
 
-    if budget_for_history_accumulator < len(HISTORY_HEADER_TEXT) + len(NO_HISTORY_MESSAGE) + 50:
+    if budget_for_history_accumulator < count_tokens(HISTORY_HEADER_TEXT) + count_tokens(NO_HISTORY_MESSAGE) + 50:
         print(
-            f"[WARNING] SID {request.sid if request else 'N/A'}: 可用于历史记录的空间不足 (预算: {budget_for_history_accumulator} chars)。")
+            f"[WARNING] SID {request.sid if request else 'N/A'}: 可用于历史记录的空间不足 (预算: {budget_for_history_accumulator} tokens)。")
         history_accumulator_str = HISTORY_HEADER_TEXT + NO_HISTORY_MESSAGE
         if budget_for_history_accumulator < 0:
             print(
-                f"[CRITICAL WARNING] SID {request.sid if request else 'N/A'}: 系统提示和当前查询已超限 ({len_sys_prompt + len_current_query_block} > {MAX_TOTAL_PROMPT_CHARS_HARD_LIMIT}).")
-            if len_sys_prompt + len(
-                    CURRENT_QUERY_INTRO_TEXT) < MAX_TOTAL_PROMPT_CHARS_HARD_LIMIT:  # 尝试截断current_user_query_segment
-                max_len_current_query_segment = MAX_TOTAL_PROMPT_CHARS_HARD_LIMIT - len_sys_prompt - len(
-                    CURRENT_QUERY_INTRO_TEXT) - 10  # 10 for safety
-                if max_len_current_query_segment > 0 and len(
-                        current_user_query_segment) > max_len_current_query_segment:
-                    current_user_query_segment = current_user_query_segment[
-                                                 :max_len_current_query_segment] + "\n...(当前指令过长，已被截断)...\n"
+                f"[CRITICAL WARNING] SID {request.sid if request else 'N/A'}: 系统提示和当前查询已超限 ({len_sys_prompt + len_current_query_block} > {MAX_TOTAL_PROMPT_TOKENS} tokens).")
+            if len_sys_prompt + count_tokens(
+                    CURRENT_QUERY_INTRO_TEXT) < MAX_TOTAL_PROMPT_TOKENS:  # 尝试截断current_user_query_segment
+                max_tokens_current_query_segment = MAX_TOTAL_PROMPT_TOKENS - len_sys_prompt - count_tokens(
+                    CURRENT_QUERY_INTRO_TEXT) - token_counter.MESSAGE_OVERHEAD_TOKENS - 20  # 20 for safety
+                if max_tokens_current_query_segment > 0 and count_tokens(
+                        current_user_query_segment) > max_tokens_current_query_segment:
+                    current_user_query_segment = token_counter.truncate_to_tokens(
+                        prompt_token_counter, current_user_query_segment,
+                        max_tokens_current_query_segment) + "\n...(当前指令过长，已被截断)...\n"
                     current_query_block_str = CURRENT_QUERY_INTRO_TEXT + current_user_query_segment
             else:  # 连系统提示都放不下了，或者没有空间给当前指令
                 current_query_block_str = CURRENT_QUERY_INTRO_TEXT + "\n...(当前指令过长，且无足够空间显示，已被严重截断)...\n"
             return final_system_prompt, current_query_block_str
 
-    notice_lengths = [len(TRUNCATION_MESSAGE_OTHER), len(TRUNCATION_MESSAGE_CRITICAL), len(NO_HISTORY_MESSAGE)]
-    budget_for_history_content_actual = budget_for_history_accumulator - len(HISTORY_HEADER_TEXT) - max(
+    notice_lengths = [count_tokens(TRUNCATION_MESSAGE_OTHER), count_tokens(TRUNCATION_MESSAGE_CRITICAL),
+                      count_tokens(NO_HISTORY_MESSAGE)]
+    budget_for_history_content_actual = budget_for_history_accumulator - count_tokens(HISTORY_HEADER_TEXT) - max(
         notice_lengths) - 20
 
     if budget_for_history_content_actual <= 0:
@@ -304,54 +688,10 @@ def build_llm_input_for_client(
     else:
         llm_structured_outputs_formatted_recent_first = []
         other_history_items_formatted_recent_first = []
-        max_cmd_output_snippet = 20000  # 保持不变
 
         for entry in reversed(conversation_history):
-            entry_str = ""
             entry_type = entry.get("type")
-            content = entry.get("content")
-            env_name_hist = entry.get("env_name_at_time", env_name_for_system_prompt)
-
-            if entry_type == "command_execution_result" and isinstance(content, dict):
-                stdout_s = str(content.get('stdout', ''))
-                stderr_s = str(content.get('stderr', ''))
-                if len(stdout_s) > max_cmd_output_snippet: stdout_s = stdout_s[
-                                                                      :max_cmd_output_snippet // 2] + "\n...\n(输出过长已截断)\n...\n" + stdout_s[
-                                                                                                                                         -max_cmd_output_snippet // 2:]
-                if len(stderr_s) > max_cmd_output_snippet: stderr_s = stderr_s[
-                                                                      :max_cmd_output_snippet // 2] + "\n...\n(输出过长已截断)\n...\n" + stderr_s[
-                                                                                                                                         -max_cmd_output_snippet // 2:]
-                entry_str = (f"\n[上一个系统操作结果 - 命令执行]:\n"
-                             f"  命令: `{content.get('command_executed', 'N/A')}`\n"
-                             f"  工作目录: `{content.get('working_directory', '默认')}`\n"
-                             f"  返回码: {content.get('return_code', 'N/A')}\n"
-                             f"  标准输出:\n```text\n{stdout_s or '(无标准输出)'}\n```\n"
-                             f"  标准错误:\n```text\n{stderr_s or '(无标准错误)'}\n```\n")
-            elif entry_type == "user_input_to_llm" and isinstance(content, dict):
-                entry_str = f"\n[先前发送给你的指令上下文 (当时目标环境: '{env_name_hist}')]:\n{content.get('context_summary', '无总结')}\n"
-            elif entry_type == "llm_structured_output" and isinstance(content, dict):
-                summary = content.get('thought_summary', '(无总结)')
-                files_req = content.get('files_to_read', [])
-                cmds_req = content.get('commands_to_execute', [])
-                files_write_req = content.get('files_to_write', [])  # +++ Added for history +++
-                entry_str = f"\n[你之前的JSON响应 (当时目标环境: '{env_name_hist}')]:\n  思考总结: {summary}\n"
-                if files_req: entry_str += f"  请求读取文件: {files_req}\n"
-                if files_write_req: entry_str += f"  请求写入文件: {[fw.get('path', 'N/A') for fw in files_write_req if isinstance(fw, dict)]}\n"  # +++ Added for history +++
-                if cmds_req: entry_str += f"  请求执行命令: {[c.get('command_line', 'N/A') for c in cmds_req if isinstance(c, dict)]}\n"
-            elif entry_type == "llm_raw_unparsable_output" and isinstance(content, str):
-                raw_output_snippet = content[:2000]  # 保持不变
-                if len(content) > 2000: raw_output_snippet += "\n...(原始输出过长已截断)...\n"
-                entry_str = f"\n[你先前未解析的原始输出 (这通常表示格式错误)]:\n```text\n{raw_output_snippet}\n```\n"
-            # +++ START OF NEW CODE for file_write_result history +++
-            elif entry_type == "file_write_result" and isinstance(content, dict):
-                filepath = content.get('filepath', 'N/A')
-                success = content.get('success', False)
-                message = content.get('message', '无消息')
-                entry_str = (f"\n[上一个系统操作结果 - 文件写入]:\n"
-                             f"  文件路径: `{filepath}`\n"
-                             f"  操作状态: {'成功' if success else '失败'}\n"
-                             f"  详细信息: {message}\n")
-
+            entry_str = format_history_entry(entry, env_name_for_system_prompt)
             if entry_str:
                 if entry_type == "llm_structured_output":
                     llm_structured_outputs_formatted_recent_first.append(entry_str)
@@ -367,9 +707,10 @@ def build_llm_input_for_client(
         other_truncated = False
 
         for part in structured_history_parts_chronological:
-            if current_history_content_len + len(part) <= budget_for_history_content_actual:
+            part_tokens = count_tokens(part)  # 同一条历史在每次构建提示时文本不变，计数结果由 LRU 缓存复用
+            if current_history_content_len + part_tokens <= budget_for_history_content_actual:
                 final_history_content_parts.append(part)
-                current_history_content_len += len(part)
+                current_history_content_len += part_tokens
             else:
                 structured_truncated = True;
                 break
@@ -378,9 +719,10 @@ def build_llm_input_for_client(
             other_truncated = True
         else:
             for part in other_history_parts_chronological:
-                if current_history_content_len + len(part) <= budget_for_history_content_actual:
+                part_tokens = count_tokens(part)
+                if current_history_content_len + part_tokens <= budget_for_history_content_actual:
                     final_history_content_parts.append(part)
-                    current_history_content_len += len(part)
+                    current_history_content_len += part_tokens
                 else:
                     other_truncated = True;
                     break
@@ -407,43 +749,64 @@ def add_to_conversation_history(entry_type: str, content: Any, env_name_at_time:
         entry["env_name_at_time"] = env_name_at_time
     conversation_history.append(entry)
     if len(conversation_history) > MAX_HISTORY_ITEMS:
-        conversation_history = conversation_history[-MAX_HISTORY_ITEMS:]
+        # 前缀稳定模式下成批裁剪，避免之后每追加一条都从开头移除一条而破坏提示前缀
+        keep_items = int(MAX_HISTORY_ITEMS * PREFIX_STABLE_HISTORY_REFILL_RATIO) if LLM_PROMPT_LAYOUT == "prefix_stable" \
+            else MAX_HISTORY_ITEMS
+        conversation_history = conversation_history[-keep_items:]
 
 
-def stream_command_output(sid: str, command_input: Union[str, List[str]], working_dir: Optional[str] = None) -> Dict[
-    str, Any]:
+def stream_command_output(sid: str, command_input: Union[str, List[str]], working_dir: Optional[str] = None,
+                          block_id: Optional[int] = None) -> Dict[str, Any]:
     command_to_log_str: str
     if isinstance(command_input, list):
         command_to_log_str = subprocess.list2cmdline(command_input)
     else:
         command_to_log_str = command_input
-    socketio.emit('command_stream', {'type': 'command_start', 'command': command_to_log_str}, room=sid, namespace='/')
-    full_stdout_str, full_stderr_str, final_return_code = "", "", -1
+    block_fields = {'block_id': block_id} if block_id is not None else {}
+    socketio.emit('command_stream', {'type': 'command_start', 'command': command_to_log_str, **block_fields},
+                  room=sid, namespace='/')
+    stdout_capture = command_output_spill.new_capture("stdout", COMMAND_OUTPUT_HEAD_CHARS, COMMAND_OUTPUT_TAIL_CHARS)
+    stderr_capture = command_output_spill.new_capture("stderr", COMMAND_OUTPUT_HEAD_CHARS, COMMAND_OUTPUT_TAIL_CHARS)
+    final_return_code = -1
+    resource_usage: Optional[Dict[str, Any]] = None
+    command_started_at = time.monotonic()
     try:
         for stream_type, content in executor.execute_command_stream(command_input, working_directory=working_dir):
             if stream_type == 'stdout':
-                full_stdout_str += content;
-                socketio.emit('command_stream', {'type': 'stdout_chunk', 'chunk': content}, room=sid, namespace='/')
+                stdout_capture.write(content)
+                socketio.emit('command_stream', {'type': 'stdout_chunk', 'chunk': content, **block_fields},
+                              room=sid, namespace='/')
             elif stream_type == 'stderr':
-                full_stderr_str += content;
-                socketio.emit('command_stream', {'type': 'stderr_chunk', 'chunk': content}, room=sid, namespace='/')
+                stderr_capture.write(content)
+                socketio.emit('command_stream', {'type': 'stderr_chunk', 'chunk': content, **block_fields},
+                              room=sid, namespace='/')
+            elif stream_type == 'resource_usage':
+                resource_usage = content
             elif stream_type == 'return_code':
                 final_return_code = int(content)
             socketio.sleep(0.015)
         socketio.emit('command_stream',
-                      {'type': 'command_end', 'command': command_to_log_str, 'return_code': final_return_code},
-                      room=sid, namespace='/')
+                      {'type': 'command_end', 'command': command_to_log_str, 'return_code': final_return_code,
+                       'resource_usage': resource_usage, **block_fields}, room=sid, namespace='/')
     except Exception as e:
         error_line = f"stream_command_output error for '{command_to_log_str}': {e}";
         print(f"MAIN_PY ERROR: {error_line}")
-        socketio.emit('command_stream', {'type': 'stderr_chunk', 'chunk': error_line + "\n"}, room=sid, namespace='/');
-        full_stderr_str += error_line + "\n";
+        socketio.emit('command_stream', {'type': 'stderr_chunk', 'chunk': error_line + "\n", **block_fields},
+                      room=sid, namespace='/');
+        stderr_capture.write(error_line + "\n")
         final_return_code = -9999
         socketio.emit('command_stream',
-                      {'type': 'command_end', 'command': command_to_log_str, 'return_code': final_return_code},
-                      room=sid, namespace='/')
-    return {"stdout": full_stdout_str, "stderr": full_stderr_str, "return_code": final_return_code,
-            "command_executed": command_to_log_str, "working_directory": working_dir or os.getcwd()}
+                      {'type': 'command_end', 'command': command_to_log_str, 'return_code': final_return_code,
+                       **block_fields}, room=sid, namespace='/')
+    finally:
+        stdout_capture.close()
+        stderr_capture.close()
+    session_metrics.record_command(time.monotonic() - command_started_at, command_to_log_str, resource_usage)
+    return {"stdout": stdout_capture.text(), "stderr": stderr_capture.text(), "return_code": final_return_code,
+            "command_executed": command_to_log_str, "working_directory": working_dir or os.getcwd(),
+            "stdout_chars": stdout_capture.total_chars, "stderr_chars": stderr_capture.total_chars,
+            "stdout_log": stdout_capture.spill_path, "stderr_log": stderr_capture.spill_path,
+            "resource_usage": resource_usage}
 
 
 def extract_json_from_llm_response(raw_response: str) -> Optional[str]:
@@ -489,6 +852,131 @@ def extract_json_from_llm_response(raw_response: str) -> Optional[str]:
     return None
 
 
+def parse_llm_action_response(raw_response: str) -> Tuple[Optional[Dict[str, Any]], bool, Optional[str]]:
+    """
+    解析LLM的行动JSON并检查其结构是否可用：至少包含非空的 commands_to_execute / files_to_read / files_to_write，
+    或者只有 thought_summary (例如配置已完成)。返回 (解析出的对象, 是否有效, JSON解析错误信息)。
+    """
+    json_string_candidate = extract_json_from_llm_response(raw_response)
+    if not json_string_candidate:
+        return None, False, None
+    try:
+        json_object_parsed = json.loads(json_string_candidate)
+    except json.JSONDecodeError as e:
+        print(f"JSON解析失败: {e}. Candidate: '{json_string_candidate}'")
+        return None, False, str(e)
+    if not isinstance(json_object_parsed, dict):
+        return None, False, None
+
+    def non_empty_list(key: str) -> bool:
+        value = json_object_parsed.get(key)
+        return isinstance(value, list) and len(value) > 0
+
+    valid = non_empty_list("commands_to_execute") or non_empty_list("files_to_read") or \
+        non_empty_list("files_to_write") or bool(json_object_parsed.get("thought_summary"))
+    return json_object_parsed, valid, None
+
+
+def run_hedged_llm_requests(sid: str, system_prompt: str, user_input: str, max_tokens: int,
+                            hedge_count: int) -> Dict[str, Any]:
+    """
+    对同一步同时发出 hedge_count 个流式补全请求 (第 i 个的温度为 0.1 + i * LLM_HEDGE_TEMPERATURE_STEP，避免得到相同的错误输出)，
+    第一个通过 parse_llm_action_response 检查的结果胜出，协调线程随即中止其余请求的连接 (LLMClient.abort，推理服务器随之停止生成)。
+    最先输出内容的请求会实时推送到界面 (包括动作预览，但不预读文件：落选请求要读的文件可能根本不需要)；
+    胜出的若是另一个请求，则清空并重放其输出。
+    返回 {"text", "index", "metrics", "stopped_early", "reasoning_budget_exceeded", "error"}；没有有效结果时返回最先完成的那个，由调用方按原逻辑重试。
+    超过 LLM_HEDGE_TIMEOUT_SECONDS 仍没有有效结果时中止全部请求，没有任何请求完成则返回 index 为 None、带超时错误的空结果。
+    """
+    cancel_event = threading.Event()
+    results: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+    leader_lock = threading.Lock()
+    leader = {"index": None}
+    # 在启动线程之前创建全部客户端，协调线程才能在任何时刻中止落选请求 (包括尚未发出的)
+    clients = {index: create_auxiliary_llm_client(system_prompt) for index in range(hedge_count)}
+
+    def hedge_worker(index: int):
+        client = clients[index]
+        temperature = 0.1 + index * LLM_HEDGE_TEMPERATURE_STEP
+        text = ""
+        error = None
+        valid = False
+        action_parser = stream_json.StreamingActionParser()
+        display_splitter = stream_json.ReasoningSplitter()
+        stream = None
+        try:
+            stream = client.get_response_stream(user_input, temperature=temperature, max_tokens=max_tokens,
+                                                **action_stream_options())
+            for event_type, value in stream:
+                if cancel_event.is_set():
+                    break
+                if event_type == "delta_content" and value is not None:
+                    text += value
+                    with leader_lock:
+                        if leader["index"] is None:
+                            leader["index"] = index
+                    if leader["index"] == index:
+                        emit_llm_stream_tokens(sid, display_splitter, value)
+                        for action_kind, action_value in action_parser.feed(value):
+                            handle_streamed_action(sid, action_kind, action_value, None)
+                elif event_type == "error":
+                    error = value
+                    break
+                elif event_type == "stream_end":
+                    break
+            if leader["index"] == index and not cancel_event.is_set():
+                emit_llm_stream_tokens(sid, display_splitter)
+            if not cancel_event.is_set():
+                valid = parse_llm_action_response(text)[1]
+        except Exception as e:
+            error = error or str(e)
+        finally:
+            if stream is not None:
+                stream.close()
+            # 无论以何种方式结束都要报告结果，协调线程据此判断是否所有请求都已结束
+            results.put({"index": index, "text": text, "valid": valid and error is None, "error": error,
+                         "metrics": client.last_call_metrics, "stopped_early": client.last_stream_stopped_early,
+                         "reasoning_budget_exceeded": client.last_reasoning_budget_exceeded})
+
+    for index in range(hedge_count):
+        threading.Thread(target=hedge_worker, args=(index,), daemon=True).start()
+
+    hedge_timeout = LLM_HEDGE_TIMEOUT_SECONDS or clients[0].timeout * 3
+    deadline = time.monotonic() + hedge_timeout
+    finished: List[Dict[str, Any]] = []
+    winner: Optional[Dict[str, Any]] = None
+    while len(finished) < hedge_count:
+        try:
+            result = results.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            print(f"SID {sid}: hedged LLM request timed out after {hedge_timeout:.0f}s "
+                  f"({len(finished)}/{hedge_count} finished), aborting.")
+            break
+        finished.append(result)
+        if result["valid"]:
+            winner = result
+            break
+    cancel_event.set()
+    for index, client in clients.items():
+        if winner is None or index != winner["index"]:
+            client.abort()
+    if winner is None and finished:
+        winner = next((r for r in finished if r["text"].strip()), finished[0])
+    if winner is None:
+        winner = {"index": None, "text": "", "valid": False,
+                  "error": f"对冲请求在 {hedge_timeout:.0f} 秒内没有任何结果，已全部中止。", "metrics": None,
+                  "stopped_early": False, "reasoning_budget_exceeded": False}
+    if winner["index"] != leader["index"]:
+        socketio.emit('llm_stream_clear', {}, room=sid, namespace='/')
+        if winner["text"]:
+            replay_splitter = stream_json.ReasoningSplitter()
+            emit_llm_stream_tokens(sid, replay_splitter, winner["text"])
+            emit_llm_stream_tokens(sid, replay_splitter)
+    print(f"SID {sid}: hedged LLM request finished, winner "
+          f"#{winner['index'] + 1 if winner['index'] is not None else '-'}/{hedge_count} "
+          f"(valid={winner['valid']}, {len(finished)} finished before cancel)")
+    return winner
+
+
 def read_project_files(sid: str, project_root: str, relative_paths: List[str]) -> Dict[str, str]:
     global project_file_cache
     contents: Dict[str, str] = {};
@@ -593,6 +1081,19 @@ def read_project_files(sid: str, project_root: str, relative_paths: List[str]) -
     return contents
 
 
+def handle_streamed_action(sid: str, action_kind: str, action_value: Any, project_root: Optional[str]):
+    """
+    处理 StreamingActionParser 在流式输出过程中提前解析出的单个动作：推送给前端预览；
+    只读的文件请求在模型仍在输出时就预先读入 project_file_cache，命令和写文件仍要等完整JSON校验通过后才执行。
+    """
+    if action_kind == "object_complete":
+        return
+    socketio.emit('llm_action_preview', {'kind': action_kind, 'item': action_value}, room=sid, namespace='/')
+    if action_kind == "file_to_read" and project_root and isinstance(action_value, str) and action_value.strip():
+        if action_value.strip() not in project_file_cache:
+            read_project_files(sid, project_root, [action_value])
+
+
 @socketio.on('connect')
 def handle_connect():
     sid = request.sid
@@ -630,7 +1131,7 @@ def handle_update_system_prompt(data: Dict[str, str]):
 
 def process_setup_step(sid: str, step_data: Dict[str, Any], retry_count: int = 0):
     with app.app_context():
-        global initial_readme_summary_for_llm, project_file_cache
+        global initial_readme_summary_for_llm, project_file_cache, last_llm_prompt_sent
 
         git_url = step_data.get('git_url')
         if not git_url:
@@ -697,27 +1198,25 @@ def process_setup_step(sid: str, step_data: Dict[str, Any], retry_count: int = 0
 
             socketio.emit('status_update', {'message': f"项目将在本地: {project_cloned_root_path}", 'type': 'info'},
                           room=sid, namespace='/')
-            if os.path.exists(project_cloned_root_path):
-                socketio.emit('status_update', {'message': f"清理旧项目: {project_cloned_root_path}", 'type': 'info'},
-                              room=sid, namespace='/')
-                try:
-                    shutil.rmtree(project_cloned_root_path)
-                except Exception as e:
-                    socketio.emit('error_message', {'message': f"清理旧目录失败: {e}", 'type': 'error'}, room=sid,
-                                  namespace='/');
-                    return
-
-            socketio.emit('status_update', {'message': f"开始克隆: {git_url}...", 'type': 'info'}, room=sid,
-                          namespace='/')
-            git_cmd_list = ["git", "clone", git_url, project_cloned_root_path]
-            clone_res = stream_command_output(sid, git_cmd_list, os.getcwd())
+            # 已有的检出用 fetch + checkout + clean 增量刷新；否则删除旧目录，从按 URL 缓存的本地裸镜像克隆
+            mirror_cache = git_mirror.GitMirrorCache(
+                git_mirror.default_mirror_cache_dir(project_cloned_root_path),
+                lambda git_cmd_list, git_cwd: stream_command_output(sid, git_cmd_list, git_cwd or os.getcwd()))
+            socketio.emit('status_update', {
+                'message': f"开始准备仓库: {git_url} (克隆方式: {git_mirror.GIT_CLONE_MODE}，镜像缓存: {mirror_cache.cache_dir})...",
+                'type': 'info'}, room=sid, namespace='/')
+            clone_res = mirror_cache.prepare_workspace(git_url, project_cloned_root_path, git_mirror.GIT_CLONE_MODE)
             add_to_conversation_history("command_execution_result", clone_res, env_name_at_time=env_name)
             if clone_res.get('return_code', -1) != 0:
                 socketio.emit('error_message',
                               {'message': f"Git克隆失败: {clone_res.get('stderr', '未知错误')}", 'type': 'error'},
                               room=sid, namespace='/');
                 return
-            socketio.emit('status_update', {'message': "仓库克隆成功。", 'type': 'success'}, room=sid, namespace='/')
+            if clone_res.get('workspace_strategy') == "refreshed":
+                socketio.emit('status_update', {'message': "已将现有项目目录刷新到远程最新版本。", 'type': 'success'},
+                              room=sid, namespace='/')
+            else:
+                socketio.emit('status_update', {'message': "仓库克隆成功。", 'type': 'success'}, room=sid, namespace='/')
 
             dir_listing_content = "无法获取项目根目录的列表。"
             dir_command_to_execute_list = ["cmd", "/c", "dir"]
@@ -895,77 +1394,91 @@ def process_setup_step(sid: str, step_data: Dict[str, Any], retry_count: int = 0
 
         display_sys_prompt_len = len(final_system_prompt)
         display_user_input_len = len(full_user_input_with_history)
+        full_prompt_sent = final_system_prompt + "\x00" + full_user_input_with_history
+        shared_prefix_chars = shared_prefix_length(last_llm_prompt_sent, full_prompt_sent)
+        last_llm_prompt_sent = full_prompt_sent
         socketio.emit('llm_prompt_sent', {
+            'shared_prefix_chars': shared_prefix_chars,
+            'total_chars': len(full_prompt_sent),
             'prompt_head': final_system_prompt[:1000] + (
                 f"... (SysPrompt Total: {display_sys_prompt_len} chars)" if display_sys_prompt_len > 1000 else ""),
             'prompt_tail': (
                                f"... (UserInput Start, Total: {display_user_input_len} chars) ..." if display_user_input_len > 2000 else "") + full_user_input_with_history[
                                                                                                                                                -1000:]
         }, room=sid, namespace='/')
+        llm_max_output_tokens = compute_max_output_tokens(final_system_prompt, full_user_input_with_history)
         print(
-            f"SID {sid}: Sending prompt to LLM. System prompt length: {display_sys_prompt_len}, User input length: {display_user_input_len}, Total: {display_sys_prompt_len + display_user_input_len}")
+            f"SID {sid}: Sending prompt to LLM. System prompt length: {display_sys_prompt_len}, User input length: {display_user_input_len}, Total: {display_sys_prompt_len + display_user_input_len}, max_tokens: {llm_max_output_tokens}, "
+            f"shared prefix with previous prompt: {shared_prefix_chars} chars ({LLM_PROMPT_LAYOUT} layout)")
 
         socketio.emit('status_update', {'message': "请求LLM分析及指令...", 'type': 'info'}, room=sid, namespace='/')
         accumulated_llm_text = ""
+        action_parser = stream_json.StreamingActionParser()
         socketio.emit('llm_stream_clear', {}, room=sid, namespace='/')
-        try:
-            for event_type, content_chunk_val in llm_client.get_response_stream(
-                    full_user_input_with_history, max_tokens=MAX_LLM_OUTPUT_TOKENS, temperature=0.1):
-                if event_type == "delta_content" and content_chunk_val is not None:
-                    accumulated_llm_text += content_chunk_val
-                    socketio.emit('llm_general_stream', {'token': content_chunk_val}, room=sid, namespace='/');
-                    socketio.sleep(0.005)
-                elif event_type == "error":
-                    socketio.emit('error_message',
-                                  {'message': f"LLM流式响应错误: {content_chunk_val}", 'type': 'error'}, room=sid,
-                                  namespace='/');
-                    break
-                elif event_type == "stream_end":
-                    socketio.emit('status_update', {'message': "LLM流式响应接收完毕。", 'type': 'info'}, room=sid,
-                                  namespace='/');
-                    break
-        except Exception as e:
-            socketio.emit('error_message', {'message': f"LLM get_response_stream调用错误: {e}", 'type': 'error'},
-                          room=sid, namespace='/');
-            return
+        if LLM_HEDGE_COUNT > 1:
+            socketio.emit('status_update', {'message': f"对冲模式：同时发出 {LLM_HEDGE_COUNT} 个LLM请求，采用第一个有效结果。",
+                                            'type': 'info'}, room=sid, namespace='/')
+            hedge_result = run_hedged_llm_requests(sid, final_system_prompt, full_user_input_with_history,
+                                                   llm_max_output_tokens, LLM_HEDGE_COUNT)
+            accumulated_llm_text = hedge_result["text"]
+            if hedge_result["error"] and not accumulated_llm_text:
+                socketio.emit('error_message', {'message': f"LLM流式响应错误: {hedge_result['error']}", 'type': 'error'},
+                              room=sid, namespace='/')
+            else:
+                stream_end_message = f"LLM流式响应接收完毕 (采用第 {hedge_result['index'] + 1} 个对冲请求的结果)。"
+                if hedge_result["stopped_early"]:
+                    stream_end_message = f"已收到完整的行动JSON (第 {hedge_result['index'] + 1} 个对冲请求)，提前结束LLM流式响应。"
+                if hedge_result["reasoning_budget_exceeded"]:
+                    stream_end_message += f" 思考过程超出 {LLM_REASONING_BUDGET_TOKENS} token 预算，已被截断。"
+                socketio.emit('status_update', {'message': stream_end_message, 'type': 'info'}, room=sid, namespace='/')
+            emit_llm_metrics(sid, hedge_result["metrics"])
+        else:
+            display_splitter = stream_json.ReasoningSplitter()
+            try:
+                for event_type, content_chunk_val in llm_client.get_response_stream(
+                        full_user_input_with_history, temperature=0.1,
+                        max_tokens=llm_max_output_tokens,
+                        **action_stream_options()):
+                    if event_type == "delta_content" and content_chunk_val is not None:
+                        accumulated_llm_text += content_chunk_val
+                        emit_llm_stream_tokens(sid, display_splitter, content_chunk_val)
+                        for action_kind, action_value in action_parser.feed(content_chunk_val):
+                            handle_streamed_action(sid, action_kind, action_value, project_cloned_root_path)
+                        socketio.sleep(0.005)
+                    elif event_type == "error":
+                        socketio.emit('error_message',
+                                      {'message': f"LLM流式响应错误: {content_chunk_val}", 'type': 'error'}, room=sid,
+                                      namespace='/');
+                        break
+                    elif event_type == "stream_end":
+                        stream_end_message = "LLM流式响应接收完毕。"
+                        if llm_client.last_stream_stopped_early:
+                            stream_end_message = "已收到完整的行动JSON，提前结束LLM流式响应。"
+                        if llm_client.last_reasoning_budget_exceeded:
+                            stream_end_message += f" 思考过程超出 {LLM_REASONING_BUDGET_TOKENS} token 预算，已被截断。"
+                        socketio.emit('status_update', {'message': stream_end_message, 'type': 'info'}, room=sid,
+                                      namespace='/');
+                        break
+            except Exception as e:
+                socketio.emit('error_message', {'message': f"LLM get_response_stream调用错误: {e}", 'type': 'error'},
+                              room=sid, namespace='/');
+                return
+            emit_llm_stream_tokens(sid, display_splitter)
+            emit_llm_metrics(sid)
 
         if not accumulated_llm_text.strip():
             socketio.emit('status_update', {'message': "LLM响应为空。", 'type': 'warning'}, room=sid, namespace='/')
 
         socketio.emit('llm_raw_response_debug', {'raw_response': accumulated_llm_text}, room=sid, namespace='/')
-        json_string_candidate = extract_json_from_llm_response(accumulated_llm_text)
-        json_object_parsed: Optional[Dict[str, Any]] = None;
-        json_decode_error_occurred = False
-
-        if json_string_candidate:
-            try:
-                json_object_parsed = json.loads(json_string_candidate)
-            except json.JSONDecodeError as e:
-                json_decode_error_occurred = True;
-                print(f"SID {sid} JSON解析失败: {e}. Candidate: '{json_string_candidate}'")
-                socketio.emit('status_update', {'message': f"LLM响应JSON解析失败: {e}", 'type': 'warning'}, room=sid,
-                              namespace='/')
-        else:
-            json_decode_error_occurred = True
+        json_object_parsed, valid_json_structure, json_decode_error = parse_llm_action_response(accumulated_llm_text)
+        if json_decode_error:
+            socketio.emit('status_update', {'message': f"LLM响应JSON解析失败: {json_decode_error}", 'type': 'warning'},
+                          room=sid, namespace='/')
 
-        has_cmds_key = "commands_to_execute" in (json_object_parsed or {})
         cmds_list = json_object_parsed.get("commands_to_execute", []) if json_object_parsed else []
-        has_valid_cmds = has_cmds_key and isinstance(cmds_list, list) and len(cmds_list) > 0
-
-        has_files_key = "files_to_read" in (json_object_parsed or {})
         files_list = json_object_parsed.get("files_to_read", []) if json_object_parsed else []
-        has_valid_files = has_files_key and isinstance(files_list, list) and len(files_list) > 0
-
-        has_files_to_write_key = "files_to_write" in (json_object_parsed or {})
         files_to_write_list = json_object_parsed.get("files_to_write", []) if json_object_parsed else []
-        has_valid_files_to_write = has_files_to_write_key and isinstance(files_to_write_list, list) and len(
-            files_to_write_list) > 0
-        has_thought = bool(json_object_parsed and json_object_parsed.get("thought_summary"))
-        is_thought_only_valid = has_thought and not has_valid_cmds and not has_valid_files and not has_valid_files_to_write  # +++ Modified +++
-
-        valid_json_structure = not json_decode_error_occurred and json_object_parsed is not None and \
-                               (
-                                           has_valid_cmds or has_valid_files or is_thought_only_valid or has_valid_files_to_write)  # +++ Modified +++
+        has_valid_files_to_write = isinstance(files_to_write_list, list) and len(files_to_write_list) > 0
 
         if not valid_json_structure:
             if retry_count < MAX_LLM_RETRIES:
@@ -1009,8 +1522,9 @@ def process_setup_step(sid: str, step_data: Dict[str, Any], retry_count: int = 0
                                    'type': 'warning'}, room=sid,
                                   namespace='/')
 
-        actual_commands_to_run: List[Tuple[str, str]] = []
-        for cmd_obj in cmds_list:
+        actual_commands_to_run: List[Tuple[str, str, List[int]]] = []
+        kept_command_positions: Dict[int, int] = {}  # LLM数组中的下标 -> 保留后的下标，用于换算 depends_on
+        for cmd_position, cmd_obj in enumerate(cmds_list):
             if isinstance(cmd_obj, dict) and isinstance(cmd_obj.get("command_line"), str) and cmd_obj[
                 "command_line"].strip():
                 original_cmd = cmd_obj["command_line"]
@@ -1020,7 +1534,11 @@ def process_setup_step(sid: str, step_data: Dict[str, Any], retry_count: int = 0
                 if original_cmd != cleaned_cmd: socketio.emit('status_update',
                                                               {'message': f"警告：LLM命令含--cwd，已移除...",
                                                                'type': 'warning'}, room=sid, namespace='/')
-                if cleaned_cmd: actual_commands_to_run.append((cleaned_cmd, cmd_obj.get("description", "无描述")))
+                if cleaned_cmd:
+                    depends_on = cmd_obj.get("depends_on") if isinstance(cmd_obj.get("depends_on"), list) else []
+                    depends_on = [kept_command_positions[d] for d in depends_on if d in kept_command_positions]
+                    kept_command_positions[cmd_position] = len(actual_commands_to_run)
+                    actual_commands_to_run.append((cleaned_cmd, cmd_obj.get("description", "无描述"), depends_on))
             else:
                 socketio.emit('status_update',
                               {'message': f"警告：跳过格式不正确的命令对象: {cmd_obj}", 'type': 'warning'}, room=sid,
@@ -1100,11 +1618,14 @@ def process_setup_step(sid: str, step_data: Dict[str, Any], retry_count: int = 0
         # 如果没有读取和写入请求，处理暂存或新的命令执行请求
         current_commands_to_run_action = actual_commands_to_run or pending_commands_to_execute_next
         if current_commands_to_run_action:
-            last_cmd_res = {};
-            all_ok = True
-            for i, (cmd_str, desc) in enumerate(current_commands_to_run_action):
+            scheduled_commands = [{"command_line": entry[0], "description": entry[1],
+                                   "depends_on": entry[2] if len(entry) > 2 else []}
+                                  for entry in current_commands_to_run_action]
+
+            def run_scheduled_command(i: int, scheduled: Dict[str, Any]) -> Dict[str, Any]:
+                cmd_str, desc = scheduled["command_line"], scheduled["description"]
                 socketio.emit('status_update',
-                              {'message': f"执行 ({i + 1}/{len(current_commands_to_run_action)}): {cmd_str} ({desc})",
+                              {'message': f"执行 ({i + 1}/{len(scheduled_commands)}): {cmd_str} ({desc})",
                                'type': 'info'}, room=sid, namespace='/')
                 cmd_cwd = None
                 if not ("conda create" in cmd_str.lower() or "conda env create" in cmd_str.lower()):
@@ -1114,14 +1635,32 @@ def process_setup_step(sid: str, step_data: Dict[str, Any], retry_count: int = 0
                         socketio.emit('status_update',
                                       {'message': f"警告: 项目路径无效，命令将在默认目录执行。", 'type': 'warning'},
                                       room=sid, namespace='/')
-                last_cmd_res = stream_command_output(sid, cmd_str, working_dir=cmd_cwd)
-                add_to_conversation_history("command_execution_result", last_cmd_res, env_name_at_time=env_name)
-                if last_cmd_res.get('return_code', -1) != 0:
+                return stream_command_output(sid, cmd_str, working_dir=cmd_cwd, block_id=next(command_block_ids))
+
+            command_results = command_scheduler.run_command_dag(scheduled_commands, run_scheduled_command,
+                                                                max_workers=COMMAND_SCHEDULER_WORKERS)
+            last_cmd_res = {};
+            first_failed_res: Optional[Dict[str, Any]] = None
+            all_ok = True
+            skipped_commands = []
+            for scheduled, cmd_res in zip(scheduled_commands, command_results):  # 按原始顺序汇报结果
+                if cmd_res is None:
+                    skipped_commands.append(scheduled["command_line"])
+                    all_ok = False
+                    continue
+                add_to_conversation_history("command_execution_result", cmd_res, env_name_at_time=env_name)
+                last_cmd_res = cmd_res
+                if cmd_res.get('return_code', -1) != 0:
                     socketio.emit('error_message',
-                                  {'message': f"命令 '{cmd_str}' 执行失败 (RC: {last_cmd_res.get('return_code')})。",
+                                  {'message': f"命令 '{scheduled['command_line']}' 执行失败 (RC: {cmd_res.get('return_code')})。",
                                    'type': 'error'}, room=sid, namespace='/');
-                    all_ok = False;
-                    break
+                    all_ok = False
+                    first_failed_res = first_failed_res or cmd_res
+            if skipped_commands:
+                socketio.emit('status_update', {'message': f"因前面的命令失败，跳过 {len(skipped_commands)} 条命令: "
+                                                           f"{'; '.join(skipped_commands)}", 'type': 'warning'},
+                              room=sid, namespace='/')
+            last_cmd_res = first_failed_res or last_cmd_res
 
             next_step_data = next_step_data_base.copy()
             next_step_data['step_type'] = 'feedback'
@@ -1236,13 +1775,11 @@ if __name__ == '__main__':
     key_display = LLM_API_KEY[:5] + "..." if LLM_API_KEY and len(LLM_API_KEY) > 5 else (
         LLM_API_KEY if LLM_API_KEY else "未设置")
     print(f"LLM配置: 模型='{LLM_MODEL_NAME}', API Key='{key_display}', Base URL='{LLM_BASE_URL}'")
-    print(f"LLM提示硬性总长度限制: {MAX_TOTAL_PROMPT_CHARS_HARD_LIMIT} chars")
+    print(f"LLM提示硬性总长度限制: {MAX_TOTAL_PROMPT_TOKENS} tokens (上下文窗口 {LLM_CONTEXT_WINDOW_TOKENS} tokens，"
+          f"计数方式: {prompt_token_counter.name})")
     if 'llm' not in globals() or 'executor' not in globals():
         print("严重错误: llm.py 或 command_executor.py 未正确加载。")
     else:
         print(f"系统提示词模板长度 (不含动态部分): {len(DEFAULT_SYSTEM_PROMPT_TEMPLATE)} chars")
-        if platform.system() == "Windows":
-            executor.find_and_set_conda_paths()
-        else:
-            executor.find_and_set_conda_paths()
+        # Conda 路径在第一次执行命令时才解析 (executor.ensure_conda_paths)，并使用磁盘缓存，不拖慢服务器启动
         socketio.run(app, debug=True, host='0.0.0.0', port=5000, use_reloader=False, allow_unsafe_werkzeug=True)
\ No newline at end of file
@@ -0,0 +1,168 @@
+# output_capture.py
+
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+DEFAULT_HEAD_CHARS = 10000
+DEFAULT_TAIL_CHARS = 10000
+TRUNCATION_MARKER = "\n...\n(输出过长已截断)\n...\n"
+SESSION_DIR_PREFIX = "session-"
+DEFAULT_KEEP_SESSIONS = 10
+
+
+class CommandOutputCapture:
+    """
+    捕获一个命令输出流 (stdout 或 stderr)：内存中只保留开头 head_chars 个字符和最后 tail_chars 个字符 (环形缓冲)，
+    完整输出按 UTF-8 写入 spill_path，之后可以用 read() 按字节偏移随机读取。
+    内存占用与输出总量无关 (尾部缓冲最多多出一个输出块)；spill_path 为 None 或无法写入时只保留头尾。
+    """
+
+    def __init__(self, spill_path: Optional[str] = None, head_chars: int = DEFAULT_HEAD_CHARS,
+                 tail_chars: int = DEFAULT_TAIL_CHARS):
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.total_chars = 0
+        self.total_bytes = 0
+        self._head_parts: List[str] = []
+        self._head_len = 0
+        self._tail: Deque[str] = deque()
+        self._tail_len = 0
+        self.spill_path: Optional[str] = None
+        self._file = None
+        if spill_path:
+            try:
+                self._file = open(spill_path, "wb")
+                self.spill_path = spill_path
+            except OSError as e:
+                print(f"[WARN] 无法创建命令输出日志文件 '{spill_path}'，只保留输出的开头和结尾: {e}")
+
+    def write(self, text: str):
+        if not text:
+            return
+        self.total_chars += len(text)
+        if self._file is not None:
+            data = text.encode("utf-8", "replace")
+            self._file.write(data)
+            self.total_bytes += len(data)
+        room = self.head_chars - self._head_len
+        if room > 0:
+            self._head_parts.append(text[:room])
+            self._head_len += min(room, len(text))
+            text = text[room:]
+        if text:
+            self._tail.append(text)
+            self._tail_len += len(text)
+            while self._tail and self._tail_len - len(self._tail[0]) >= self.tail_chars:
+                self._tail_len -= len(self._tail.popleft())
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_chars > self.head_chars + self.tail_chars
+
+    def head(self) -> str:
+        return "".join(self._head_parts)
+
+    def tail(self) -> str:
+        text = "".join(self._tail)
+        return text[-self.tail_chars:] if self.truncated else text
+
+    def text(self) -> str:
+        """完整输出 (未超出头尾容量时) 或 开头 + 截断标记 + 结尾。"""
+        if not self.truncated:
+            return self.head() + "".join(self._tail)
+        return self.head() + TRUNCATION_MARKER + self.tail()
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def read(self, offset: int = 0, size: int = -1) -> str:
+        """从完整输出日志中按字节偏移读取；偏移落在多字节字符中间时边界处的字节以替换字符显示。"""
+        if self._file is not None:
+            self._file.flush()
+        if not self.spill_path:
+            return self.text()[offset:offset + size if size >= 0 else None]
+        return read_output_log(self.spill_path, offset, size)
+
+
+def read_output_log(path: str, offset: int = 0, size: int = -1) -> str:
+    with open(path, "rb") as f:
+        f.seek(max(0, offset))
+        return f.read(size).decode("utf-8", "replace")
+
+
+def prune_session_dirs(root_dir: str, keep: int, exclude: Optional[str] = None) -> int:
+    """
+    删除 root_dir 下较旧的会话日志目录，只保留最近修改的 keep 个 (exclude 指定的目录不删除也不计数)。
+    返回删除的目录数；keep 小于 0 时不做任何清理。
+    """
+    if keep < 0:
+        return 0
+    try:
+        entries = [entry for entry in os.scandir(root_dir)
+                   if entry.name.startswith(SESSION_DIR_PREFIX) and entry.is_dir(follow_symlinks=False)
+                   and entry.path != exclude]
+    except OSError:
+        return 0
+    sessions = []
+    for entry in entries:
+        try:
+            sessions.append((entry.stat(follow_symlinks=False).st_mtime, entry.path))
+        except OSError:
+            continue
+    sessions.sort(reverse=True)
+    removed = 0
+    for _, path in sessions[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+class OutputSpillDirectory:
+    """
+    一个配置会话的命令输出日志目录，每个捕获的输出流一个文件 (并行执行的命令互不交错)。
+    目录在第一次捕获时创建，同时清理 root_dir 下较旧的会话目录，加上本会话最多保留 keep_sessions + 1 个。
+    """
+
+    def __init__(self, root_dir: str, keep_sessions: int = DEFAULT_KEEP_SESSIONS):
+        self.root_dir = root_dir
+        self.keep_sessions = keep_sessions
+        self.path = os.path.join(root_dir, time.strftime(SESSION_DIR_PREFIX + "%Y%m%d-%H%M%S") +
+                                 f"-{os.getpid()}-{id(self):x}")
+        self._created = False
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._available = True
+
+    def new_capture(self, label: str, head_chars: int = DEFAULT_HEAD_CHARS,
+                    tail_chars: int = DEFAULT_TAIL_CHARS) -> CommandOutputCapture:
+        spill_path = None
+        with self._lock:
+            self._counter += 1
+            index = self._counter
+            if self._available and not self._created:
+                try:
+                    os.makedirs(self.path, exist_ok=True)
+                    self._created = True
+                except OSError as e:
+                    print(f"[WARN] 无法创建命令输出日志目录 '{self.path}': {e}")
+                    self._available = False
+                else:
+                    removed = prune_session_dirs(self.root_dir, self.keep_sessions, exclude=self.path)
+                    if removed:
+                        print(f"[INFO] Removed {removed} old command output log session(s) from '{self.root_dir}'.")
+        if self._available:
+            spill_path = os.path.join(self.path, f"{index:04d}-{label}.log")
+        return CommandOutputCapture(spill_path, head_chars, tail_chars)
+
+
+__all__ = ["CommandOutputCapture", "OutputSpillDirectory", "prune_session_dirs", "read_output_log",
+           "TRUNCATION_MARKER", "DEFAULT_HEAD_CHARS", "DEFAULT_TAIL_CHARS", "DEFAULT_KEEP_SESSIONS"]
@@ -0,0 +1,181 @@
+# output_reader.py
+
+import codecs
+import os
+import platform
+import queue
+import selectors
+import subprocess
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+DEFAULT_READ_SIZE = 64 * 1024          # 每次从管道读取的最大字节数 (复用同一块缓冲区)
+DEFAULT_COALESCE_CHARS = 32 * 1024     # 累积到这么多字符就立即产出
+DEFAULT_COALESCE_INTERVAL = 0.05       # 否则最多攒这么久 (秒) 再产出，保证界面上输出仍是"实时"的
+EXIT_POLL_INTERVAL = 0.25              # 没有输出时检查进程是否已退出的间隔
+
+
+class ProcessOutputReader:
+    """
+    读取子进程 stdout / stderr 的输出，产出 (stream_type, text)。
+
+    - Unix 上用 selectors (epoll/kqueue) 等待两个管道，就绪后用 os.readv 读入复用的大缓冲区；
+      Windows 上管道不支持 select，改为每个管道一个线程用 read1 读取原始字节，解码仍在调用方线程完成。
+    - 每个流一个 codecs 增量解码器，跨读取边界的多字节字符 (UTF-8 中文、GBK 等) 不会被截断成替换字符。
+    - 输出按大小或时间合并：同一流连续的文本攒到 coalesce_chars 或 coalesce_interval 后才产出，
+      换流时先产出之前攒下的内容，保持 stdout / stderr 的大致先后顺序。
+    - 进程已退出但管道仍被其孙进程持有时 (例如后台服务)，读完已有数据后结束，不会一直挂起。
+    """
+
+    def __init__(self, process: subprocess.Popen, encoding: str = "utf-8", errors: str = "replace",
+                 read_size: int = DEFAULT_READ_SIZE, coalesce_chars: int = DEFAULT_COALESCE_CHARS,
+                 coalesce_interval: float = DEFAULT_COALESCE_INTERVAL):
+        self.process = process
+        self.read_size = read_size
+        self.coalesce_chars = coalesce_chars
+        self.coalesce_interval = coalesce_interval
+        self._pipes = {name: pipe for name, pipe in (("stdout", process.stdout), ("stderr", process.stderr)) if pipe}
+        self._decoders = {name: codecs.getincrementaldecoder(encoding)(errors) for name in self._pipes}
+        self._pending: List[str] = []
+        self._pending_type: Optional[str] = None
+        self._pending_chars = 0
+        self._pending_since = 0.0
+        self.bytes_read = 0
+        self.bytes_by_stream = {name: 0 for name in self._pipes}
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        if platform.system() == "Windows":
+            return self._iter_threaded()
+        return self._iter_selectors()
+
+    # --- 合并 ---
+
+    def _add(self, stream_type: str, text: str) -> Iterator[Tuple[str, str]]:
+        if not text:
+            return
+        if self._pending_type is not None and self._pending_type != stream_type:
+            yield from self._flush()
+        if not self._pending:
+            self._pending_type = stream_type
+            self._pending_since = time.monotonic()
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars >= self.coalesce_chars:
+            yield from self._flush()
+
+    def _flush(self) -> Iterator[Tuple[str, str]]:
+        if self._pending:
+            text = "".join(self._pending)
+            stream_type = self._pending_type
+            self._pending, self._pending_type, self._pending_chars = [], None, 0
+            yield stream_type, text
+
+    def _wait_timeout(self) -> float:
+        if not self._pending:
+            return EXIT_POLL_INTERVAL
+        return max(0.0, self._pending_since + self.coalesce_interval - time.monotonic())
+
+    def _flush_if_due(self) -> Iterator[Tuple[str, str]]:
+        if self._pending and time.monotonic() - self._pending_since >= self.coalesce_interval:
+            yield from self._flush()
+
+    def _finish_stream(self, stream_type: str) -> Iterator[Tuple[str, str]]:
+        # 流结束时让解码器输出残留的不完整字节 (按 errors 策略处理)
+        yield from self._add(stream_type, self._decoders[stream_type].decode(b"", final=True))
+
+
+    # --- Unix: selectors ---
+
+    def _iter_selectors(self) -> Iterator[Tuple[str, str]]:
+        buffer = bytearray(self.read_size)
+        view = memoryview(buffer)
+        with selectors.DefaultSelector() as selector:
+            for stream_type, pipe in self._pipes.items():
+                selector.register(pipe.fileno(), selectors.EVENT_READ, stream_type)
+            exit_seen = False
+            while selector.get_map():
+                ready = selector.select(self._wait_timeout())
+                for key, _ in ready:
+                    stream_type = key.data
+                    try:
+                        size = os.readv(key.fd, [buffer])
+                    except OSError:
+                        size = 0
+                    if size:
+                        self.bytes_read += size
+                        self.bytes_by_stream[stream_type] += size
+                        yield from self._add(stream_type, self._decoders[stream_type].decode(view[:size]))
+                    else:
+                        selector.unregister(key.fd)
+                        yield from self._finish_stream(stream_type)
+                yield from self._flush_if_due()
+                if not ready and process_has_exited(self.process):
+                    if not exit_seen:
+                        # 再等一轮，读完进程退出前写入管道的数据
+                        exit_seen = True
+                        continue
+                    # 进程已退出且管道已读空：管道可能被孙进程继承而永远不会到达 EOF
+                    for key in list(selector.get_map().values()):
+                        selector.unregister(key.fd)
+                        yield from self._finish_stream(key.data)
+        yield from self._flush()
+
+    # --- Windows: 每个管道一个读取线程 ---
+
+    def _iter_threaded(self) -> Iterator[Tuple[str, str]]:
+        chunks: "queue.Queue[Tuple[str, Optional[bytes]]]" = queue.Queue()
+        threads = [threading.Thread(target=self._read_pipe_to_queue, args=(stream_type, pipe, chunks), daemon=True)
+                   for stream_type, pipe in self._pipes.items()]
+        for thread in threads:
+            thread.start()
+        streams_open = len(threads)
+        while streams_open > 0:
+            try:
+                stream_type, data = chunks.get(timeout=self._wait_timeout())
+            except queue.Empty:
+                yield from self._flush_if_due()
+                if self.process.poll() is not None and not any(thread.is_alive() for thread in threads) \
+                        and chunks.empty():
+                    break
+                continue
+            if data is None:
+                streams_open -= 1
+                yield from self._finish_stream(stream_type)
+            else:
+                self.bytes_read += len(data)
+                self.bytes_by_stream[stream_type] += len(data)
+                yield from self._add(stream_type, self._decoders[stream_type].decode(data))
+            yield from self._flush_if_due()
+        for thread in threads:
+            thread.join(timeout=0.5)
+        yield from self._flush()
+
+    def _read_pipe_to_queue(self, stream_type: str, pipe, chunks: "queue.Queue[Tuple[str, Optional[bytes]]]"):
+        read = getattr(pipe, "read1", pipe.read)
+        try:
+            for data in iter(lambda: read(self.read_size), b""):
+                chunks.put((stream_type, data))
+        except (OSError, ValueError):
+            pass
+        finally:
+            chunks.put((stream_type, None))
+
+
+def process_has_exited(process: subprocess.Popen) -> bool:
+    """检查子进程是否已退出。Unix 上用 WNOWAIT 只检查不回收，调用方之后仍可以用 os.wait4 取得它的资源使用 (rusage)。"""
+    if hasattr(os, "waitid") and process.returncode is None:
+        try:
+            return os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+        except ChildProcessError:
+            pass
+    return process.poll() is not None
+
+
+def read_process_output(process: subprocess.Popen, encoding: str = "utf-8", errors: str = "replace",
+                        **reader_options) -> Iterator[Tuple[str, str]]:
+    return iter(ProcessOutputReader(process, encoding, errors, **reader_options))
+
+
+__all__ = ["ProcessOutputReader", "read_process_output", "process_has_exited", "DEFAULT_READ_SIZE",
+           "DEFAULT_COALESCE_CHARS", "DEFAULT_COALESCE_INTERVAL"]
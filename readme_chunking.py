@@ -0,0 +1,134 @@
+# readme_chunking.py
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# README 提取结果中按片段合并的文本字段 (与 main.README_EXTRACTION_SYSTEM_PROMPT 中的结构一致)
+EXTRACTION_TEXT_FIELDS = ("installation_instructions", "configuration_details", "dependencies",
+                          "usage_examples", "other_relevant_info")
+
+# 章节标题或正文命中这些关键词时，认为该章节与安装/依赖/配置/运行相关
+RELEVANT_HEADING_KEYWORDS = (
+    "install", "setup", "set up", "requirement", "depend", "environment", "env", "conda", "pip", "docker",
+    "build", "compil", "getting started", "quick start", "quickstart", "usage", "run", "prerequisite",
+    "configur", "development", "from source", "how to use", "example", "cuda", "gpu",
+    "安装", "依赖", "环境", "配置", "使用", "运行", "快速开始", "快速上手", "开始", "部署", "编译", "准备", "示例",
+)
+RELEVANT_CONTENT_PATTERN = re.compile(
+    r"\b(pip3?\s+install|conda\s+(install|create|env)|python\s+-m\s+pip|poetry\s+install|apt(-get)?\s+install|"
+    r"brew\s+install|requirements[\w.-]*\.txt|environment\.ya?ml|setup\.py|pyproject\.toml|docker\s+(build|run)|"
+    r"python\s+[\w./-]+\.py|nvcc|cmake)", re.IGNORECASE)
+
+_ATX_HEADING_RE = re.compile(r"^ {0,3}(#{1,6})[ \t]+(.*?)[ \t#]*$")
+_FENCE_RE = re.compile(r"^ {0,3}(```|~~~)")
+
+
+def split_markdown_sections(text: str) -> List[Tuple[str, str]]:
+    """
+    按 Markdown ATX 标题 (# ~ ######) 把文本切成章节，返回 [(标题路径, 章节全文)]。
+    标题路径形如 "Installation > From source"；围栏代码块中的 '#' 行 (如 shell 注释) 不会被当作标题。
+    第一个标题之前的内容 (通常是项目简介) 作为标题为空的第一个章节。
+    """
+    sections: List[Tuple[str, str]] = []
+    heading_stack: List[Tuple[int, str]] = []
+    current_lines: List[str] = []
+    current_path = ""
+    in_fence: Optional[str] = None
+    for line in text.splitlines(keepends=True):
+        fence = _FENCE_RE.match(line)
+        if fence:
+            if in_fence is None:
+                in_fence = fence.group(1)
+            elif fence.group(1) == in_fence:
+                in_fence = None
+        heading = _ATX_HEADING_RE.match(line.rstrip("\r\n")) if in_fence is None and not fence else None
+        if heading:
+            if current_lines:
+                sections.append((current_path, "".join(current_lines)))
+            level = len(heading.group(1))
+            while heading_stack and heading_stack[-1][0] >= level:
+                heading_stack.pop()
+            heading_stack.append((level, heading.group(2).strip()))
+            current_path = " > ".join(title for _, title in heading_stack)
+            current_lines = [line]
+        else:
+            current_lines.append(line)
+    if current_lines:
+        sections.append((current_path, "".join(current_lines)))
+    return sections
+
+
+def is_relevant_section(heading_path: str, content: str) -> bool:
+    lowered = heading_path.lower()
+    if any(keyword in lowered for keyword in RELEVANT_HEADING_KEYWORDS):
+        return True
+    return bool(RELEVANT_CONTENT_PATTERN.search(content))
+
+
+def _split_oversized(content: str, max_chars: int) -> List[str]:
+    # 超长的单个章节按段落 (空行) 切分，段落本身仍超长时硬切
+    pieces: List[str] = []
+    current = ""
+    for paragraph in re.split(r"(?<=\n)\n", content):
+        while len(paragraph) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + len(paragraph) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += paragraph
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def build_extraction_chunks(text: str, max_chunk_chars: int = 12000, max_chunks: int = 12,
+                            intro_chars: int = 3000) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    选出与安装/依赖/配置/运行相关的章节，按原文顺序把相邻章节合并成不超过 max_chunk_chars 的片段。
+    开头的简介部分 (前 intro_chars 字符) 总是保留，便于模型了解项目概况。
+    返回 (片段列表 [{"headings": [...], "text": "..."}], 被跳过的章节数)。超过 max_chunks 时丢弃最后的片段。
+    """
+    sections = split_markdown_sections(text)
+    chunks: List[Dict[str, Any]] = []
+    skipped = 0
+    for index, (heading_path, content) in enumerate(sections):
+        if index == 0 and not heading_path:
+            content = content[:intro_chars]
+        elif not is_relevant_section(heading_path, content):
+            skipped += 1
+            continue
+        for piece in _split_oversized(content, max_chunk_chars):
+            if chunks and len(chunks[-1]["text"]) + len(piece) <= max_chunk_chars:
+                chunks[-1]["text"] += piece
+                if heading_path and heading_path not in chunks[-1]["headings"]:
+                    chunks[-1]["headings"].append(heading_path)
+            else:
+                chunks.append({"headings": [heading_path] if heading_path else [], "text": piece})
+    if len(chunks) > max_chunks:
+        skipped += len(chunks) - max_chunks
+        chunks = chunks[:max_chunks]
+    return chunks, skipped
+
+
+def merge_extraction_results(partials: List[Dict[str, Any]], total_chunks: int) -> Dict[str, Any]:
+    """按片段顺序合并各片段的提取结果：文本字段去重后用空行拼接，extraction_summary 汇总为一条说明。"""
+    merged: Dict[str, Any] = {}
+    for field in EXTRACTION_TEXT_FIELDS:
+        values: List[str] = []
+        for partial in partials:
+            value = partial.get(field)
+            if isinstance(value, list):
+                value = "\n".join(str(item) for item in value if item)
+            if isinstance(value, str) and value.strip() and value.strip() not in values:
+                values.append(value.strip())
+        if values:
+            merged[field] = "\n\n".join(values)
+    summaries = [p.get("extraction_summary").strip() for p in partials
+                 if isinstance(p.get("extraction_summary"), str) and p.get("extraction_summary").strip()]
+    merged["extraction_summary"] = (f"README 按章节分块提取，共 {total_chunks} 个片段，成功解析 {len(partials)} 个。"
+                                    + (" 各片段说明: " + " | ".join(summaries) if summaries else ""))
+    return merged
@@ -0,0 +1,120 @@
+# sse_parser.py
+
+import json
+from typing import Any, List, Optional
+
+_json_raw_decode = json.JSONDecoder().raw_decode
+
+
+class SSEParser:
+    """
+    增量式 Server-Sent Events 解析器。
+
+    feed() 接收网络上读到的原始字节块（可在任意位置被切断），返回本次已完整的事件 data 负载 (str，可直接交给 json.loads)。
+    - 原始字节追加到一个可复用的 bytearray 缓冲区，只按事件分隔符 (空行) 截取已完整的部分，未完成的事件留在缓冲区中；
+    - 每次 feed 只对已完整的区域做一次 UTF-8 解码（事件边界不会落在多字节字符中间），而不是逐行 decode/startswith/切片/strip；
+      绝大多数事件只有一行 "data: {...}"，走单次切片的快速路径。
+    - 支持 LF、CRLF 和单独 CR 的行结束符（CRLF 被切在两个块之间也能正确处理）。
+    - 同一事件内的多行 data: 按规范用 "\\n" 拼接；注释行 (":" 开头，常用作心跳) 以及 event/id/retry 字段被忽略。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pending_cr = False  # 上一个块以 CR 结尾，若下一个块以 LF 开头则二者是同一个 CRLF
+        self.events_parsed = 0
+
+    def feed(self, chunk: bytes) -> List[str]:
+        if not chunk:
+            return []
+        if self._pending_cr:
+            self._pending_cr = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+        if b"\r" in chunk:
+            # 统一为 LF，之后只需按 "\n\n" 查找事件边界
+            self._pending_cr = chunk.endswith(b"\r")
+            chunk = chunk.replace(b"\r\n", b"\n")
+            if b"\r" in chunk:  # 单独的 CR 很少见，只在确实存在时再做第二次替换
+                chunk = chunk.replace(b"\r", b"\n")
+        buf = self._buffer
+        buf += chunk
+        boundary = buf.rfind(b"\n\n")
+        if boundary == -1:
+            return []
+        newline_count = buf.count(b"\n", 0, boundary)  # 在字节上计数，比解码后的宽字符 str 快
+        starts_with_data = buf.startswith(b"data: ")
+        complete = buf[:boundary].decode("utf-8", errors="replace")
+        del buf[:boundary + 2]  # 原地压缩缓冲区，保留未完成的事件
+        payloads: List[str] = []
+        if starts_with_data:
+            payloads = complete.split("\n\ndata: ")
+            # 所有换行都属于事件分隔符，说明整段都是单行 "data: ..." 事件 (OpenAI 兼容服务器的常见情况)：
+            # 一次切分即得到全部负载，无需逐行处理
+            if newline_count == 2 * (len(payloads) - 1):
+                payloads[0] = payloads[0][6:]
+                self.events_parsed += len(payloads)
+                return payloads
+            payloads = []
+        for block in complete.split("\n\n"):
+            self._parse_block(block, payloads)
+        self.events_parsed += len(payloads)
+        return payloads
+
+    def flush(self) -> List[str]:
+        """流结束时调用：处理最后一个没有以空行结尾的事件。"""
+        payloads: List[str] = []
+        if self._buffer:
+            self._parse_block(self._buffer.decode("utf-8", errors="replace"), payloads)
+            self._buffer.clear()
+        self._pending_cr = False
+        self.events_parsed += len(payloads)
+        return payloads
+
+    @staticmethod
+    def _parse_block(block: str, payloads: List[str]):
+        data_lines: List[str] = []
+        for line in block.split("\n"):
+            if not line:  # 多余的空行同样是事件分隔符
+                if data_lines:
+                    payloads.append("\n".join(data_lines))
+                    data_lines = []
+                continue
+            if line[0] == ":":  # 注释行
+                continue
+            field, _, value = line.partition(":")
+            if field != "data":
+                continue  # event / id / retry 以及不认识的字段：当前用不到，忽略
+            if value[:1] == " ":
+                value = value[1:]
+            data_lines.append(value)
+        if data_lines:
+            payloads.append("\n".join(data_lines))
+
+    @staticmethod
+    def is_done_marker(payload: str) -> bool:
+        return len(payload) < 16 and payload.strip() == "[DONE]"
+
+
+def loads_payload(payload: str) -> Any:
+    """
+    解析一个 JSON 负载。直接复用预先构造的 JSONDecoder.raw_decode，省去 json.loads 每次调用的参数检查开销；
+    负载带前导空白或尾随内容时退回标准的 json.loads（出错时同样抛出 json.JSONDecodeError）。
+    """
+    try:
+        obj, end = _json_raw_decode(payload)
+        if end == len(payload):
+            return obj
+    except json.JSONDecodeError:
+        pass
+    return json.loads(payload)
+
+
+def split_events(data: bytes, chunk_size: Optional[int] = None) -> List[str]:
+    """便捷函数：把一段完整的 SSE 字节流（可选按 chunk_size 切块模拟网络读取）解析为全部 data 负载。"""
+    parser = SSEParser()
+    payloads: List[str] = []
+    step = chunk_size or len(data) or 1
+    for i in range(0, len(data), step):
+        payloads.extend(parser.feed(data[i:i + step]))
+    payloads.extend(parser.flush())
+    return payloads
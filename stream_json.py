@@ -0,0 +1,232 @@
+# stream_json.py
+
+import json
+from typing import Any, List, Optional, Tuple
+
+# 顶层动作对象中按元素增量输出的数组字段 -> 输出事件类型
+ACTION_ARRAY_KEYS = {
+    "commands_to_execute": "command",
+    "files_to_read": "file_to_read",
+    "files_to_write": "file_to_write",
+}
+# 顶层动作对象中完整后即输出的字符串字段 -> 输出事件类型
+ACTION_STRING_KEYS = {
+    "thought_summary": "thought_summary",
+}
+
+THINK_OPEN_TAG = "<think>"
+THINK_CLOSE_TAG = "</think>"
+
+
+class StreamingActionParser:
+    """
+    增量式动作 JSON 解析器，由 get_response_stream 的 delta_content 文本块驱动。
+
+    只跟踪 <think> 块之外的第一个顶层 JSON 对象：commands_to_execute / files_to_read / files_to_write 中的每个元素
+    在其对象（或字符串）闭合的那一刻就被解析并返回，不必等整个响应结束。
+    feed() 返回 [(事件类型, 值), ...]，事件类型为 "command"、"file_to_read"、"file_to_write"、"thought_summary"，
+    顶层对象闭合时额外返回 ("object_complete", 完整对象或 None)。
+    这里的结果只用于提前预览/预取，最终仍以 extract_json_from_llm_response 对完整文本的解析为准。
+    """
+
+    def __init__(self):
+        self._object_parts: List[str] = []  # 顶层对象开始以来的全部文本块，对象闭合时拼接一次
+        self._window = ""               # 仍可能被切片的尾部文本（从最早未闭合的元素/字符串开始）
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._in_think = False
+        self._tag_tail = ""             # 顶层对象外、可能被切断的 <think> / </think> 标签前缀
+        self._element_start = -1        # 当前数组元素在 _window 中的起始位置
+        self._string_start = -1         # 当前字符串在 _window 中的起始位置（含引号）
+        self._expect_key = False
+        self._current_key: Optional[str] = None
+        self._array_kind: Optional[str] = None  # 正在跟踪的数组字段对应的事件类型
+        self.completed = False
+        self.emitted_count = 0
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        if not chunk or self.completed:
+            return []
+        events: List[Tuple[str, Any]] = []
+        if self._depth == 0:
+            chunk = self._skip_outside_object(chunk)
+            if not chunk:
+                return events
+        self._object_parts.append(chunk)
+        i = len(self._window)
+        text = self._window + chunk
+        n = len(text)
+        while i < n:
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._on_string_end(text, i, events)
+                i += 1
+                continue
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == "{" or ch == "[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = True
+                elif self._depth == 2 and ch == "[" and self._current_key in ACTION_ARRAY_KEYS:
+                    self._array_kind = ACTION_ARRAY_KEYS[self._current_key]
+                elif self._depth == 3 and self._array_kind and ch == "{":
+                    self._element_start = i
+            elif ch == "}" or ch == "]":
+                self._depth -= 1
+                if self._depth == 2 and self._element_start != -1:
+                    self._emit_element(text[self._element_start:i + 1], events)
+                    self._element_start = -1
+                elif self._depth == 1:
+                    self._array_kind = None
+                elif self._depth <= 0:
+                    self._object_parts[-1] = chunk[:len(chunk) - (n - i - 1)]
+                    events.append(("object_complete", self._loads("".join(self._object_parts))))
+                    self.completed = True
+                    self._window = ""
+                    self._object_parts = []
+                    return events
+            elif ch == "," and self._depth == 1:
+                self._expect_key = True
+            i += 1
+        self._compact_window(text)
+        return events
+
+    def _compact_window(self, text: str):
+        # 只保留最早未闭合的元素/字符串开始之后的文本，避免每个块都复制整个对象
+        keep_from = len(text)
+        if self._element_start != -1:
+            keep_from = self._element_start
+        if self._in_string and self._string_start < keep_from:
+            keep_from = self._string_start
+        self._window = text[keep_from:]
+        if self._element_start != -1:
+            self._element_start -= keep_from
+        if self._in_string:
+            self._string_start -= keep_from
+
+    def _skip_outside_object(self, chunk: str) -> str:
+        """处理顶层对象之外的文本：跳过 <think> 块，返回从第一个 '{' 开始的部分（没有则返回空串）。"""
+        text = self._tag_tail + chunk
+        self._tag_tail = ""
+        pos = 0
+        while True:
+            if self._in_think:
+                close_at = text.find(THINK_CLOSE_TAG, pos)
+                if close_at == -1:
+                    self._tag_tail = self._partial_tag_suffix(text, THINK_CLOSE_TAG)
+                    return ""
+                self._in_think = False
+                pos = close_at + len(THINK_CLOSE_TAG)
+                continue
+            open_at = text.find(THINK_OPEN_TAG, pos)
+            brace_at = text.find("{", pos)
+            if brace_at != -1 and (open_at == -1 or brace_at < open_at):
+                return text[brace_at:]
+            if open_at == -1:
+                self._tag_tail = self._partial_tag_suffix(text, THINK_OPEN_TAG)
+                return ""
+            self._in_think = True
+            pos = open_at + len(THINK_OPEN_TAG)
+
+    @staticmethod
+    def _partial_tag_suffix(text: str, tag: str) -> str:
+        # 文本末尾若是标签的前缀（标签被切在两个块之间），保留下来与下一个块拼接
+        for size in range(min(len(tag) - 1, len(text)), 0, -1):
+            if tag.startswith(text[-size:]):
+                return text[-size:]
+        return ""
+
+    def _on_string_end(self, text: str, end: int, events: List[Tuple[str, Any]]):
+        if self._depth == 1:
+            value = self._loads(text[self._string_start:end + 1])
+            if self._expect_key:
+                self._current_key = value if isinstance(value, str) else None
+                self._expect_key = False
+            elif self._current_key in ACTION_STRING_KEYS and isinstance(value, str):
+                events.append((ACTION_STRING_KEYS[self._current_key], value))
+        elif self._depth == 2 and self._array_kind:
+            self._emit_element(text[self._string_start:end + 1], events)
+
+    def _emit_element(self, raw: str, events: List[Tuple[str, Any]]):
+        value = self._loads(raw)
+        if value is not None:
+            events.append((self._array_kind, value))
+            self.emitted_count += 1
+
+    @staticmethod
+    def _loads(raw: str) -> Any:
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            return None
+
+
+class ReasoningSplitter:
+    """
+    把流式文本增量拆分为思考过程 (<think> ... </think>) 和正文，标签本身被去掉，跨文本块切断的标签也能正确识别。
+    feed() 返回 [("reasoning" | "content", 文本), ...]。reasoning_tokens 按包含思考文本的 delta 数计数
+    (OpenAI 兼容服务器通常每个 token 一个 delta)，用于思考预算。
+    """
+
+    def __init__(self, max_reasoning_chars: int = 16000):
+        self.in_reasoning = False
+        self.reasoning_tokens = 0
+        self._tag_tail = ""
+        self._reasoning_parts: List[str] = []
+        self._reasoning_chars = 0
+        self._max_reasoning_chars = max_reasoning_chars  # 只保留思考文本的末尾部分，供续写请求使用
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        if not chunk:
+            return []
+        segments: List[Tuple[str, str]] = []
+        text = self._tag_tail + chunk
+        self._tag_tail = ""
+        pos = 0
+        while pos < len(text):
+            tag = THINK_CLOSE_TAG if self.in_reasoning else THINK_OPEN_TAG
+            tag_at = text.find(tag, pos)
+            if tag_at == -1:
+                self._tag_tail = StreamingActionParser._partial_tag_suffix(text[pos:], tag)
+                self._add_segment(segments, text[pos:len(text) - len(self._tag_tail)])
+                break
+            self._add_segment(segments, text[pos:tag_at])
+            self.in_reasoning = not self.in_reasoning
+            pos = tag_at + len(tag)
+        if any(kind == "reasoning" for kind, _ in segments):
+            self.reasoning_tokens += 1
+        return segments
+
+    def flush(self) -> List[Tuple[str, str]]:
+        """流结束时返回被暂存的、实际并非标签的尾部文本。"""
+        segments: List[Tuple[str, str]] = []
+        self._add_segment(segments, self._tag_tail)
+        self._tag_tail = ""
+        return segments
+
+    @property
+    def reasoning_text(self) -> str:
+        return "".join(self._reasoning_parts)
+
+    def _add_segment(self, segments: List[Tuple[str, str]], text: str):
+        if not text:
+            return
+        kind = "reasoning" if self.in_reasoning else "content"
+        if kind == "reasoning":
+            self._reasoning_parts.append(text)
+            self._reasoning_chars += len(text)
+            while self._reasoning_chars > self._max_reasoning_chars and len(self._reasoning_parts) > 1:
+                self._reasoning_chars -= len(self._reasoning_parts.pop(0))
+        if segments and segments[-1][0] == kind:
+            segments[-1] = (kind, segments[-1][1] + text)
+        else:
+            segments.append((kind, text))
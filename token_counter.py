@@ -0,0 +1,106 @@
+# token_counter.py
+
+import functools
+import re
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken  # 可选依赖：安装后可选用精确的 BPE 计数
+except ImportError:
+    tiktoken = None
+
+# 中日韩文字 (含全角标点)：Qwen / DeepSeek 等分词器中常用汉字基本是一字一 token，生僻字会更多，按 1 计
+_CJK_RE = re.compile("[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+_WORD_RE = re.compile(r"[A-Za-z]+")
+_DIGIT_RE = re.compile(r"[0-9]")
+# 连续的 ASCII 标点 (如 "==", "->", "://") 在 BPE 中通常合并为一个 token
+_PUNCT_RUN_RE = re.compile(r"[!-/:-@\[-`{-~]+")
+# 其余非 ASCII、非中日韩文字的字符 (其他语言文字、特殊符号等)，每个按 1 计
+_OTHER_RE = re.compile("[^\\x00-\\x7f\\s\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+_NEWLINE_RUN_RE = re.compile(r"\n+")
+
+# 每条聊天消息在 chat template 中额外占用的 token (角色标记、分隔符等)
+MESSAGE_OVERHEAD_TOKENS = 8
+
+
+class ApproxTokenCounter:
+    """
+    快速的本地近似分词计数，不依赖任何分词器文件。
+    按字符类别分别估算：中日韩文字每字 1 token，英文单词每 4 个字母约 1 token，数字逐位计数，连续的 ASCII 标点计 1 token，
+    其他字符每个 1 token，连续换行计 1 token。对中文提示和英文命令输出都偏保守 (略微高估)，再乘以 safety_factor 留出余量。
+    count() 按文本内容做 LRU 记忆化：对话历史中的同一条记录在每次构建提示时都会被重新计数，命中缓存即可直接返回。
+    count_uncached() 计数结果相同但不经过缓存，用于只会出现一次的文本 (如二分截断时的各个前缀)，避免把缓存中的历史记录挤出去。
+    """
+
+    name = "approx"
+
+    def __init__(self, safety_factor: float = 1.05, cache_size: int = 4096):
+        self.safety_factor = safety_factor
+        self.count = functools.lru_cache(maxsize=cache_size)(self.count_uncached)
+
+    def count_uncached(self, text: str) -> int:
+        if not text:
+            return 0
+        if text.isascii():
+            cjk = others = 0
+        else:
+            cjk = len(_CJK_RE.findall(text))
+            others = len(_OTHER_RE.findall(text))
+        words = sum((len(word) + 3) // 4 for word in _WORD_RE.findall(text))
+        digits = len(_DIGIT_RE.findall(text))
+        punctuation = len(_PUNCT_RUN_RE.findall(text))
+        newlines = len(_NEWLINE_RUN_RE.findall(text))
+        return int((cjk + others + words + digits + punctuation + newlines) * self.safety_factor) + 1
+
+
+class TiktokenCounter:
+    """
+    基于 tiktoken 的计数 (需安装 tiktoken)。编码与本地模型的分词器并不完全相同，但比近似计数更稳定。
+    与 ApproxTokenCounter 相同，提供带 LRU 缓存的 count() 和不经过缓存的 count_uncached()。
+    """
+
+    name = "tiktoken"
+
+    def __init__(self, encoding_name: str = "cl100k_base", cache_size: int = 4096):
+        if tiktoken is None:
+            raise ImportError("tiktoken 未安装，无法使用 TiktokenCounter。")
+        self._encoding = tiktoken.get_encoding(encoding_name)
+        self.count = functools.lru_cache(maxsize=cache_size)(self.count_uncached)
+
+    def count_uncached(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+def create_token_counter(name: Optional[str] = None):
+    """按名称创建计数器："approx" (默认) 或 "tiktoken"；tiktoken 不可用时退回近似计数。"""
+    if name == "tiktoken":
+        try:
+            return TiktokenCounter()
+        except (ImportError, ValueError) as e:
+            print(f"[WARN] 无法使用 tiktoken 计数，改用近似计数: {e}")
+    return ApproxTokenCounter()
+
+
+def count_message_tokens(counter, messages: List[Dict[str, str]]) -> int:
+    return sum(counter.count(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def truncate_to_tokens(counter, text: str, max_tokens: int) -> str:
+    """
+    返回 text 的最长前缀，使其 token 数不超过 max_tokens (二分查找前缀长度)。
+    各个候选前缀只会计数一次，用 count_uncached 计数，不占用 count() 的缓存。
+    """
+    if max_tokens <= 0:
+        return ""
+    if counter.count(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if counter.count_uncached(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]